@@ -41,5 +41,13 @@ def create_app(config_class=Config):
     # 7. Đăng ký Chatbot Blueprint
     from app.api.chat_routes import chat_bp
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
+
+    # 8. Warm-up model OCR (chỉ ở process OCR, các process khác load lazy khi cần)
+    if app.config.get('OCR_PRELOAD_MODELS'):
+        from app import ai_model
+        ai_model.warmup()
+        # Job còn dở từ lần chạy trước (process bị restart) -> đưa lại vào hàng đợi / đánh dấu failed
+        from app.services.ocr_job_service import OcrJobService
+        OcrJobService.recover_jobs(app)
     
     return app
\ No newline at end of file
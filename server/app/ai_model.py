@@ -1,53 +1,153 @@
 # app/ai_model.py
 import sys
 import os
-from app.my_ocr_core import InvoiceRecognizer 
-
-# Singleton Instance
-_real_ai_model = None
-
-def load_model():
-    global _real_ai_model
-    if _real_ai_model is None:
-        try:
-            current_file_path = os.path.abspath(__file__)
-            
-            app_dir = os.path.dirname(current_file_path)
-            
-            server_dir = os.path.dirname(app_dir)
-            
-            print(f" [Path Fix] Đang tìm model tại gốc: {server_dir}")
-            
-            _real_ai_model = InvoiceRecognizer(model_dir=server_dir)
-            
-        except Exception as e:
-            print(f" [CRITICAL] Không thể load AI Model: {e}")
-
-def process_ocr(image_path: str) -> str:
+import threading
+from config import Config
+from app import ocr_worker_pool
+from app.ocr_worker_pool import OcrPoolBusyError
+from app.utils.ocr_metrics import OcrJobStats
+
+# Lưu ý: KHÔNG import app.my_ocr_core ở đầu file.
+# Module đó kéo theo torch/paddleocr/transformers/vietocr (vài giây + hàng trăm MB RAM),
+# nên chỉ import khi thực sự cần chạy OCR để các worker API khác khởi động nhanh.
+
+# Singleton Instance: tier -> InvoiceRecognizer (các tier dùng chung LayoutLMv3)
+_real_ai_models = {}
+_load_lock = threading.Lock()
+
+def resolve_tier(tier=None):
+    """Tên tier hợp lệ (mặc định OCR_DEFAULT_TIER), tier lạ/chưa bật -> ValueError"""
+    tier = tier or Config.OCR_DEFAULT_TIER
+    if tier not in Config.OCR_TIERS or tier not in Config.OCR_ENABLED_TIERS:
+        raise ValueError(f"Tier OCR không hợp lệ: {tier} (hỗ trợ: {', '.join(Config.OCR_ENABLED_TIERS)})")
+    return tier
+
+def build_recognizer_kwargs(tier=None):
+    """Tham số khởi tạo InvoiceRecognizer lấy từ Config + profile của tier (dùng chung cho singleton và pool worker)"""
+    kwargs = {
+        "rec_batch_size": Config.OCR_REC_BATCH_SIZE,
+        "pdf_dpi": Config.OCR_PDF_DPI,
+        "layout_window": Config.OCR_LAYOUT_WINDOW,
+        "layout_stride": Config.OCR_LAYOUT_STRIDE,
+        "inference_mode": Config.OCR_INFERENCE_MODE,
+        "torchscript": Config.OCR_TORCHSCRIPT,
+        "max_image_side": Config.OCR_MAX_IMAGE_SIDE,
+        "table_crop": Config.OCR_TABLE_CROP,
+        "microbatch": Config.OCR_MICROBATCH_ENABLED,
+        "microbatch_wait_ms": Config.OCR_MICROBATCH_WAIT_MS,
+        "microbatch_max_crops": Config.OCR_MICROBATCH_MAX_CROPS,
+        "microbatch_max_windows": Config.OCR_MICROBATCH_MAX_WINDOWS,
+        "paddle_detector_only": Config.OCR_PADDLE_DET_ONLY,
+        "template_cache": Config.OCR_TEMPLATE_CACHE,
+        "template_path": Config.OCR_TEMPLATE_PATH,
+        "template_min_confirmations": Config.OCR_TEMPLATE_MIN_CONFIRMATIONS,
+        "template_min_coverage": Config.OCR_TEMPLATE_MIN_COVERAGE,
+        "template_learn_confidence": Config.OCR_TEMPLATE_LEARN_CONFIDENCE,
+        "pipeline": Config.OCR_PIPELINE_ENABLED,
+        "pipeline_prepare_workers": Config.OCR_PIPELINE_PREPARE_WORKERS,
+        "pipeline_queue_size": Config.OCR_PIPELINE_QUEUE_SIZE
+    }
+    kwargs.update(Config.OCR_TIERS[resolve_tier(tier)])
+    return kwargs
+
+def load_model(tier=None):
+    tier = resolve_tier(tier)
+    if tier not in _real_ai_models:
+        with _load_lock:
+            if tier in _real_ai_models:
+                return _real_ai_models[tier]
+            try:
+                from app.my_ocr_core import InvoiceRecognizer
+
+                current_file_path = os.path.abspath(__file__)
+                
+                app_dir = os.path.dirname(current_file_path)
+                
+                server_dir = os.path.dirname(app_dir)
+                
+                print(f" [Path Fix] Đang tìm model tại gốc: {server_dir} (tier: {tier})")
+                
+                shared = next(iter(_real_ai_models.values()), None)
+                _real_ai_models[tier] = InvoiceRecognizer(
+                    model_dir=server_dir, shared_layout=shared, **build_recognizer_kwargs(tier)
+                )
+                
+            except Exception as e:
+                print(f" [CRITICAL] Không thể load AI Model: {e}")
+    return _real_ai_models.get(tier)
+
+def warmup():
     """
-    Hàm Adapter: Gọi InvoiceRecognizer -> Trả về chuỗi raw text
+    Load sẵn model OCR (gọi lúc khởi động ở các process được cấu hình làm OCR worker).
+    - Bật pool: khởi động toàn bộ process worker (mỗi worker tự load model của mọi tier).
+    - Tắt pool: load model singleton của mọi tier ngay trong process hiện tại.
     """
-    global _real_ai_model
-    if _real_ai_model is None:
-        load_model()
-    
-    if _real_ai_model is None:
-        return "ERROR: AI Model chưa được khởi tạo."
+    if Config.OCR_POOL_ENABLED:
+        ocr_worker_pool.get_pool().warmup()
+    else:
+        for tier in Config.OCR_ENABLED_TIERS:
+            load_model(tier)
 
+def _predict_document(image_path, tier=None):
+    """
+    Chạy predict_document trên pool process (nếu bật) hoặc model singleton trong process hiện tại.
+    Trả về {"lines": [...], "pages": [...], "metrics": {...}} hoặc None nếu model chưa load được.
+    """
+    tier = resolve_tier(tier)
+    if Config.OCR_POOL_ENABLED:
+        return ocr_worker_pool.get_pool().predict(
+            image_path,
+            wait_timeout=Config.OCR_POOL_SUBMIT_TIMEOUT,
+            timeout=Config.OCR_POOL_JOB_TIMEOUT,
+            tier=tier
+        )
+
+    model = load_model(tier)
+    if model is None:
+        return None
+
+    return model.predict_document(image_path)
+
+def process_ocr_document(image_path, tier=None):
+    """
+    Hàm Adapter: Gọi InvoiceRecognizer (ảnh hoặc PDF nhiều trang)
+    -> (chuỗi raw text của tất cả các trang, List[OcrRow], thông tin thời gian từng trang, số liệu từng stage)
+    raw text chỉ để hiển thị; phần parse dùng trực tiếp các OcrRow (không phải tách chuỗi lại).
+    image_path: đường dẫn file hoặc bytes của file upload (giữ trong bộ nhớ, gửi thẳng sang pool worker)
+    tier: profile OCR (Config.OCR_TIERS), None = OCR_DEFAULT_TIER
+    """
+    stats = OcrJobStats()
     try:
-        print(f" [AI] Bắt đầu xử lý ảnh: {image_path}")
+        source = f"{len(image_path)} bytes" if isinstance(image_path, bytes) else image_path
+        print(f" [AI] Bắt đầu xử lý file: {source}")
         
-        # Gọi hàm predict của Core -> Trả về List[str]
-        # Ví dụ: ["Banh ngot 2 50000 100000", "Keo 1 5000 5000"]
-        output_lines = _real_ai_model.predict(image_path)
+        # Gọi hàm predict của Core -> rows: List[OcrRow], lines: List[str]
+        # Ví dụ lines: ["Banh ngot | 2 | 100000 | 50000", "Keo | 1 | 5000 | 5000"]
+        # "ocr_total" gồm cả thời gian chờ/chuyển dữ liệu qua pool worker
+        with stats.stage("ocr_total"):
+            document = _predict_document(image_path, tier)
+        if document is None:
+            return "ERROR: AI Model chưa được khởi tạo.", [], [], stats.to_dict()
+        stats.merge(document.get("metrics"))
         
         # Thêm header giả để khớp với logic parser cũ (ItemName Quantity Amount Price)
         # Lưu ý: Class InvoiceRecognizer đã format đúng thứ tự này ở cuối hàm predict
         header = "ITEMNAME QUANTITY AMOUNT UNITPRICE"
         
-        final_result = [header] + output_lines
-        return "\n".join(final_result)
+        final_result = [header] + document["lines"]
+        return "\n".join(final_result), document["rows"], document["pages"], stats.to_dict()
 
+    except (OcrPoolBusyError, ValueError):
+        # Để route trả về 503 (quá tải) / 400 (tier không hợp lệ) thay vì một kết quả rỗng
+        raise
     except Exception as e:
         print(f" Lỗi khi chạy AI: {e}")
-        return ""
\ No newline at end of file
+        stats.count("errors")
+        return "", [], [], stats.to_dict()
+
+def process_ocr(image_path: str, tier=None) -> str:
+    """
+    Hàm Adapter: Gọi InvoiceRecognizer -> Trả về chuỗi raw text
+    """
+    raw_text, _, _, _ = process_ocr_document(image_path, tier)
+    return raw_text
@@ -1,12 +1,26 @@
 # app/api/warehouse_routes.py
 import os
-from flask import Blueprint, request, jsonify, current_app 
-from werkzeug.utils import secure_filename 
+import json
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
 from app.services.warehouse_service import WarehouseService
 from app.services.notification_service import NotificationService
+from app.services.ocr_job_service import OcrJobService
+from app.services.ocr_batch_service import OcrBatchService
+from app.ocr_worker_pool import OcrPoolBusyError
+from app import ai_model
+from app.utils.ocr_metrics import OcrMetrics
+from app.utils.ocr_uploads import (
+    UploadTooLargeError, read_upload, persist_upload, temp_dir, maybe_prune_temp_files
+)
 
 warehouse_bp = Blueprint('warehouse', __name__)
 
+@warehouse_bp.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    """Body vượt MAX_CONTENT_LENGTH (werkzeug dừng parse multipart) -> JSON thay vì trang HTML mặc định"""
+    return jsonify({"success": False, "error": "File vượt quá dung lượng cho phép"}), 413
+
 @warehouse_bp.route('/products', methods=['GET'])
 def get_products():
     try:
@@ -55,8 +69,46 @@ def create_export_slip():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+def _request_flag(name):
+    """Cờ bật/tắt lấy từ query string (?name=1) hoặc field form cùng tên"""
+    flag = request.args.get(name) or request.form.get(name) or ''
+    return flag.lower() in ('1', 'true', 'yes')
+
+def _is_async_request():
+    """Client bật chế độ bất đồng bộ bằng ?async=1 (hoặc field form 'async')"""
+    return _request_flag('async')
+
+def _request_tier():
+    """Tier OCR lấy từ ?tier=fast|accurate (hoặc field form 'tier'); None = OCR_DEFAULT_TIER. Tier lạ -> ValueError"""
+    tier = request.args.get('tier') or request.form.get('tier')
+    return ai_model.resolve_tier(tier) if tier else None
+
+def _upload_too_large():
+    """
+    Từ chối sớm theo Content-Length, TRƯỚC khi đọc request.files (chưa nhận body).
+    Cộng thêm 64KB cho phần header multipart.
+    """
+    max_bytes = current_app.config.get('OCR_MAX_UPLOAD_BYTES')
+    if max_bytes and request.content_length and request.content_length > max_bytes + 64 * 1024:
+        return jsonify({"success": False, "error": "File vượt quá dung lượng cho phép"}), 413
+    return None
+
+def _read_ocr_upload(file):
+    """
+    Đọc file upload (werkzeug đã parse xong body, giới hạn bởi MAX_CONTENT_LENGTH) vào bộ nhớ;
+    file lớn hơn OCR_MAX_UPLOAD_BYTES -> UploadTooLargeError.
+    Chỉ ghi ra đĩa (uploads/ocr_audit) khi bật OCR_AUDIT_UPLOADS.
+    """
+    data = read_upload(file, current_app.config.get('OCR_MAX_UPLOAD_BYTES'))
+    if current_app.config.get('OCR_AUDIT_UPLOADS'):
+        persist_upload(data, file.filename, os.path.join(current_app.config['UPLOAD_FOLDER'], 'ocr_audit'))
+    return data
+
 @warehouse_bp.route('/ocr-upload', methods=['POST'])
 def upload_and_process_invoice():
+    too_large = _upload_too_large()
+    if too_large: return too_large
+
     if 'file' not in request.files:
         return jsonify({"success": False, "error": "Không có file nào được gửi"}), 400
 
@@ -65,26 +117,160 @@ def upload_and_process_invoice():
         return jsonify({"success": False, "error": "Tên file rỗng"}), 400
 
     if file:
-        filename = secure_filename(file.filename)
-        # Lưu tạm ảnh để AI xử lý (đường dẫn này sẽ truyền vào hàm process_ocr)
-        image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_ocr', filename)
-        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        maybe_prune_temp_files(current_app.config)
         
         try:
-            file.save(image_path)
-            
-            # Hàm này đã bao gồm cả AI + Parsing + Smart Search
-            smart_items = WarehouseService.process_ocr_upload(image_path)
+            tier = _request_tier()
+        except ValueError as ve:
+            return jsonify({"success": False, "error": str(ve)}), 400
+
+        try:
+            data = _read_ocr_upload(file)
+
+            if _is_async_request():
+                # Job chạy sau khi request kết thúc -> cần file trên đĩa (tên duy nhất theo job_id)
+                job_id = OcrJobService.new_job_id()
+                image_path = persist_upload(data, file.filename, temp_dir(current_app.config), prefix=job_id)
+                job = OcrJobService.submit(image_path, job_id=job_id, tier=tier)
+                return jsonify({
+                    "success": True,
+                    "data": {
+                        "job_id": job.id,
+                        "status": job.status,
+                        "status_url": url_for('warehouse.get_ocr_job', job_id=job.id),
+                        "stream_url": url_for('warehouse.stream_ocr_job', job_id=job.id)
+                    }
+                }), 202
             
-            # Xóa file tạm sau khi xử lý xong (tùy chọn)
-            # os.remove(image_path) 
+            # Hàm này đã bao gồm cả AI + Parsing + Smart Search (ảnh xử lý thẳng từ bộ nhớ)
+            # ?debug=1 -> trả thêm thời gian từng stage của request này; ?tier=fast -> profile nhanh
+            smart_items = WarehouseService.process_ocr_upload(data, debug=_request_flag('debug'), tier=tier)
 
             return jsonify({"success": True, "data": smart_items}), 200
-            
+
+        except UploadTooLargeError as te:
+            return jsonify({"success": False, "error": str(te)}), 413
+        except OcrPoolBusyError as be:
+            return jsonify({"success": False, "error": str(be)}), 503
         except Exception as e:
             print(f"Lỗi OCR Server: {e}")
             return jsonify({"success": False, "error": f"Lỗi server: {str(e)}"}), 500
 
+def _stream_line(fmt, event, data):
+    """1 sự kiện stream: SSE (fmt == 'sse') hoặc 1 dòng NDJSON {"event", "data"}"""
+    payload = json.dumps(data if fmt == 'sse' else {"event": event, "data": data}, ensure_ascii=False, default=str)
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@warehouse_bp.route('/ocr-upload/stream', methods=['POST'])
+def upload_and_stream_invoice():
+    """
+    Bản streaming của /ocr-upload: gửi raw text ngay khi OCR xong, sau đó từng item
+    (cùng schema với "items") ngay khi được match, cuối cùng là 1 sự kiện summary.
+    Mặc định NDJSON; ?format=sse -> Server-Sent Events.
+    """
+    too_large = _upload_too_large()
+    if too_large: return too_large
+
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({"success": False, "error": "Không có file nào được gửi"}), 400
+
+    fmt = 'sse' if request.args.get('format') == 'sse' else 'ndjson'
+
+    try:
+        tier = _request_tier()
+    except ValueError as ve:
+        return jsonify({"success": False, "error": str(ve)}), 400
+
+    try:
+        data = _read_ocr_upload(file)
+        events = WarehouseService.iter_ocr_upload(data, debug=_request_flag('debug'), tier=tier)
+        # Chạy OCR trước khi gửi header -> quá tải/lỗi OCR vẫn trả được mã lỗi HTTP đúng
+        first_event = next(events)
+    except UploadTooLargeError as te:
+        return jsonify({"success": False, "error": str(te)}), 413
+    except OcrPoolBusyError as be:
+        return jsonify({"success": False, "error": str(be)}), 503
+    except Exception as e:
+        print(f"Lỗi OCR Server: {e}")
+        return jsonify({"success": False, "error": f"Lỗi server: {str(e)}"}), 500
+
+    def generate():
+        yield _stream_line(fmt, *first_event)
+        try:
+            for event, data in events:
+                yield _stream_line(fmt, event, data)
+        except Exception as e:
+            print(f"Lỗi OCR Stream: {e}")
+            yield _stream_line(fmt, "error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if fmt == 'sse' else 'application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@warehouse_bp.route('/ocr-upload/batch', methods=['POST'])
+def upload_invoice_batch():
+    """
+    Upload nhiều hóa đơn (field 'files', có thể lặp lại; hoặc 1 file .zip).
+    Trả về NDJSON: mỗi hóa đơn xong là có 1 dòng kết quả kèm tiến độ, dòng cuối là tổng kết.
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({"success": False, "error": "Không có file nào được gửi"}), 400
+
+    maybe_prune_temp_files(current_app.config)
+    try:
+        tier = _request_tier()
+        batch_id, batch_dir = OcrBatchService.new_batch_dir()
+        entries = OcrBatchService.save_uploads(files, batch_dir)
+    except ValueError as ve:
+        return jsonify({"success": False, "error": str(ve)}), 400
+    except Exception as e:
+        print(f"Lỗi OCR Batch: {e}")
+        return jsonify({"success": False, "error": f"Lỗi server: {str(e)}"}), 500
+
+    return Response(
+        stream_with_context(OcrBatchService.iter_batch_results(batch_id, entries, tier=tier, batch_dir=batch_dir)),
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@warehouse_bp.route('/ocr-jobs/<string:job_id>', methods=['GET'])
+def get_ocr_job(job_id):
+    """Polling trạng thái/kết quả của OCR job"""
+    try:
+        job = OcrJobService.get_job(job_id)
+        return jsonify({"success": True, "data": job.to_dict()}), 200
+    except ValueError as ve:
+        return jsonify({"success": False, "error": str(ve)}), 404
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@warehouse_bp.route('/ocr-jobs/<string:job_id>/stream', methods=['GET'])
+def stream_ocr_job(job_id):
+    """Server-Sent Events: đẩy trạng thái job cho tới khi hoàn tất"""
+    try:
+        OcrJobService.get_job(job_id)
+    except ValueError as ve:
+        return jsonify({"success": False, "error": str(ve)}), 404
+
+    return Response(
+        stream_with_context(OcrJobService.iter_job_events(job_id)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@warehouse_bp.route('/ocr-metrics', methods=['GET'])
+def get_ocr_metrics():
+    """Histogram độ trễ từng stage OCR + bộ đếm (của process hiện tại). ?format=prometheus -> text"""
+    if request.args.get('format') == 'prometheus':
+        return Response(OcrMetrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify({"success": True, "data": OcrMetrics.snapshot()}), 200
+
 @warehouse_bp.route('/products', methods=['POST'])
 def create_product(): 
     try:
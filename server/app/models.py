@@ -1,4 +1,5 @@
 # server/app/models.py
+import json
 from datetime import datetime
 from . import db, bcrypt
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -31,6 +32,8 @@ class Product(db.Model):
 
     standard_price = db.Column(db.Float, default=0)
     is_active = db.Column(db.Boolean, default=True)
+    # Mốc thời gian sửa cuối -> watermark cho đồng bộ MongoDB tăng dần (app/utils/mongo_sync.py)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     # Mối quan hệ với các chi tiết phiếu
     import_details = db.relationship('ImportSlipDetail', backref='product', lazy='dynamic')
     export_details = db.relationship('ExportSlipDetail', backref='product', lazy='dynamic')
@@ -253,3 +256,60 @@ class Notification(db.Model):
         
     def __repr__(self):
         return f'<Notification for User ID {self.recipient_id}>'
+
+"""
+HÀNG ĐỢI OCR BẤT ĐỒNG BỘ
+"""
+# Mỗi lần upload hóa đơn ở chế độ async tạo 1 job, worker nền cập nhật trạng thái
+class OcrJob(db.Model):
+    __tablename__ = 'ocr_job'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, index=True)
+    file_path = db.Column(db.String(500), nullable=False)
+    tier = db.Column(db.String(20), nullable=True)  # tier OCR client chọn (None = OCR_DEFAULT_TIER)
+    # JSON kết quả process_ocr_upload (LONGTEXT trên MySQL: hóa đơn nhiều dòng dễ vượt 64 KB của TEXT)
+    result = db.Column(db.Text(length=2**32 - 1), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (OcrJob.STATUS_DONE, OcrJob.STATUS_FAILED)
+
+    def to_dict(self, include_result=True):
+        # Thời gian chờ trong hàng đợi và thời gian chạy thực tế (giây)
+        queued_seconds = None
+        run_seconds = None
+        if self.started_at and self.created_at:
+            queued_seconds = (self.started_at - self.created_at).total_seconds()
+        if self.finished_at and self.started_at:
+            run_seconds = (self.finished_at - self.started_at).total_seconds()
+
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "tier": self.tier,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() + 'Z' if self.created_at else None,
+            "started_at": self.started_at.isoformat() + 'Z' if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() + 'Z' if self.finished_at else None,
+            "timings": {
+                "queued_seconds": queued_seconds,
+                "run_seconds": run_seconds
+            }
+        }
+        if include_result:
+            data["result"] = json.loads(self.result) if self.result else None
+        return data
+
+    def __repr__(self):
+        return f'<OcrJob {self.id} ({self.status})>'
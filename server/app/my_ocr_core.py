@@ -4,9 +4,11 @@ import os
 import cv2
 import numpy as np
 import torch
+import time
 import logging
+import threading
 import traceback 
-from collections import Counter
+from collections import Counter, defaultdict
 
 # --- 1. VÁ LỖI PILLOW (BẮT BUỘC CHO VIETOCR) ---
 import PIL.Image
@@ -16,12 +18,22 @@ if not hasattr(PIL.Image, 'ANTIALIAS'):
     PIL.Image.BICUBIC = PIL.Image.Resampling.BICUBIC
 
 # --- 2. IMPORT CÁC THƯ VIỆN AI ---
+import fitz  # PyMuPDF: đọc hóa đơn PDF
 from paddleocr import PaddleOCR
+from paddleocr.paddleocr import parse_args as paddle_parse_args
+from paddleocr.tools.infer.predict_det import TextDetector
 from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
 
 # Import VietOCR
 from vietocr.tool.predictor import Predictor
 from vietocr.tool.config import Cfg
+from vietocr.tool.translate import process_input, translate, translate_beam_search
+
+from app.ocr_types import OcrRow
+from app.utils.ocr_metrics import OcrJobStats
+from app.utils.micro_batcher import MicroBatcher
+from app.utils.layout_templates import LayoutTemplateStore
+from app.utils.stage_pipeline import StagePipeline
 
 # Tắt log rác và OneDNN để tránh xung đột
 logging.getLogger("ppocr").setLevel(logging.ERROR)
@@ -39,62 +51,292 @@ HEADER_MAP = {
     "AmountValue": "Amount"
 }
 
+# Vùng bảng hợp lệ phải cao >= 20% ảnh và nhỏ hơn 90% diện tích ảnh
+TABLE_MIN_HEIGHT_RATIO = 0.2
+TABLE_MAX_AREA_RATIO = 0.9
+
+# Kiến trúc VietOCR mặc định dùng cho nhận dạng
+VIETOCR_ARCH = 'vgg_seq2seq'
+
+# Trang PDF có ít nhất bấy nhiêu từ trong text layer thì dùng luôn text, bỏ qua OCR
+PDF_TEXT_LAYER_MIN_WORDS = 5
+
+# Tham số DB detector (giống nhau cho cả 2 cách khởi tạo Paddle)
+PADDLE_DET_PARAMS = {
+    "det_algorithm": "DB",
+    "det_db_unclip_ratio": 1.5,
+    "det_db_box_thresh": 0.5,
+    "det_db_thresh": 0.3,
+}
+
+
+def build_text_detector(model_dir, use_gpu=False, cpu_threads=None, detector_only=True, det_limit_side_len=960):
+    """
+    Tạo DB text detector của Paddle -> callable(img_array) -> (dt_boxes, elapse).
+    - detector_only=True: chỉ load model det (không load rec/cls tiếng Trung không bao giờ dùng tới).
+    - detector_only=False: cách cũ, dựng cả PaddleOCR rồi lấy .text_detector.
+    - det_limit_side_len: cạnh dài nhất của ảnh đưa vào detector (nhỏ hơn = nhanh hơn, dễ sót chữ nhỏ).
+    """
+    det_path = os.path.join(model_dir, "ocr_models/ch_PP-OCRv3_det_infer")
+    if not os.path.exists(det_path):
+        raise FileNotFoundError(f"Không tìm thấy model OCR tại: {det_path}")
+
+    paddle_kwargs = {"cpu_threads": int(cpu_threads)} if cpu_threads else {}
+
+    if detector_only:
+        # Dùng đúng bộ tham số mặc định của PaddleOCR rồi ghi đè phần detector
+        args = paddle_parse_args(mMain=False)
+        args.__dict__.update(
+            det_model_dir=det_path, use_gpu=use_gpu, show_log=False,
+            det_limit_side_len=det_limit_side_len,
+            **PADDLE_DET_PARAMS, **paddle_kwargs
+        )
+        return TextDetector(args)
+
+    rec_path = os.path.join(model_dir, "ocr_models/ch_PP-OCRv3_rec_infer")
+    cls_path = os.path.join(model_dir, "ocr_models/ch_ppocr_mobile_v2.0_cls_infer")
+    engine = PaddleOCR(
+        use_angle_cls=False, # Tắt CLS để tránh lỗi Numpy
+        lang='ch',
+        det_model_dir=det_path,
+        rec_model_dir=rec_path,
+        cls_model_dir=cls_path,
+        use_gpu=use_gpu,
+        show_log=False,
+        det_limit_side_len=det_limit_side_len,
+        **PADDLE_DET_PARAMS,
+        **paddle_kwargs
+    )
+    return engine.text_detector
+
+
+def set_detector_limit_side_len(text_detector, limit_side_len):
+    """Đổi kích thước đầu vào của DB detector đã load (bước resize DetResizeForTest trong preprocess_op)"""
+    for op in getattr(text_detector, "preprocess_op", None) or []:
+        if hasattr(op, "limit_side_len"):
+            op.limit_side_len = limit_side_len
+
+
 class InvoiceRecognizer:
-    def __init__(self, model_dir="./"):
+    def __init__(self, model_dir="./", rec_batch_size=32, cpu_threads=None, pdf_dpi=200,
+                 layout_window=512, layout_stride=128, inference_mode="fp32", torchscript=False,
+                 max_image_side=2000, table_crop=True, microbatch=False, microbatch_wait_ms=20,
+                 microbatch_max_crops=64, microbatch_max_windows=8, paddle_detector_only=True,
+                 vietocr_arch=VIETOCR_ARCH, beamsearch=False, det_limit_side_len=960, shared_layout=None,
+                 template_cache=False, template_path=None, template_min_confirmations=3,
+                 template_min_coverage=0.85, template_learn_confidence=0.9,
+                 pipeline=False, pipeline_prepare_workers=2, pipeline_queue_size=4):
         """
         Khởi tạo Model: Paddle (Det) + VietOCR (Rec) + LayoutLMv3 (IE)
+        rec_batch_size: số vùng chữ tối đa VietOCR nhận dạng trong 1 lượt (1 = từng vùng một)
+        cpu_threads: giới hạn số thread CPU của Paddle/torch (None = để thư viện tự chọn)
+        pdf_dpi: độ phân giải khi rasterize từng trang PDF
+        layout_window / layout_stride: độ dài cửa sổ token của LayoutLMv3 và số token chồng lấn giữa 2 cửa sổ
+        inference_mode: "fp32" (mặc định) hoặc "int8" (dynamic quantization các lớp Linear/GRU, chỉ CPU)
+        torchscript: dùng CNN của VietOCR đã trace sẵn (cache trên đĩa cạnh final_model)
+        max_image_side: thu nhỏ ảnh để cạnh dài nhất không vượt quá giá trị này trước khi Det/Rec (None = giữ nguyên)
+        table_crop: chỉ chạy Det/Rec trong vùng bảng hàng hóa (nếu tìm được)
+        microbatch: gom vùng chữ (VietOCR) và cửa sổ LayoutLMv3 của các request chạy đồng thời thành 1 batch,
+            chờ tối đa microbatch_wait_ms hoặc tới khi đủ microbatch_max_crops / microbatch_max_windows
+        paddle_detector_only: chỉ load DB detector của Paddle (False = dựng cả PaddleOCR như trước)
+        vietocr_arch / beamsearch: kiến trúc VietOCR và bật beam search (chính xác hơn, không chạy theo lô được)
+        det_limit_side_len: kích thước đầu vào của DB detector
+        shared_layout: InvoiceRecognizer khác (cùng inference_mode) để dùng chung LayoutLMv3 thay vì load lần nữa
+            (các tier chỉ khác nhau ở Det/Rec/cửa sổ, không cần 2 bản LayoutLMv3 trong bộ nhớ).
+            Cũng dùng chung VietOCR khi cùng vietocr_arch/torchscript (beamsearch chọn theo từng tier), và DB detector
+            (det_limit_side_len đặt lại theo từng lần gọi).
+        template_cache: học khoảng x của các cột theo dòng tiêu đề bảng (lưu ở template_path); gặp lại mẫu đã
+            được xác nhận template_min_confirmations lần thì gán cột theo vị trí, bỏ qua LayoutLMv3
+            (xem app/utils/layout_templates.py cho ý nghĩa các ngưỡng còn lại)
+        pipeline: các hóa đơn ảnh chạy qua pipeline 4 stage (prepare -> detect -> recognize -> layout) trên thread,
+            nối bằng hàng đợi pipeline_queue_size -> preprocess/detection của ảnh sau chạy gối với
+            recognition/LayoutLMv3 của ảnh trước. prepare có pipeline_prepare_workers thread.
+            Micro-batching bị tắt khi bật pipeline (mỗi stage chỉ có 1 thread gọi model, không có gì để gom).
         """
+        self.rec_batch_size = max(1, int(rec_batch_size))
+        self.pdf_dpi = int(pdf_dpi)
+        self.layout_window = int(layout_window)
+        self.layout_stride = int(layout_stride)
+        self.inference_mode = inference_mode
+        self.torchscript = bool(torchscript)
+        self.max_image_side = int(max_image_side) if max_image_side else None
+        self.table_crop = bool(table_crop)
+        if microbatch and pipeline:
+            # Pipeline thắng: mỗi stage chỉ có 1 thread gọi model nên micro-batcher không có gì để gom
+            print("⚠️ [Core AI] OCR_MICROBATCH_ENABLED và OCR_PIPELINE_ENABLED cùng bật -> dùng pipeline, tắt micro-batching.")
+        self.microbatch = bool(microbatch) and not pipeline
+        self.vietocr_arch = vietocr_arch
+        self.beamsearch = bool(beamsearch)
+        self.det_limit_side_len = det_limit_side_len
+        self.paddle_detector_only = bool(paddle_detector_only)
+        # Số request đang chạy predict_document (để micro-batcher không chờ vô ích khi chỉ có 1 request)
+        self._active_jobs = 0
+        self._active_lock = threading.Lock()
+        if cpu_threads:
+            torch.set_num_threads(int(cpu_threads))
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"⚙️ [Core AI] Đang khởi tạo trên thiết bị: {self.device}")
 
-        # --- A. Load PaddleOCR (Chỉ dùng Detection) ---
-        det_path = os.path.join(model_dir, "ocr_models/ch_PP-OCRv3_det_infer")
-        rec_path = os.path.join(model_dir, "ocr_models/ch_PP-OCRv3_rec_infer") 
-        cls_path = os.path.join(model_dir, "ocr_models/ch_ppocr_mobile_v2.0_cls_infer")
-
-        if not os.path.exists(det_path):
-            raise FileNotFoundError(f"Không tìm thấy model OCR tại: {det_path}")
-
-        print("[Core AI] Loading PaddleOCR (Detector)...")
-        self.ocr_engine = PaddleOCR(
-            use_angle_cls=False, # Tắt CLS để tránh lỗi Numpy
-            lang='ch',
-            det_model_dir=det_path,
-            rec_model_dir=rec_path,
-            cls_model_dir=cls_path,
-            use_gpu=(self.device == 'cuda'),
-            show_log=False,
-            det_db_unclip_ratio=1.5,
-            det_db_box_thresh=0.5,
-            det_db_thresh=0.3
-        )
+        # --- A. Load Paddle DB Detector (chỉ dùng Detection, nhận dạng do VietOCR làm) ---
+        if shared_layout is not None and shared_layout.paddle_detector_only == self.paddle_detector_only:
+            print("[Core AI] Dùng chung Paddle (Detector) đã load.")
+            self.text_detector = shared_layout.text_detector
+            # Predictor của Paddle không an toàn khi nhiều thread gọi cùng lúc -> dùng chung cả lock
+            self._det_lock = shared_layout._det_lock
+        else:
+            print("[Core AI] Loading Paddle (Detector)...")
+            self.text_detector = build_text_detector(
+                model_dir, use_gpu=(self.device == 'cuda'), cpu_threads=cpu_threads,
+                detector_only=paddle_detector_only, det_limit_side_len=det_limit_side_len
+            )
+            self._det_lock = threading.Lock()
 
         # --- B. Load VietOCR (Recognition) ---
-        print("[Core AI] Loading VietOCR (Recognizer)...")
-        try:
-            config = Cfg.load_config_from_name('vgg_seq2seq')
-            config['cnn']['pretrained'] = False
-            config['device'] = 'cpu'
-            self.vietocr = Predictor(config)
-        except Exception as e:
-            print(f"❌ [Core AI] Lỗi load VietOCR: {e}")
-            raise e
+        self._vietocr_shared = (
+            shared_layout is not None
+            and shared_layout.vietocr_arch == self.vietocr_arch
+            and shared_layout.torchscript == self.torchscript
+            and shared_layout.inference_mode == self.inference_mode
+        )
+        if self._vietocr_shared:
+            # Cùng weights -> 1 bản trong bộ nhớ (đã trace/quantize bởi recognizer gốc);
+            # greedy/beam search chọn theo self.beamsearch ở mỗi lần nhận dạng
+            print("[Core AI] Dùng chung VietOCR đã load.")
+            self.vietocr = shared_layout.vietocr
+        else:
+            print("[Core AI] Loading VietOCR (Recognizer)...")
+            try:
+                config = Cfg.load_config_from_name(vietocr_arch)
+                config['cnn']['pretrained'] = False
+                config['predictor']['beamsearch'] = self.beamsearch
+                config['device'] = 'cpu'
+                self.vietocr = Predictor(config)
+            except Exception as e:
+                print(f"❌ [Core AI] Lỗi load VietOCR: {e}")
+                raise e
 
         # --- C. Load LayoutLMv3 ---
-        print("[Core AI] Loading LayoutLMv3...")
-        layout_model_path = os.path.join(model_dir, "final_model")
-        if not os.path.exists(layout_model_path):
-            raise FileNotFoundError(f"Không tìm thấy LayoutLMv3 tại: {layout_model_path}")
-            
-        self.model = LayoutLMv3ForTokenClassification.from_pretrained(layout_model_path).to(self.device)
-        self.processor = LayoutLMv3Processor.from_pretrained(layout_model_path, apply_ocr=False)
+        self._layout_shared = shared_layout is not None and shared_layout.inference_mode == self.inference_mode
+        if self._layout_shared:
+            # Model đã được tối ưu (int8) bởi recognizer gốc -> dùng lại nguyên trạng
+            print("[Core AI] Dùng chung LayoutLMv3 đã load.")
+            self.model = shared_layout.model
+            self.processor = shared_layout.processor
+        else:
+            print("[Core AI] Loading LayoutLMv3...")
+            layout_model_path = os.path.join(model_dir, "final_model")
+            if not os.path.exists(layout_model_path):
+                raise FileNotFoundError(f"Không tìm thấy LayoutLMv3 tại: {layout_model_path}")
+                
+            self.model = LayoutLMv3ForTokenClassification.from_pretrained(layout_model_path).to(self.device)
+            self.processor = LayoutLMv3Processor.from_pretrained(layout_model_path, apply_ocr=False)
+
+        # --- D. Cache mẫu bố cục theo nhà cung cấp (dùng chung với recognizer gốc nếu share LayoutLMv3) ---
+        if not template_cache:
+            self.templates = None
+        elif shared_layout is not None and shared_layout.templates is not None:
+            self.templates = shared_layout.templates
+        else:
+            self.templates = LayoutTemplateStore(
+                template_path, min_confirmations=template_min_confirmations,
+                min_coverage=template_min_coverage, learn_confidence=template_learn_confidence
+            )
+
+        # --- E. Tối ưu cho CPU (tùy chọn) ---
+        self._apply_cpu_optimizations(model_dir)
+
+        # --- F. Micro-batching giữa các request (tạo sẵn, chỉ dùng khi self.microbatch bật) ---
+        self._rec_batcher = MicroBatcher(
+            self.recognize_batch, max_batch_size=microbatch_max_crops, max_wait_ms=microbatch_wait_ms,
+            expected_callers=lambda: self._active_jobs, name="ocr-rec-batcher"
+        )
+        self._layout_batcher = MicroBatcher(
+            self._run_layout_batch, max_batch_size=microbatch_max_windows, max_wait_ms=microbatch_wait_ms,
+            size_fn=lambda encodings: sum(len(e["input_ids"]) for e in encodings),
+            expected_callers=lambda: self._active_jobs, name="ocr-layout-batcher"
+        )
+        
+        # --- G. Pipeline nhiều stage (tạo sẵn, thread chỉ khởi động ở lần submit đầu tiên) ---
+        self.pipeline = StagePipeline([
+            ("prepare", self._pipeline_prepare, pipeline_prepare_workers),
+            ("detect", self._pipeline_detect, 1),
+            ("recognize", self._pipeline_recognize, 1),
+            ("layout", self._pipeline_layout, 1),
+        ], queue_size=pipeline_queue_size, name="ocr-pipeline") if pipeline else None
         
         print("✅ [Core AI] Tất cả Model đã sẵn sàng!")
 
-    def aggressive_preprocess(self, pil_image):
-        """Xử lý ảnh bằng OpenCV để tách chữ dính"""
+    def _apply_cpu_optimizations(self, model_dir):
+        """
+        Chế độ suy luận tối ưu cho node chỉ có CPU:
+        - int8: torch dynamic quantization cho Linear (LayoutLMv3, VietOCR) và GRU (decoder seq2seq).
+        - torchscript: thay CNN (VGG) của VietOCR bằng bản trace, lưu tại final_model_optimized/.
+          Chỉ trace được phần CNN; vòng lặp decode seq2seq và LayoutLMv3 (độ dài cửa sổ thay đổi)
+          vẫn chạy eager.
+        """
+        if self.inference_mode not in ("fp32", "int8"):
+            raise ValueError(f"inference_mode không hợp lệ: {self.inference_mode}")
+
+        if self.torchscript and not self._vietocr_shared:
+            self.vietocr.model.cnn = self._load_traced_vietocr_cnn(model_dir)
+
+        if self.inference_mode == "int8":
+            if self.device != "cpu":
+                print("⚠️ [Core AI] Dynamic quantization chỉ hỗ trợ CPU, giữ nguyên fp32.")
+                return
+            print("[Core AI] Quantize int8 (dynamic) cho LayoutLMv3 + VietOCR...")
+            if not self._layout_shared:
+                self.model = torch.ao.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            if not self._vietocr_shared:
+                self.vietocr.model = torch.ao.quantization.quantize_dynamic(
+                    self.vietocr.model, {torch.nn.Linear, torch.nn.GRU}, dtype=torch.qint8
+                )
+
+    def _load_traced_vietocr_cnn(self, model_dir):
+        """Load CNN đã trace từ cache, chưa có thì trace rồi lưu (xóa file để trace lại khi đổi weights)"""
+        cache_dir = os.path.join(model_dir, "final_model_optimized")
+        cache_path = os.path.join(cache_dir, f"vietocr_cnn_{self.vietocr_arch}.pt")
+
+        if os.path.exists(cache_path):
+            print(f"[Core AI] Load TorchScript CNN: {cache_path}")
+            return torch.jit.load(cache_path, map_location=self.vietocr.config['device'])
+
+        print("[Core AI] Trace CNN của VietOCR (lần đầu)...")
+        cnn = self.vietocr.model.cnn.eval()
+        height = self.vietocr.config['dataset']['image_height']
+        example = torch.rand(1, 3, height, 128).to(self.vietocr.config['device'])
+        with torch.no_grad():
+            traced = torch.jit.trace(cnn, example)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        traced.save(cache_path)
+        return traced
+
+    # --- ẢNH: pipeline làm việc trên 1 mảng NumPy RGB (H, W, 3), các hàm vẫn nhận ảnh PIL ---
+
+    @staticmethod
+    def decode_image(data):
+        """bytes của file ảnh -> mảng RGB uint8 (giải mã trực tiếp trong bộ nhớ, không ghi file tạm)"""
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            # Định dạng OpenCV không đọc được (gif, ...) -> để PIL thử
+            import io
+            return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    @staticmethod
+    def image_size(image):
+        """(width, height) của ảnh PIL hoặc mảng NumPy"""
+        if isinstance(image, np.ndarray):
+            return image.shape[1], image.shape[0]
+        return image.size
+
+    def aggressive_preprocess(self, image):
+        """Xử lý ảnh bằng OpenCV để tách chữ dính (trả về cùng kiểu với đầu vào: PIL hoặc NumPy)"""
         try:
-            img = np.array(pil_image)
+            img = np.asarray(image)
             if len(img.shape) == 3:
                 gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
             else:
@@ -103,10 +345,60 @@ class InvoiceRecognizer:
             kernel = np.ones((2, 2), np.uint8)
             eroded = cv2.erode(binary, kernel, iterations=1)
             final_img = cv2.cvtColor(eroded, cv2.COLOR_GRAY2RGB)
-            return Image.fromarray(final_img)
+            return final_img if isinstance(image, np.ndarray) else Image.fromarray(final_img)
         except Exception as e:
             print(f"⚠️ Lỗi preprocess, dùng ảnh gốc: {e}")
-            return pil_image
+            return image
+
+    def normalize_resolution(self, image):
+        """Thu nhỏ ảnh chụp độ phân giải cao (12MP...) -> (ảnh, tỉ lệ scale so với ảnh gốc)"""
+        w, h = self.image_size(image)
+        longest = max(w, h)
+        if not self.max_image_side or longest <= self.max_image_side:
+            return image, 1.0
+        scale = self.max_image_side / longest
+        new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if isinstance(image, np.ndarray):
+            return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA), scale
+        return image.resize(new_size, Image.Resampling.LANCZOS), scale
+
+    def find_table_region(self, image):
+        """
+        Tìm vùng bảng hàng hóa dựa trên các đường kẻ ngang (dải mực liên tục dài >= 1/3 chiều rộng).
+        Trả về (x0, y0, x1, y1) hoặc None nếu không chắc chắn (khi đó chạy trên toàn ảnh).
+        """
+        try:
+            img = np.asarray(image)
+            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if len(img.shape) == 3 else img
+            h, w = gray.shape
+            _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, w // 3), 1))
+            rule_lines = cv2.morphologyEx(ink, cv2.MORPH_OPEN, kernel)
+            line_rows = np.where(rule_lines.any(axis=1))[0]
+            if line_rows.size == 0:
+                return None
+
+            top, bottom = int(line_rows.min()), int(line_rows.max())
+            # Chỉ có 1 đường kẻ (hoặc các đường quá sát nhau) -> không xác định được bảng
+            if bottom - top < h * TABLE_MIN_HEIGHT_RATIO:
+                return None
+
+            line_cols = np.where(rule_lines[top:bottom + 1].any(axis=0))[0]
+            margin = max(2, int(h * 0.01))
+            region = (
+                max(0, int(line_cols.min()) - margin), max(0, top - margin),
+                min(w, int(line_cols.max()) + margin + 1), min(h, bottom + margin + 1)
+            )
+
+            # Vùng bảng gần bằng cả ảnh -> crop không đáng
+            area = (region[2] - region[0]) * (region[3] - region[1])
+            if area > w * h * TABLE_MAX_AREA_RATIO:
+                return None
+            return region
+        except Exception as e:
+            print(f"⚠️ Lỗi tìm vùng bảng, dùng toàn ảnh: {e}")
+            return None
 
     def normalize_box(self, box, width, height):
         return [
@@ -116,35 +408,343 @@ class InvoiceRecognizer:
             int(max(0, min(1000, box[3] / height * 1000)))
         ]
 
+    def _recognize_one(self, crop):
+        """
+        Nhận dạng 1 vùng chữ, lỗi thì trả về chuỗi rỗng (box sẽ bị bỏ qua).
+        Giống Predictor.predict nhưng chọn greedy/beam search theo self.beamsearch
+        (weights VietOCR có thể dùng chung giữa các tier khác cách decode).
+        """
+        try:
+            config = self.vietocr.config
+            dataset_cfg = config['dataset']
+            img = process_input(
+                crop, dataset_cfg['image_height'], dataset_cfg['image_min_width'], dataset_cfg['image_max_width']
+            ).to(config['device'])
+            if self.beamsearch:
+                sent = translate_beam_search(img, self.vietocr.model)
+            else:
+                sent_ids, _ = translate(img, self.vietocr.model)
+                sent = sent_ids[0].tolist()
+            return self.vietocr.vocab.decode(sent)
+        except Exception:
+            return ""
+
+    def recognize_batch(self, crops, batch_size=None):
+        """
+        Nhận dạng nhiều vùng chữ bằng VietOCR theo lô.
+        - Mỗi ảnh được chuẩn hóa về chiều cao cố định (process_input của VietOCR),
+          chiều rộng sau chuẩn hóa được làm tròn nên dùng luôn làm "bucket".
+        - Chỉ gom các ảnh cùng chiều rộng -> không cần padding -> kết quả giống hệt chạy từng ảnh.
+        Trả về List[str] cùng thứ tự với crops.
+        """
+        batch_size = max(1, int(batch_size or self.rec_batch_size))
+        config = self.vietocr.config
+
+        # Beam search của VietOCR không hỗ trợ batch -> chạy từng ảnh
+        if batch_size == 1 or self.beamsearch:
+            return [self._recognize_one(c) for c in crops]
+
+        dataset_cfg = config['dataset']
+        texts = [""] * len(crops)
+        buckets = defaultdict(list)
+        for idx, crop in enumerate(crops):
+            try:
+                tensor = process_input(
+                    crop, dataset_cfg['image_height'],
+                    dataset_cfg['image_min_width'], dataset_cfg['image_max_width']
+                )
+            except Exception:
+                continue  # Ảnh lỗi (vd: crop rộng 0px) -> bỏ qua như luồng cũ
+            buckets[tensor.shape[-1]].append((idx, tensor))
+
+        for width in sorted(buckets):
+            items = buckets[width]
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                try:
+                    batch = torch.cat([t for _, t in chunk], 0).to(config['device'])
+                    sent_ids, _ = translate(batch, self.vietocr.model)
+                    sents = self.vietocr.vocab.batch_decode(sent_ids.tolist())
+                except Exception as e:
+                    print(f"⚠️ [OCR] Lỗi nhận dạng theo lô ({len(chunk)} ảnh), chạy lại từng ảnh: {e}")
+                    sents = [self._recognize_one(crops[idx]) for idx, _ in chunk]
+
+                for (idx, _), sent in zip(chunk, sents):
+                    texts[idx] = sent
+
+        return texts
+
     def predict(self, image_path_or_file):
         """
         Hàm chính: Paddle (Det) -> VietOCR (Rec) -> LayoutLMv3 -> Result
+        Nhận ảnh hoặc file PDF (nhiều trang) -> List[str] dạng "name | qty | amount | price"
+        (dùng predict_document nếu cần dữ liệu có cấu trúc: OcrRow kèm box + độ tin cậy)
         """
-        # Load ảnh
-        image = Image.open(image_path_or_file).convert("RGB")
-        w_orig, h_orig = image.size
-        
-        # 1. Preprocess
-        processed_img = self.aggressive_preprocess(image)
-        img_array = np.array(processed_img)
-        
-        # 2. OCR Pipeline
-        words = []
-        boxes = []
-        
+        return self.predict_document(image_path_or_file)["lines"]
+
+    def predict_document(self, image_path_or_file):
+        """
+        Giống predict nhưng trả thêm dữ liệu có cấu trúc, thông tin từng trang và số liệu từng stage:
+        { "rows": [OcrRow], "lines": [...], "pages": [{"page", "source", "seconds", "rows"}], "metrics": {"stages", "counts"} }
+        source = "ocr" (chạy Det + Rec) hoặc "text_layer" (PDF có sẵn text, bỏ qua OCR)
+        """
+        with self._active_lock:
+            self._active_jobs += 1
+        try:
+            # PDF vẫn chạy tuần tự từng trang (giữ tối đa 1 bitmap trang trong bộ nhớ)
+            if self.pipeline is not None and not self.is_pdf(image_path_or_file):
+                job = {"source": image_path_or_file, "stats": OcrJobStats(),
+                       "submitted": time.perf_counter(), "seconds": 0.0}
+                return self.pipeline.submit(job).result()
+            return self._predict_document(image_path_or_file)
+        finally:
+            with self._active_lock:
+                self._active_jobs -= 1
+
+    def _predict_document(self, image_path_or_file):
+        """image_path_or_file: đường dẫn, file-like hoặc bytes (upload giữ trong bộ nhớ)"""
+        stats = OcrJobStats()
+
+        if self.is_pdf(image_path_or_file):
+            rows = []
+            pages = []
+            for page_result in self.predict_pdf_pages(image_path_or_file, stats=stats):
+                rows.extend(page_result.pop("ocr_rows"))
+                pages.append(page_result)
+        else:
+            start = time.perf_counter()
+            # Giải mã 1 lần thành mảng RGB, dùng chung cho preprocess/detection/crop
+            with stats.stage("load"):
+                image = self._load_image(image_path_or_file)
+            stats.count("pages")
+            rows = self._predict_image(image, stats)
+            pages = [{"page": 1, "source": "ocr", "seconds": time.perf_counter() - start, "rows": len(rows)}]
+
+        return {
+            "rows": rows,
+            "lines": [row.to_line() for row in rows],
+            "pages": pages,
+            "metrics": stats.to_dict()
+        }
+
+    def _load_image(self, image_path_or_file):
+        if isinstance(image_path_or_file, (bytes, bytearray, memoryview)):
+            data = bytes(image_path_or_file)
+        elif hasattr(image_path_or_file, "read"):
+            data = image_path_or_file.read()
+        else:
+            with open(image_path_or_file, "rb") as f:
+                data = f.read()
+        return self.decode_image(data)
+
+    # --- PDF ---
+
+    @staticmethod
+    def is_pdf(image_path_or_file):
+        """Nhận diện PDF theo magic bytes (không tin vào đuôi file)"""
+        try:
+            if isinstance(image_path_or_file, (bytes, bytearray, memoryview)):
+                head = bytes(image_path_or_file[:5])
+            elif hasattr(image_path_or_file, "read"):
+                pos = image_path_or_file.tell()
+                head = image_path_or_file.read(5)
+                image_path_or_file.seek(pos)
+            else:
+                with open(image_path_or_file, "rb") as f:
+                    head = f.read(5)
+            return head == b"%PDF-"
+        except Exception:
+            return False
+
+    def iter_pdf_pages(self, pdf_path_or_file, dpi=None, stats=None):
+        """
+        Generator: mỗi lần chỉ rasterize 1 trang -> chỉ có 1 bitmap trang trong bộ nhớ.
+        Yield (page_no, image, text_words); text_words = [(text, box_0_1000)] nếu trang có text layer.
+        """
+        dpi = dpi or self.pdf_dpi
+        stats = stats or OcrJobStats()
+        if isinstance(pdf_path_or_file, (bytes, bytearray, memoryview)):
+            doc = fitz.open(stream=bytes(pdf_path_or_file), filetype="pdf")
+        elif hasattr(pdf_path_or_file, "read"):
+            doc = fitz.open(stream=pdf_path_or_file.read(), filetype="pdf")
+        else:
+            doc = fitz.open(pdf_path_or_file)
+
+        try:
+            for page_index in range(doc.page_count):
+                with stats.stage("load"):
+                    page = doc.load_page(page_index)
+                    text_words = self._extract_text_layer(page)
+
+                    pix = page.get_pixmap(dpi=dpi, alpha=False)
+                    # Copy ra mảng NumPy riêng để giải phóng pixmap ngay
+                    image = np.frombuffer(pix.samples, np.uint8).reshape(
+                        pix.height, pix.stride
+                    )[:, :pix.width * 3].reshape(pix.height, pix.width, 3).copy()
+                    pix = None
+                stats.count("pages")
+
+                yield page_index + 1, image, text_words
+        finally:
+            doc.close()
+
+    def _extract_text_layer(self, page):
+        """
+        Lấy chữ + tọa độ có sẵn của PDF sinh từ phần mềm.
+        Các từ cùng dòng được gộp thành cụm (giống box của text detector),
+        tách cụm khi khoảng trống ngang lớn hơn chiều cao dòng (sang cột khác).
+        """
+        raw_words = page.get_text("words")
+        if len([w for w in raw_words if w[4].strip()]) < PDF_TEXT_LAYER_MIN_WORDS:
+            return []
+
+        page_w, page_h = page.rect.width, page.rect.height
+        raw_words.sort(key=lambda w: (w[5], w[6], w[0]))  # block, line, x0
+
+        segments = []
+        current = None
+        for x0, y0, x1, y1, text, block_no, line_no, _ in raw_words:
+            if not text.strip(): continue
+            line_key = (block_no, line_no)
+            if (current and current["key"] == line_key
+                    and x0 - current["box"][2] <= (y1 - y0)):
+                current["text"] += " " + text
+                current["box"][2] = max(current["box"][2], x1)
+                current["box"][1] = min(current["box"][1], y0)
+                current["box"][3] = max(current["box"][3], y1)
+            else:
+                if current: segments.append(current)
+                current = {"key": line_key, "text": text, "box": [x0, y0, x1, y1]}
+        if current: segments.append(current)
+
+        return [(seg["text"], self.normalize_box(seg["box"], page_w, page_h)) for seg in segments]
+
+    def predict_pdf_pages(self, pdf_path_or_file, dpi=None, stats=None):
+        """Generator: xử lý lần lượt từng trang PDF, yield kết quả + thời gian của trang đó"""
+        stats = stats or OcrJobStats()
+        for page_no, image, text_words in self.iter_pdf_pages(pdf_path_or_file, dpi, stats):
+            start = time.perf_counter()
+            if text_words:
+                words = [t for t, _ in text_words]
+                boxes = [b for _, b in text_words]
+                stats.count("text_layer_pages")
+                stats.count("words", len(words))
+                rows = self._extract_rows(image, words, boxes, stats, page=page_no)
+                source = "text_layer"
+            else:
+                rows = self._predict_image(image, stats, page=page_no)
+                source = "ocr"
+
+            yield {
+                "page": page_no, "source": source,
+                "seconds": time.perf_counter() - start, "rows": len(rows),
+                "ocr_rows": rows
+            }
+
+    # --- PIPELINE NHIỀU STAGE (nhiều hóa đơn ảnh chạy gối nhau) ---
+    # Mỗi stage nhận/trả về dict job; "seconds" cộng dồn thời gian xử lý thực tế (không tính thời gian chờ hàng đợi)
+
+    def _pipeline_prepare(self, job):
+        start = time.perf_counter()
+        with job["stats"].stage("load"):
+            job["image"] = self._load_image(job["source"])
+        job["stats"].count("pages")
+        job["page"] = self._prepare_page(job["image"], job["stats"])
+        job["seconds"] += time.perf_counter() - start
+        return job
+
+    def _pipeline_detect(self, job):
+        start = time.perf_counter()
+        self._detect_page(job["page"], job["stats"])
+        job["seconds"] += time.perf_counter() - start
+        return job
+
+    def _pipeline_recognize(self, job):
+        start = time.perf_counter()
+        job["words"], job["boxes"] = self._recognize_page(job["page"], job["stats"])
+        job["page"] = None  # Giải phóng ảnh đã preprocess + các vùng chữ
+        job["seconds"] += time.perf_counter() - start
+        return job
+
+    def _pipeline_layout(self, job):
+        """Stage cuối: LayoutLMv3 + gom dòng -> kết quả giống _predict_document"""
+        stats = job["stats"]
+        start = time.perf_counter()
+        rows = self._extract_rows(job["image"], job["words"], job["boxes"], stats) if job["words"] else []
+        seconds = job["seconds"] + time.perf_counter() - start
+
+        # Thời gian nằm chờ trong hàng đợi giữa các stage + tỉ lệ bận hiện tại của từng stage
+        stats.add_time("pipeline_wait", max(0.0, time.perf_counter() - job["submitted"] - seconds))
+        for stage, utilization in self.pipeline.utilization().items():
+            stats.set_gauge(f"pipeline_utilization_{stage}", utilization)
+
+        return {
+            "rows": rows,
+            "lines": [row.to_line() for row in rows],
+            "pages": [{"page": 1, "source": "ocr", "seconds": seconds, "rows": len(rows)}],
+            "metrics": stats.to_dict()
+        }
+
+    # --- PIPELINE 1 ẢNH ---
+
+    def _predict_image(self, image, stats=None, page=1):
+        stats = stats or OcrJobStats()
+        words, boxes = self._ocr_words(image, stats)
+        if not words:
+            return []
+        return self._extract_rows(image, words, boxes, stats, page)
+
+    def _ocr_words(self, image, stats=None):
+        """Detection (Paddle) + Recognition (VietOCR) -> (words, boxes chuẩn hóa 0-1000)"""
+        stats = stats or OcrJobStats()
+        page = self._prepare_page(image, stats)
+        self._detect_page(page, stats)
+        return self._recognize_page(page, stats)
+
+    def _prepare_page(self, image, stats):
+        """Chuẩn hóa độ phân giải + cắt vùng bảng + preprocess -> dict trạng thái của trang cho các bước sau"""
+        w_orig, h_orig = self.image_size(image)
+
+        with stats.stage("preprocess"):
+            # 1. Chuẩn hóa độ phân giải + chỉ giữ vùng bảng hàng hóa (tất cả trên mảng NumPy)
+            work_img, scale = self.normalize_resolution(np.asarray(image))
+            offset_x, offset_y = 0, 0
+            if self.table_crop:
+                region = self.find_table_region(work_img)
+                if region:
+                    offset_x, offset_y = region[0], region[1]
+                    work_img = work_img[region[1]:region[3], region[0]:region[2]]
+                    stats.count("table_crops")
+            
+            # 2. Preprocess
+            img_array = self.aggressive_preprocess(work_img)
+
+        return {
+            "img_array": img_array, "scale": scale, "offset": (offset_x, offset_y),
+            "size": (w_orig, h_orig), "crops": [], "crop_boxes": []
+        }
+
+    def _detect_page(self, page, stats):
+        """Detection (Paddle) + cắt toàn bộ vùng chữ (ghi vào page["crops"] / page["crop_boxes"])"""
+        img_array = page["img_array"]
         try:
             # A. Detection
-            dt_boxes, _ = self.ocr_engine.text_detector(img_array)
+            with stats.stage("detection"):
+                with self._det_lock:
+                    # Detector có thể dùng chung giữa các tier -> đặt kích thước đầu vào của tier này mỗi lần gọi
+                    set_detector_limit_side_len(self.text_detector, self.det_limit_side_len)
+                    dt_boxes, _ = self.text_detector(img_array)
             
             if dt_boxes is None or (isinstance(dt_boxes, np.ndarray) and dt_boxes.size == 0):
                 print("⚠️ [OCR] Không tìm thấy vùng chữ nào.")
-                return []
+                return page
                 
             if isinstance(dt_boxes, np.ndarray):
                 dt_boxes = dt_boxes.tolist()
+            stats.count("boxes", len(dt_boxes))
 
-            # B. Recognition
-            for i, box in enumerate(dt_boxes):
+            # B. Cắt toàn bộ vùng chữ trước, sau đó nhận dạng theo lô
+            for box in dt_boxes:
                 try:
                     x_vals = [c[0] for c in box]
                     y_vals = [c[1] for c in box]
@@ -153,78 +753,236 @@ class InvoiceRecognizer:
                     
                     if x2 <= x1 or y2 <= y1: continue
                     
-                    cropped = processed_img.crop((int(x1), int(y1), int(x2), int(y2)))
-                    text = self.vietocr.predict(cropped)
-                    
-                    if not text.strip(): continue
-                    
-                    norm_box = self.normalize_box([x1, y1, x2, y2], w_orig, h_orig)
-                    words.append(text)
-                    boxes.append(norm_box)
-                    
+                    # VietOCR nhận ảnh PIL -> chỉ chuyển đổi phần vùng chữ nhỏ
+                    page["crops"].append(Image.fromarray(
+                        img_array[max(0, int(y1)):int(y2), max(0, int(x1)):int(x2)]
+                    ))
+                    page["crop_boxes"].append([x1, y1, x2, y2])
                 except Exception:
-                    continue 
-                    
+                    continue
         except Exception as e:
             print(f"❌ [OCR Error] Lỗi trong quá trình OCR: {e}")
             traceback.print_exc()
-            return []
+            page["crops"], page["crop_boxes"] = [], []
+        return page
 
-        if not words:
-            return []
+    def _recognize_page(self, page, stats):
+        """Recognition (VietOCR) các vùng chữ đã cắt -> (words, boxes chuẩn hóa 0-1000 theo ảnh gốc)"""
+        words = []
+        boxes = []
+        if not page["crops"]:
+            return words, boxes
 
-        # 3. Inference LayoutLMv3
+        w_orig, h_orig = page["size"]
+        offset_x, offset_y = page["offset"]
+        scale = page["scale"]
         try:
-            encoding = self.processor(
-                images=[image], text=[words], boxes=[boxes],
-                return_tensors="pt", truncation=True, padding="max_length", max_length=512
-            )
-            for k, v in encoding.items(): encoding[k] = v.to(self.device)
+            # C. Recognition (giữ nguyên thứ tự các box)
+            with stats.stage("recognition"):
+                if self.microbatch:
+                    texts = self._rec_batcher.submit(page["crops"])
+                else:
+                    texts = self.recognize_batch(page["crops"])
+            for text, (x1, y1, x2, y2) in zip(texts, page["crop_boxes"]):
+                if not text.strip(): continue
 
-            with torch.no_grad():
-                outputs = self.model(**encoding)
+                # Đưa box từ ảnh đã crop/thu nhỏ về tọa độ ảnh gốc
+                orig_box = [
+                    (x1 + offset_x) / scale, (y1 + offset_y) / scale,
+                    (x2 + offset_x) / scale, (y2 + offset_y) / scale
+                ]
+                norm_box = self.normalize_box(orig_box, w_orig, h_orig)
+                words.append(text)
+                boxes.append(norm_box)
+                    
+        except Exception as e:
+            print(f"❌ [OCR Error] Lỗi trong quá trình OCR: {e}")
+            traceback.print_exc()
+            return [], []
 
-            predictions = outputs.logits.argmax(-1).squeeze().tolist()
-            word_ids = encoding.word_ids()
-            id2label = self.model.config.id2label
-            
-            final_labels = []
-            word_labels_map = {}
-            for idx, word_id in enumerate(word_ids):
-                if word_id is None: continue
-                if word_id not in word_labels_map: word_labels_map[word_id] = []
-                word_labels_map[word_id].append(id2label[predictions[idx]])
-
-            for i in range(len(words)):
-                if i in word_labels_map:
-                    counts = Counter(word_labels_map[i])
-                    final_labels.append(counts.most_common(1)[0][0])
-                else:
-                    final_labels.append("O")
+        stats.count("words", len(words))
+        return words, boxes
+
+    def _label_words(self, image, words, boxes):
+        """
+        Gán nhãn LayoutLMv3 cho từng cụm chữ bằng cửa sổ trượt:
+        - Chuỗi token được cắt thành các cửa sổ dài tối đa layout_window, chồng lấn layout_stride token
+          -> hóa đơn dài không bị mất chữ sau token thứ 512.
+        - Tất cả cửa sổ chạy chung 1 batch, chỉ pad tới cửa sổ dài nhất
+          -> hóa đơn ngắn không phải tính đủ 512 token.
+        - Chữ nằm trong vùng chồng lấn lấy nhãn từ cửa sổ mà nó nằm "giữa" nhất (nhiều ngữ cảnh nhất).
+        Trả về (nhãn, xác suất softmax trung bình của các token mang nhãn đó) cho từng cụm chữ.
+        """
+        encoding = self._encode_layout(image, words, boxes)
+        if self.microbatch:
+            predictions, probs = self._layout_batcher.submit([encoding])[0]
+        else:
+            predictions, probs = self._run_layout_batch([encoding])[0]
+        id2label = self.model.config.id2label
+
+        # word_id -> (độ "giữa" trong cửa sổ, danh sách (nhãn, xác suất) của token)
+        best_window = {}
+        for w_idx, window_preds in enumerate(predictions):
+            word_ids = encoding.word_ids(w_idx)
+            positions = [i for i, wid in enumerate(word_ids) if wid is not None]
+            if not positions: continue
+            first, last = positions[0], positions[-1]
+
+            window_labels = {}
+            window_context = {}
+            for idx in positions:
+                word_id = word_ids[idx]
+                window_labels.setdefault(word_id, []).append(
+                    (id2label[window_preds[idx]], probs[w_idx][idx])
+                )
+                context = min(idx - first, last - idx)
+                window_context[word_id] = min(window_context.get(word_id, context), context)
+
+            for word_id, labels in window_labels.items():
+                context = window_context[word_id]
+                if word_id not in best_window or context > best_window[word_id][0]:
+                    best_window[word_id] = (context, labels)
+
+        final_labels = []
+        final_probs = []
+        for i in range(len(words)):
+            if i in best_window:
+                token_labels = best_window[i][1]
+                label = Counter(l for l, _ in token_labels).most_common(1)[0][0]
+                label_probs = [p for l, p in token_labels if l == label]
+                final_labels.append(label)
+                final_probs.append(sum(label_probs) / len(label_probs))
+            else:
+                final_labels.append("O")
+                final_probs.append(0.0)
+        return final_labels, final_probs
+
+    def _encode_layout(self, image, words, boxes):
+        """Tokenize + cắt cửa sổ trượt cho 1 trang -> BatchEncoding (mỗi cửa sổ là 1 dòng của batch)"""
+        encoding = self.processor(
+            images=[image], text=[words], boxes=[boxes],
+            return_tensors="pt", truncation=True, padding="longest",
+            max_length=self.layout_window, stride=self.layout_stride,
+            return_overflowing_tokens=True
+        )
+        encoding.pop("overflow_to_sample_mapping", None)
+
+        # Processor trả pixel_values dạng list khi có overflow -> ghép lại thành 1 tensor
+        if isinstance(encoding["pixel_values"], list):
+            encoding["pixel_values"] = torch.stack(encoding["pixel_values"])
+        return encoding
+
+    def _run_layout_batch(self, encodings):
+        """
+        Chạy LayoutLMv3 cho cửa sổ của 1 hoặc nhiều trang (có thể từ nhiều request) trong 1 lượt forward.
+        Cửa sổ của các trang khác nhau được pad tới độ dài dài nhất (attention_mask = 0 ở phần pad).
+        Trả về [(predictions, probs)] theo từng encoding, mỗi phần tử là list theo cửa sổ -> token.
+        """
+        if len(encodings) == 1:
+            batch = {k: v for k, v in encodings[0].items()}
+        else:
+            max_len = max(e["input_ids"].shape[1] for e in encodings)
+            pad_values = {"input_ids": self.processor.tokenizer.pad_token_id, "attention_mask": 0, "bbox": 0}
+            batch = {}
+            for key, pad_value in pad_values.items():
+                tensors = []
+                for e in encodings:
+                    t = e[key]
+                    extra = max_len - t.shape[1]
+                    if extra:
+                        # bbox có thêm chiều toạ độ cuối cùng -> chỉ pad chiều token
+                        pad = (0, 0, 0, extra) if t.dim() == 3 else (0, extra)
+                        t = torch.nn.functional.pad(t, pad, value=pad_value)
+                    tensors.append(t)
+                batch[key] = torch.cat(tensors)
+            batch["pixel_values"] = torch.cat([e["pixel_values"] for e in encodings])
+
+        model_inputs = {k: v.to(self.device) for k, v in batch.items()}
+        with torch.no_grad():
+            outputs = self.model(**model_inputs)
+
+        probs, predictions = outputs.logits.softmax(-1).max(-1)
+        predictions = predictions.tolist()
+        probs = probs.tolist()
+
+        results = []
+        offset = 0
+        for e in encodings:
+            n_windows = e["input_ids"].shape[0]
+            results.append((predictions[offset:offset + n_windows], probs[offset:offset + n_windows]))
+            offset += n_windows
+        return results
+
+    def _extract_rows(self, image, words, boxes, stats=None, page=1):
+        """LayoutLMv3 (hoặc mẫu bố cục đã học) gán nhãn cho từng cụm chữ -> gom thành dòng -> List[OcrRow]"""
+        stats = stats or OcrJobStats()
+        h_orig = self.image_size(image)[1]
+
+        try:
+            # 3a. Mẫu bố cục quen -> gán cột theo vị trí, không cần LayoutLMv3
+            header = None
+            if self.templates is not None:
+                header = self.templates.find_header(words, boxes)
+                output_rows = self._extract_rows_by_template(header, words, boxes, h_orig, stats, page)
+                if output_rows is not None:
+                    stats.count("rows", len(output_rows))
+                    return output_rows
+
+            # 3b. Inference LayoutLMv3
+            start = time.perf_counter()
+            with stats.stage("layoutlm"):
+                final_labels, final_probs = self._label_words(image, words, boxes)
+            layout_seconds = time.perf_counter() - start
 
             # 4. Post-processing
-            structured_rows = self._clean_and_group_data(words, final_labels, boxes, h_orig)
+            with stats.stage("grouping"):
+                structured_rows = self._clean_and_group_data(words, final_labels, boxes, h_orig, final_probs)
             
-            # 5. Output Formatting (CẬP NHẬT DẤU NGĂN CÁCH)
-            output_lines = []
-            for row in structured_rows:
-                name = row.get("ItemName", "")
-                qty = row.get("Quantity", "1").replace(",", ".")
-                price = row.get("UnitPrice", "0").replace(",", "").replace(".", "")
-                amount = row.get("Amount", "0").replace(",", "").replace(".", "")
-
-                if name:
-                    # [QUAN TRỌNG] Thêm dấu gạch đứng | vào đây
-                    line_str = f"{name} | {qty} | {amount} | {price}"
-                    output_lines.append(line_str)
-                    
-            return output_lines
+            # 5. Output: giữ nguyên số liệu từng cột thay vì nối thành chuỗi "name | qty | amount | price"
+            output_rows = [
+                OcrRow.from_group(row, page=page) for row in structured_rows if row.get("ItemName")
+            ]
+
+            if self.templates is not None and self.templates.learn(header, output_rows, layout_seconds, len(words)):
+                stats.count("template_learned")
+
+            stats.count("rows", len(output_rows))
+            return output_rows
 
         except Exception as e:
             print(f"❌ [AI Error] Lỗi phân tích LayoutLM: {e}")
             traceback.print_exc()
             return []
 
+    def _extract_rows_by_template(self, header, words, boxes, h_img, stats, page=1):
+        """
+        Gán cột theo mẫu bố cục đã học -> List[OcrRow], hoặc None nếu không có mẫu / mẫu không đủ tin cậy
+        (khi đó gọi LayoutLMv3 như bình thường). Độ tin cậy của mọi cột = tỉ lệ chữ gán được cột.
+        """
+        template = self.templates.match(header)
+        if template is None:
+            stats.count("template_misses")
+            return None
+
+        start = time.perf_counter()
+        with stats.stage("template"):
+            labels, coverage = self.templates.assign(template, header, words, boxes)
+            output_rows = []
+            if coverage >= self.templates.min_coverage:
+                structured_rows = self._clean_and_group_data(words, labels, boxes, h_img, [coverage] * len(words))
+                output_rows = [
+                    OcrRow.from_group(row, page=page) for row in structured_rows if row.get("ItemName")
+                ]
+
+        if not output_rows:
+            stats.count("template_fallbacks")
+            return None
+
+        stats.count("template_hits")
+        saved = self.templates.estimate_saved_seconds(len(words), time.perf_counter() - start)
+        stats.count("template_saved_ms", int(saved * 1000))
+        return output_rows
+
     # --- CÁC HÀM HỖ TRỢ ---
 
     def _is_same_line(self, box1, box2, img_height, iou_threshold=0.5):
@@ -238,14 +996,15 @@ class InvoiceRecognizer:
         if min_height == 0: return False
         return (intersection / min_height) > iou_threshold
 
-    def _clean_and_group_data(self, words, labels, boxes, h_img):
+    def _clean_and_group_data(self, words, labels, boxes, h_img, probs=None):
+        if probs is None: probs = [1.0] * len(words)
         entities = []
-        for word, label, box in zip(words, labels, boxes):
+        for word, label, box, prob in zip(words, labels, boxes, probs):
             clean_label = label.replace("B-", "").replace("I-", "")
             if clean_label in HEADER_MAP:
                 entities.append({
                     "text": word, "label": HEADER_MAP[clean_label], 
-                    "box": box, "center_y": (box[1] + box[3]) / 2, "x1": box[0]
+                    "box": box, "center_y": (box[1] + box[3]) / 2, "x1": box[0], "prob": prob
                 })
 
         if not entities: return []
@@ -281,11 +1040,25 @@ class InvoiceRecognizer:
             
             curr_row.sort(key=lambda x: x["x1"])
             row_dict = { "ItemName": "", "Quantity": "", "UnitPrice": "", "Amount": "" }
+            field_boxes = {}
+            field_probs = defaultdict(list)
             
             for ent in curr_row:
                 key = ent["label"]
                 if row_dict[key]: row_dict[key] += " " + ent["text"]
                 else: row_dict[key] = ent["text"]
+
+                # Box bao của cả cột + xác suất nhãn từng chữ
+                b = ent["box"]
+                if key in field_boxes:
+                    fb = field_boxes[key]
+                    field_boxes[key] = [min(fb[0], b[0]), min(fb[1], b[1]), max(fb[2], b[2]), max(fb[3], b[3])]
+                else:
+                    field_boxes[key] = list(b)
+                field_probs[key].append(ent["prob"])
+
+            row_dict["boxes"] = field_boxes
+            row_dict["confidence"] = {k: round(sum(v) / len(v), 4) for k, v in field_probs.items()}
             
             if row_dict["ItemName"]:
                 final_rows_data.append(row_dict)
@@ -0,0 +1,745 @@
+# app/ocr_benchmark.py
+"""
+Benchmark các bước của InvoiceRecognizer.
+
+Cách chạy (từ thư mục server):
+    # Thời gian/hóa đơn theo batch size VietOCR
+    python -m app.ocr_benchmark rec uploads/temp_ocr/VN_0153.jpg --batch-sizes 1 8 32 --repeat 3
+
+    # LayoutLMv3: padding cố định 512 (cách cũ) vs cửa sổ trượt + dynamic padding
+    python -m app.ocr_benchmark layout --words 40 150 600 --repeat 5
+
+    # Độ chính xác/độ trễ của các chế độ suy luận CPU so với fp32 (mặc định dùng bộ ảnh mẫu trong uploads/)
+    python -m app.ocr_benchmark modes --repeat 3
+
+    # Hóa đơn giả lập (không cần ảnh thật): thông lượng, p50/p95 từng stage, độ chính xác dòng + match
+    python -m app.ocr_benchmark synthetic --invoices 20 --rows 5 25 --noise 0.04 --blur 0.8 --rotate 2
+
+    # Micro-batching giữa các request: thông lượng + p95 với 1/4/16 client đồng thời (tắt vs bật)
+    python -m app.ocr_benchmark concurrency --clients 1 4 16 --jobs-per-client 4
+
+    # Thời gian khởi tạo + RSS: Paddle chỉ detector vs PaddleOCR đầy đủ (mỗi lần đo 1 process mới)
+    python -m app.ocr_benchmark startup --repeat 3
+
+    # Các tier OCR (fast vs accurate) trên cùng bộ hóa đơn giả lập: độ trễ + recall dòng
+    python -m app.ocr_benchmark tiers --invoices 20 --rows 5 25
+
+    # Cache mẫu bố cục: tỉ lệ hit, thời gian tiết kiệm và recall so với luôn chạy LayoutLMv3
+    python -m app.ocr_benchmark templates --invoices 30 --confirmations 3
+
+    # Pipeline nhiều stage: thông lượng khi nhiều hóa đơn cùng chạy (tuần tự vs pipeline) + tỉ lệ bận từng stage
+    python -m app.ocr_benchmark pipeline --clients 1 4 8 --jobs-per-client 4
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import difflib
+import tempfile
+import statistics
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from app.my_ocr_core import InvoiceRecognizer
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(SERVER_DIR, 'app')
+
+# Bộ ảnh cố định đi kèm repo để so sánh các chế độ suy luận
+SAMPLE_IMAGES = [
+    os.path.join(SERVER_DIR, 'uploads', 'temp_ocr', 'VN_0153.jpg'),
+    os.path.join(SERVER_DIR, 'uploads', 'avatars', 'bill_mau_moi_10.png'),
+    os.path.join(SERVER_DIR, 'uploads', 'avatars', 'hoa_don_2.png'),
+]
+
+
+# --- DỮ LIỆU GIẢ LẬP ---
+
+def load_product_names():
+    """Tên sản phẩm thật từ all_products.json + bookstore.json để sinh hóa đơn giả"""
+    names = []
+    with open(os.path.join(APP_DIR, 'all_products.json'), 'r', encoding='utf-8') as f:
+        for items in json.load(f).values():
+            names.extend(items)
+    with open(os.path.join(APP_DIR, 'bookstore.json'), 'r', encoding='utf-8') as f:
+        names.extend(book['name'] for book in json.load(f))
+    return names
+
+
+def synthetic_layout_words(n_words, names, seed=0):
+    """
+    Sinh (words, boxes) giống output của Det + Rec: mỗi dòng 4 cụm (tên, SL, đơn giá, thành tiền),
+    box chuẩn hóa 0-1000 xếp từ trên xuống dưới.
+    """
+    rng = random.Random(seed)
+    words, boxes = [], []
+    n_rows = max(1, n_words // 4)
+    row_h = max(1, min(30, 900 // n_rows))
+    for r in range(n_rows):
+        y1 = 50 + r * row_h
+        y2 = y1 + max(1, row_h - 2)
+        qty = rng.randint(1, 20)
+        price = rng.randint(5, 500) * 1000
+        for text, (x1, x2) in [
+            (rng.choice(names), (30, 500)),
+            (str(qty), (520, 580)),
+            (f"{price:,}", (600, 760)),
+            (f"{qty * price:,}", (780, 970)),
+        ]:
+            words.append(text)
+            boxes.append([x1, y1, x2, y2])
+    return words[:n_words], boxes[:n_words]
+
+
+# --- BENCHMARK VIETOCR BATCH ---
+
+def bench_batch_sizes(recognizer, image_paths, batch_sizes, repeat=3):
+    """
+    Chạy predict trên từng ảnh với mỗi batch size, trả về dict:
+    { batch_size: {"mean": giây/hóa đơn, "p50": ..., "identical": bool} }
+    "identical" so sánh output với batch size đầu tiên để chắc chắn batching không đổi kết quả.
+    """
+    report = {}
+    baseline = None
+    original_bs = recognizer.rec_batch_size
+
+    try:
+        for bs in batch_sizes:
+            recognizer.rec_batch_size = bs
+            durations = []
+            outputs = []
+            for path in image_paths:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    lines = recognizer.predict(path)
+                    durations.append(time.perf_counter() - start)
+                outputs.append(lines)
+
+            if baseline is None:
+                baseline = outputs
+
+            report[bs] = {
+                "mean": statistics.mean(durations),
+                "p50": statistics.median(durations),
+                "identical": outputs == baseline
+            }
+    finally:
+        recognizer.rec_batch_size = original_bs
+
+    return report
+
+
+def run_rec(args, recognizer):
+    # Warm-up 1 lần để không tính thời gian khởi tạo lazy của torch/paddle
+    recognizer.predict(args.images[0])
+
+    report = bench_batch_sizes(recognizer, args.images, args.batch_sizes, args.repeat)
+
+    print(f"\n{'batch':>6} | {'mean (s)':>9} | {'p50 (s)':>8} | {'speedup':>7} | output")
+    base_mean = report[args.batch_sizes[0]]["mean"]
+    for bs, r in report.items():
+        speedup = base_mean / r["mean"] if r["mean"] else 0
+        same = "giống" if r["identical"] else "KHÁC"
+        print(f"{bs:>6} | {r['mean']:>9.3f} | {r['p50']:>8.3f} | {speedup:>6.2f}x | {same}")
+
+
+# --- BENCHMARK LAYOUTLMV3 ---
+
+def _label_words_fixed_512(recognizer, image, words, boxes):
+    """Cách cũ: cắt cụt ở 512 token và luôn pad đủ 512 (chỉ dùng để so sánh)"""
+    import torch
+    encoding = recognizer.processor(
+        images=[image], text=[words], boxes=[boxes],
+        return_tensors="pt", truncation=True, padding="max_length", max_length=512
+    )
+    for k, v in encoding.items(): encoding[k] = v.to(recognizer.device)
+    with torch.no_grad():
+        outputs = recognizer.model(**encoding)
+    word_ids = encoding.word_ids()
+    labelled = {w for w in word_ids if w is not None}
+    return outputs, len(labelled)
+
+
+def run_layout(args, recognizer):
+    names = load_product_names()
+    image = Image.new("RGB", (1240, 1754), "white")  # Khổ A4 ~150 DPI
+
+    # "coverage" = số cụm chữ còn nằm trong 512 token đầu (phần còn lại bị cách cũ bỏ mất)
+    print(f"\n{'words':>6} | {'fixed-512 (s)':>13} | {'coverage':>9} | {'window (s)':>10} | {'speedup':>7}")
+    for n_words in args.words:
+        words, boxes = synthetic_layout_words(n_words, names)
+
+        # Warm-up cho từng kích thước
+        _label_words_fixed_512(recognizer, image, words, boxes)
+        recognizer._label_words(image, words, boxes)
+
+        fixed_times, window_times = [], []
+        fixed_labelled = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            _, fixed_labelled = _label_words_fixed_512(recognizer, image, words, boxes)
+            fixed_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            recognizer._label_words(image, words, boxes)
+            window_times.append(time.perf_counter() - start)
+
+        fixed = statistics.median(fixed_times)
+        window = statistics.median(window_times)
+        coverage = f"{fixed_labelled}/{len(words)}"
+        print(f"{n_words:>6} | {fixed:>13.3f} | {coverage:>9} | {window:>10.3f} | "
+              f"{fixed / window if window else 0:>6.2f}x")
+
+
+# --- BENCHMARK CHẾ ĐỘ SUY LUẬN (fp32 / int8 / TorchScript) ---
+
+INFERENCE_MODES = {
+    "fp32": {"inference_mode": "fp32", "torchscript": False},
+    "fp32+ts": {"inference_mode": "fp32", "torchscript": True},
+    "int8": {"inference_mode": "int8", "torchscript": False},
+    "int8+ts": {"inference_mode": "int8", "torchscript": True},
+}
+
+
+def compare_lines(reference, candidate):
+    """(tỉ lệ dòng giống hệt, độ giống ký tự trung bình) của candidate so với reference (fp32)"""
+    if not reference and not candidate:
+        return 1.0, 1.0
+    exact = sum(1 for a, b in zip(reference, candidate) if a == b) / max(len(reference), len(candidate))
+    char_sim = difflib.SequenceMatcher(None, "\n".join(reference), "\n".join(candidate)).ratio()
+    return exact, char_sim
+
+
+def run_modes(args):
+    images = args.images or [p for p in SAMPLE_IMAGES if os.path.exists(p)]
+    reference = None
+
+    print(f"\n{'mode':>8} | {'mean (s)':>9} | {'p50 (s)':>8} | {'speedup':>7} | {'row exact':>9} | {'char sim':>8}")
+    base_mean = None
+    for name in args.modes:
+        recognizer = InvoiceRecognizer(model_dir=SERVER_DIR, **INFERENCE_MODES[name])
+        recognizer.predict(images[0])  # warm-up
+
+        durations = []
+        outputs = []
+        for path in images:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                lines = recognizer.predict(path)
+                durations.append(time.perf_counter() - start)
+            outputs.append(lines)
+
+        # Mode đầu tiên (mặc định fp32) làm chuẩn
+        if reference is None:
+            reference = outputs
+        scores = [compare_lines(ref, out) for ref, out in zip(reference, outputs)]
+        exact = statistics.mean(s[0] for s in scores)
+        char_sim = statistics.mean(s[1] for s in scores)
+
+        mean = statistics.mean(durations)
+        base_mean = base_mean or mean
+        print(f"{name:>8} | {mean:>9.3f} | {statistics.median(durations):>8.3f} | "
+              f"{base_mean / mean if mean else 0:>6.2f}x | {exact:>9.1%} | {char_sim:>8.1%}")
+        del recognizer
+
+
+# --- BENCHMARK HÓA ĐƠN GIẢ LẬP ---
+
+# Font có đủ dấu tiếng Việt (lấy font đầu tiên tồn tại nếu không truyền --font)
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+def load_font(path=None, size=26):
+    for candidate in ([path] if path else []) + FONT_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            return ImageFont.truetype(candidate, size)
+    print(" [Benchmark] Không tìm thấy font TrueType, dùng font mặc định (có thể mất dấu tiếng Việt)")
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def synthetic_invoice(names, n_rows, font, rng):
+    """
+    Vẽ 1 hóa đơn bán hàng: tiêu đề + bảng 4 cột (Tên hàng, SL, Đơn giá, Thành tiền) + tổng cộng.
+    Trả về (ảnh PIL, danh sách dòng đúng [{"name", "quantity", "unitPrice", "amount"}]).
+    """
+    width, row_h = 1240, 48
+    height = 360 + n_rows * row_h + 160
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+
+    draw.text((width // 2 - 190, 40), "HÓA ĐƠN BÁN HÀNG", fill="black", font=font)
+    draw.text((60, 110), f"Số: {rng.randint(1000, 99999)}    Ngày: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025",
+              fill="black", font=font)
+
+    columns = [(60, "Tên hàng"), (700, "SL"), (820, "Đơn giá"), (1020, "Thành tiền")]
+    y = 220
+    draw.line((40, y - 10, width - 40, y - 10), fill="black", width=2)
+    for x, title in columns:
+        draw.text((x, y), title, fill="black", font=font)
+    y += row_h
+    draw.line((40, y - 8, width - 40, y - 8), fill="black", width=1)
+
+    truth = []
+    total = 0
+    for _ in range(n_rows):
+        name = rng.choice(names)
+        qty = rng.randint(1, 24)
+        price = rng.randint(5, 500) * 1000
+        amount = qty * price
+        total += amount
+        # Tên quá dài thì cắt để không đè sang cột SL
+        display_name = name if len(name) <= 40 else name[:40].rsplit(" ", 1)[0]
+        for x, text in zip((60, 700, 820, 1020), (display_name, str(qty), f"{price:,}", f"{amount:,}")):
+            draw.text((x, y), text, fill="black", font=font)
+        truth.append({"name": display_name, "quantity": qty, "unitPrice": float(price), "amount": float(amount)})
+        y += row_h
+
+    draw.line((40, y, width - 40, y), fill="black", width=2)
+    draw.text((60, y + 30), "Tổng cộng:", fill="black", font=font)
+    draw.text((1020, y + 30), f"{total:,}", fill="black", font=font)
+    return image, truth
+
+
+def degrade(image, rng, noise=0.0, blur=0.0, rotate=0.0):
+    """Mô phỏng ảnh chụp: xoay ngẫu nhiên ±rotate độ, làm mờ Gaussian, nhiễu Gaussian (độ lệch chuẩn theo tỉ lệ 0-1)"""
+    if rotate:
+        image = image.rotate(rng.uniform(-rotate, rotate), resample=Image.BICUBIC, expand=True, fillcolor="white")
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(radius=rng.uniform(0, blur)))
+    if noise:
+        arr = np.asarray(image, dtype=np.float32)
+        np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+        arr = arr + np_rng.normal(0, noise * 255, arr.shape)
+        image = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+    return image
+
+
+def generate_invoices(out_dir, count, row_range, names, font, seed=0, noise=0.0, blur=0.0, rotate=0.0):
+    """Sinh count hóa đơn vào out_dir -> [(đường dẫn ảnh, dòng đúng)] (cùng seed -> cùng bộ ảnh)"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    samples = []
+    for i in range(count):
+        n_rows = rng.randint(row_range[0], row_range[-1])
+        image, truth = synthetic_invoice(names, n_rows, font, rng)
+        image = degrade(image, rng, noise, blur, rotate)
+        path = os.path.join(out_dir, f"synthetic_{seed}_{i:04d}.png")
+        image.save(path)
+        samples.append((path, truth))
+    return samples
+
+
+def _name_similarity(a, b):
+    return difflib.SequenceMatcher(None, a.lower().strip(), b.lower().strip()).ratio()
+
+
+def score_rows(truth, rows, name_threshold=0.8):
+    """
+    Số dòng đúng được trích xuất: khớp 1-1 khi SL, đơn giá, thành tiền trùng khớp
+    và tên giống >= name_threshold. rows là output của WarehouseService._parse_ocr_rows.
+    """
+    remaining = list(rows)
+    correct = 0
+    for t in truth:
+        for row in remaining:
+            if (row["quantity"] == t["quantity"] and row["unitPrice"] == t["unitPrice"]
+                    and row["amount"] == t["amount"] and _name_similarity(row["name"], t["name"]) >= name_threshold):
+                remaining.remove(row)
+                correct += 1
+                break
+    return correct
+
+
+def score_matches(truth, items):
+    """Số dòng đúng mà Smart Search map về đúng sản phẩm (chỉ tính item đã match, status != NEW)"""
+    matched = [i["productName"].lower().strip() for i in items if i["status"] != "NEW"]
+    correct = 0
+    for t in truth:
+        name = t["name"].lower().strip()
+        if name in matched:
+            matched.remove(name)
+            correct += 1
+    return correct
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _print_stage_table(title, stage_samples):
+    print(f"\n{title}")
+    print(f"{'stage':>14} | {'p50 (s)':>8} | {'p95 (s)':>8}")
+    for stage, values in stage_samples.items():
+        print(f"{stage:>14} | {_percentile(values, 0.5):>8.3f} | {_percentile(values, 0.95):>8.3f}")
+
+
+def run_synthetic(args):
+    from app.services.warehouse_service import WarehouseService
+
+    names = load_product_names()
+    font = load_font(args.font)
+    out_dir = args.out or tempfile.mkdtemp(prefix="ocr_synthetic_")
+    samples = generate_invoices(out_dir, args.invoices, args.rows, names, font, args.seed,
+                                args.noise, args.blur, args.rotate)
+    n_truth = sum(len(t) for _, t in samples)
+    print(f" [Benchmark] {len(samples)} hóa đơn / {n_truth} dòng tại {out_dir}")
+
+    recognizer = InvoiceRecognizer(model_dir=SERVER_DIR)
+    recognizer.predict(samples[0][0])  # warm-up
+
+    # 1. Model thuần: InvoiceRecognizer.predict (qua predict_document để lấy thời gian từng stage)
+    stage_samples = {}
+    extracted = predicted_rows = 0
+    start = time.perf_counter()
+    for path, truth in samples:
+        document = recognizer.predict_document(path)
+        for stage, seconds in document["metrics"]["stages"].items():
+            stage_samples.setdefault(stage, []).append(seconds)
+        rows = WarehouseService._parse_ocr_rows(document["rows"])
+        predicted_rows += len(rows)
+        extracted += score_rows(truth, rows)
+    model_elapsed = time.perf_counter() - start
+
+    print(f"\nInvoiceRecognizer.predict: {len(samples) / model_elapsed:.2f} ảnh/s")
+    print(f"  Dòng trích xuất đúng: {extracted}/{n_truth} (recall {extracted / n_truth:.1%}, "
+          f"precision {extracted / predicted_rows if predicted_rows else 0:.1%})")
+    _print_stage_table("Stage của model:", stage_samples)
+
+    if args.skip_service:
+        return
+
+    # 2. End-to-end: WarehouseService.process_ocr_upload (OCR + parse + Smart Search), cần DB + MongoDB
+    from config import Config
+    from app import create_app, ai_model
+
+    Config.OCR_POOL_ENABLED = False
+    ai_model._real_ai_models[Config.OCR_DEFAULT_TIER] = recognizer  # Dùng lại model đã load
+    app = create_app()
+    app.config['OCR_CACHE_ENABLED'] = False  # Không để cache làm sai số liệu
+
+    stage_samples = {}
+    matched = 0
+    start = time.perf_counter()
+    with app.app_context():
+        for path, truth in samples:
+            result = WarehouseService.process_ocr_upload(path, debug=True)
+            for stage, seconds in result["metrics"]["stages"].items():
+                stage_samples.setdefault(stage, []).append(seconds)
+            matched += score_matches(truth, result["items"])
+    service_elapsed = time.perf_counter() - start
+
+    print(f"\nWarehouseService.process_ocr_upload: {len(samples) / service_elapsed:.2f} ảnh/s")
+    print(f"  Match đúng sản phẩm: {matched}/{n_truth} ({matched / n_truth:.1%})")
+    _print_stage_table("Stage end-to-end:", stage_samples)
+
+
+def run_tiers(args):
+    """Mỗi tier 1 recognizer (dùng chung LayoutLMv3), chạy cùng bộ hóa đơn giả lập -> độ trễ + recall dòng"""
+    from config import Config
+    from app.ai_model import build_recognizer_kwargs
+    from app.services.warehouse_service import WarehouseService
+
+    names = load_product_names()
+    font = load_font(args.font)
+    out_dir = args.out or tempfile.mkdtemp(prefix="ocr_tiers_")
+    samples = generate_invoices(out_dir, args.invoices, args.rows, names, font, args.seed,
+                                args.noise, args.blur, args.rotate)
+    n_truth = sum(len(t) for _, t in samples)
+    print(f" [Benchmark] {len(samples)} hóa đơn / {n_truth} dòng tại {out_dir}")
+
+    results = {}
+    shared = None
+    for tier in args.tiers:
+        recognizer = InvoiceRecognizer(model_dir=SERVER_DIR, shared_layout=shared, **build_recognizer_kwargs(tier))
+        shared = shared or recognizer
+        recognizer.predict(samples[0][0])  # warm-up
+
+        latencies = []
+        extracted = 0
+        for path, truth in samples:
+            start = time.perf_counter()
+            document = recognizer.predict_document(path)
+            latencies.append(time.perf_counter() - start)
+            extracted += score_rows(truth, WarehouseService._parse_ocr_rows(document["rows"]))
+        results[tier] = (statistics.mean(latencies), _percentile(latencies, 0.95), extracted)
+
+    print(f"\n{'tier':>10} | {'mean (s)':>8} | {'p95 (s)':>8} | {'recall':>7}")
+    for tier, (mean, p95, extracted) in results.items():
+        print(f"{tier:>10} | {mean:>8.3f} | {p95:>8.3f} | {extracted / n_truth:>7.1%}")
+
+    if Config.OCR_DEFAULT_TIER in results:
+        base_mean, _, base_extracted = results[Config.OCR_DEFAULT_TIER]
+        for tier, (mean, _, extracted) in results.items():
+            if tier != Config.OCR_DEFAULT_TIER:
+                print(f"  {tier} vs {Config.OCR_DEFAULT_TIER}: x{base_mean / mean:.2f} tốc độ, "
+                      f"recall {(extracted - base_extracted) / n_truth:+.1%}")
+
+
+def run_templates(args):
+    """Cùng 1 bố cục hóa đơn giả lập: luôn chạy LayoutLMv3 vs cache mẫu bố cục (học từ vài hóa đơn đầu)"""
+    from app.services.warehouse_service import WarehouseService
+
+    names = load_product_names()
+    font = load_font(args.font)
+    out_dir = args.out or tempfile.mkdtemp(prefix="ocr_templates_")
+    samples = generate_invoices(out_dir, args.invoices, args.rows, names, font, args.seed,
+                                args.noise, args.blur, args.rotate)
+    n_truth = sum(len(t) for _, t in samples)
+    print(f" [Benchmark] {len(samples)} hóa đơn / {n_truth} dòng tại {out_dir}")
+
+    baseline = InvoiceRecognizer(model_dir=SERVER_DIR)
+    cached = InvoiceRecognizer(
+        model_dir=SERVER_DIR, shared_layout=baseline, template_cache=True,
+        template_path=os.path.join(out_dir, "templates.json"), template_min_confirmations=args.confirmations
+    )
+    baseline.predict(samples[0][0])  # warm-up
+
+    print(f"\n{'mode':>10} | {'mean (s)':>8} | {'layout (s)':>10} | {'recall':>7}")
+    for label, recognizer in (("layoutlm", baseline), ("template", cached)):
+        latencies = []
+        layout_seconds = 0.0
+        extracted = 0
+        counts = {}
+        for path, truth in samples:
+            start = time.perf_counter()
+            document = recognizer.predict_document(path)
+            latencies.append(time.perf_counter() - start)
+            stages = document["metrics"]["stages"]
+            layout_seconds += stages.get("layoutlm", 0.0) + stages.get("template", 0.0)
+            for name, value in document["metrics"]["counts"].items():
+                counts[name] = counts.get(name, 0) + value
+            extracted += score_rows(truth, WarehouseService._parse_ocr_rows(document["rows"]))
+        print(f"{label:>10} | {statistics.mean(latencies):>8.3f} | {layout_seconds:>10.3f} | "
+              f"{extracted / n_truth:>7.1%}")
+
+    hits = counts.get("template_hits", 0)
+    lookups = hits + counts.get("template_misses", 0) + counts.get("template_fallbacks", 0)
+    print(f"\nMẫu bố cục: hit {hits}/{lookups} trang ({hits / lookups if lookups else 0:.1%}), "
+          f"fallback {counts.get('template_fallbacks', 0)}, "
+          f"tiết kiệm ước tính {counts.get('template_saved_ms', 0) / 1000:.2f}s")
+
+
+# --- BENCHMARK MICRO-BATCHING (nhiều client cùng lúc) ---
+
+def bench_concurrency(recognizer, images, clients, jobs_per_client):
+    """N thread cùng gọi predict_document trên 1 model -> (job/giây, danh sách độ trễ từng job)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def client(offset):
+        for j in range(jobs_per_client):
+            path = images[(offset + j) % len(images)]
+            start = time.perf_counter()
+            recognizer.predict_document(path)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies
+
+
+def run_concurrency(args, recognizer):
+    images = args.images or [p for p in SAMPLE_IMAGES if os.path.exists(p)]
+    recognizer.predict(images[0])  # warm-up
+
+    print(f"\n{'clients':>7} | {'microbatch':>10} | {'jobs/s':>7} | {'p50 (s)':>8} | {'p95 (s)':>8} | batches (rec / layout)")
+    for clients in args.clients:
+        for enabled in (False, True):
+            recognizer.microbatch = enabled
+            rec_before = recognizer._rec_batcher.stats()["batches"]
+            layout_before = recognizer._layout_batcher.stats()["batches"]
+
+            throughput, latencies = bench_concurrency(recognizer, images, clients, args.jobs_per_client)
+
+            batches = ""
+            if enabled:
+                rec = recognizer._rec_batcher.stats()["batches"] - rec_before
+                layout = recognizer._layout_batcher.stats()["batches"] - layout_before
+                batches = f"{rec} / {layout} cho {len(latencies)} job"
+            print(f"{clients:>7} | {'bật' if enabled else 'tắt':>10} | {throughput:>7.2f} | "
+                  f"{_percentile(latencies, 0.5):>8.3f} | {_percentile(latencies, 0.95):>8.3f} | {batches}")
+
+
+def run_pipeline(args):
+    """Cùng bộ ảnh, N client đồng thời: các stage chạy tuần tự trong từng request vs pipeline 4 stage"""
+    images = args.images or [p for p in SAMPLE_IMAGES if os.path.exists(p)]
+    sequential = InvoiceRecognizer(model_dir=SERVER_DIR)
+    pipelined = InvoiceRecognizer(
+        model_dir=SERVER_DIR, shared_layout=sequential, pipeline=True,
+        pipeline_prepare_workers=args.prepare_workers, pipeline_queue_size=args.queue_size
+    )
+    sequential.predict(images[0])  # warm-up
+    pipelined.predict(images[0])
+
+    print(f"\n{'clients':>7} | {'mode':>10} | {'jobs/s':>7} | {'p50 (s)':>8} | {'p95 (s)':>8}")
+    for clients in args.clients:
+        for label, recognizer in (("tuần tự", sequential), ("pipeline", pipelined)):
+            throughput, latencies = bench_concurrency(recognizer, images, clients, args.jobs_per_client)
+            print(f"{clients:>7} | {label:>10} | {throughput:>7.2f} | "
+                  f"{_percentile(latencies, 0.5):>8.3f} | {_percentile(latencies, 0.95):>8.3f}")
+
+    print("\nStage pipeline (tổng cộng):")
+    for stage, data in pipelined.pipeline.stats().items():
+        print(f"  {stage:>10}: {data['items']} lượt, bận {data['busy_seconds']:.2f}s, "
+              f"utilization gần nhất {data['utilization']:.0%}")
+
+
+# --- BENCHMARK KHỞI TẠO (thời gian + bộ nhớ) ---
+
+_STARTUP_PROBE = """
+import json, time, psutil
+proc = psutil.Process()
+base = proc.memory_info().rss
+start = time.perf_counter()
+from app.my_ocr_core import InvoiceRecognizer, build_text_detector
+imported = time.perf_counter()
+if %(full)r:
+    InvoiceRecognizer(model_dir=%(model_dir)r, paddle_detector_only=%(det_only)r)
+else:
+    build_text_detector(%(model_dir)r, detector_only=%(det_only)r)
+print(json.dumps({"seconds": time.perf_counter() - imported, "rss_mb": (proc.memory_info().rss - base) / 2 ** 20}))
+"""
+
+
+def measure_startup(det_only, full):
+    """Chạy trong interpreter mới -> (giây khởi tạo, MB RSS tăng thêm), không tính thời gian import thư viện"""
+    code = _STARTUP_PROBE % {"full": full, "det_only": det_only, "model_dir": SERVER_DIR}
+    proc = subprocess.run([sys.executable, "-c", code], cwd=SERVER_DIR, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result["seconds"], result["rss_mb"]
+
+
+def run_startup(args):
+    print(f"\n{'phạm vi':>12} | {'paddle':>13} | {'init (s)':>8} | {'RSS (MB)':>8}")
+    for full in (False, True):
+        scope = "recognizer" if full else "detector"
+        for det_only in (False, True):
+            samples = [measure_startup(det_only, full) for _ in range(args.repeat)]
+            seconds = statistics.median(s[0] for s in samples)
+            rss = statistics.median(s[1] for s in samples)
+            label = "chỉ detector" if det_only else "PaddleOCR"
+            print(f"{scope:>12} | {label:>13} | {seconds:>8.2f} | {rss:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("rec", help="So sánh batch size của VietOCR")
+    rec.add_argument("images", nargs="+", help="Đường dẫn ảnh hóa đơn")
+    rec.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    rec.add_argument("--repeat", type=int, default=3)
+
+    layout = sub.add_parser("layout", help="So sánh LayoutLMv3 padding cố định vs cửa sổ trượt")
+    layout.add_argument("--words", nargs="+", type=int, default=[40, 150, 600])
+    layout.add_argument("--repeat", type=int, default=5)
+
+    modes = sub.add_parser("modes", help="So sánh fp32 với int8/TorchScript (độ trễ + độ chính xác)")
+    modes.add_argument("images", nargs="*", help="Ảnh hóa đơn (mặc định: bộ ảnh mẫu trong uploads/)")
+    modes.add_argument("--modes", nargs="+", choices=list(INFERENCE_MODES), default=list(INFERENCE_MODES))
+    modes.add_argument("--repeat", type=int, default=3)
+
+    synthetic = sub.add_parser("synthetic", help="Thông lượng + độ chính xác trên hóa đơn giả lập")
+    synthetic.add_argument("--invoices", type=int, default=20)
+    synthetic.add_argument("--rows", nargs=2, type=int, default=[5, 25], metavar=("MIN", "MAX"))
+    synthetic.add_argument("--noise", type=float, default=0.03, help="Độ lệch chuẩn nhiễu (0-1)")
+    synthetic.add_argument("--blur", type=float, default=0.8, help="Bán kính blur tối đa (px)")
+    synthetic.add_argument("--rotate", type=float, default=2.0, help="Góc xoay tối đa (độ)")
+    synthetic.add_argument("--seed", type=int, default=0)
+    synthetic.add_argument("--font", help="Font .ttf có dấu tiếng Việt")
+    synthetic.add_argument("--out", help="Thư mục lưu ảnh sinh ra (mặc định: thư mục tạm)")
+    synthetic.add_argument("--skip-service", action="store_true",
+                           help="Chỉ chạy model, bỏ qua process_ocr_upload (không cần DB/MongoDB)")
+
+    tiers = sub.add_parser("tiers", help="So sánh các tier OCR (fast vs accurate) trên hóa đơn giả lập")
+    tiers.add_argument("--tiers", nargs="+", default=["accurate", "fast"])
+    tiers.add_argument("--invoices", type=int, default=20)
+    tiers.add_argument("--rows", nargs=2, type=int, default=[5, 25], metavar=("MIN", "MAX"))
+    tiers.add_argument("--noise", type=float, default=0.03)
+    tiers.add_argument("--blur", type=float, default=0.8)
+    tiers.add_argument("--rotate", type=float, default=2.0)
+    tiers.add_argument("--seed", type=int, default=0)
+    tiers.add_argument("--font", help="Font .ttf có dấu tiếng Việt")
+    tiers.add_argument("--out", help="Thư mục lưu ảnh sinh ra (mặc định: thư mục tạm)")
+
+    templates = sub.add_parser("templates", help="Cache mẫu bố cục vs luôn chạy LayoutLMv3 trên hóa đơn giả lập")
+    templates.add_argument("--invoices", type=int, default=30)
+    templates.add_argument("--confirmations", type=int, default=3)
+    templates.add_argument("--rows", nargs=2, type=int, default=[5, 25], metavar=("MIN", "MAX"))
+    templates.add_argument("--noise", type=float, default=0.03)
+    templates.add_argument("--blur", type=float, default=0.8)
+    templates.add_argument("--rotate", type=float, default=1.0)
+    templates.add_argument("--seed", type=int, default=0)
+    templates.add_argument("--font", help="Font .ttf có dấu tiếng Việt")
+    templates.add_argument("--out", help="Thư mục lưu ảnh sinh ra (mặc định: thư mục tạm)")
+
+    pipeline = sub.add_parser("pipeline", help="Pipeline nhiều stage vs tuần tự với nhiều client đồng thời")
+    pipeline.add_argument("images", nargs="*", help="Ảnh hóa đơn (mặc định: bộ ảnh mẫu trong uploads/)")
+    pipeline.add_argument("--clients", nargs="+", type=int, default=[1, 4, 8])
+    pipeline.add_argument("--jobs-per-client", type=int, default=4)
+    pipeline.add_argument("--prepare-workers", type=int, default=2)
+    pipeline.add_argument("--queue-size", type=int, default=4)
+
+    startup = sub.add_parser("startup", help="Thời gian khởi tạo + RSS: Paddle chỉ detector vs PaddleOCR đầy đủ")
+    startup.add_argument("--repeat", type=int, default=3)
+
+    concurrency = sub.add_parser("concurrency", help="Micro-batching: nhiều client đồng thời trên 1 model")
+    concurrency.add_argument("images", nargs="*", help="Ảnh hóa đơn (mặc định: bộ ảnh mẫu trong uploads/)")
+    concurrency.add_argument("--clients", nargs="+", type=int, default=[1, 4, 16])
+    concurrency.add_argument("--jobs-per-client", type=int, default=4)
+    concurrency.add_argument("--wait-ms", type=float, default=20)
+
+    args = parser.parse_args()
+    if args.command == "modes":
+        # Mỗi chế độ cần 1 recognizer riêng
+        run_modes(args)
+        return
+    if args.command == "synthetic":
+        run_synthetic(args)
+        return
+    if args.command == "startup":
+        run_startup(args)
+        return
+    if args.command == "tiers":
+        run_tiers(args)
+        return
+    if args.command == "templates":
+        run_templates(args)
+        return
+    if args.command == "pipeline":
+        run_pipeline(args)
+        return
+
+    recognizer = InvoiceRecognizer(model_dir=SERVER_DIR)
+
+    if args.command == "rec":
+        run_rec(args, recognizer)
+    elif args.command == "layout":
+        run_layout(args, recognizer)
+    elif args.command == "concurrency":
+        recognizer._rec_batcher.max_wait = args.wait_ms / 1000.0
+        recognizer._layout_batcher.max_wait = args.wait_ms / 1000.0
+        run_concurrency(args, recognizer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# app/ocr_types.py
+"""
+Kiểu dữ liệu trao đổi giữa InvoiceRecognizer (process OCR) và WarehouseService (process API).
+Module này KHÔNG được import torch/paddle/... để process API unpickle được kết quả từ pool worker
+mà không phải load thư viện ML.
+"""
+import re
+from dataclasses import dataclass, field, asdict
+
+ROW_FIELDS = ("ItemName", "Quantity", "UnitPrice", "Amount")
+
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)*')
+# Ký tự VietOCR hay nhận nhầm trong cột số
+_DIGIT_FIXES = str.maketrans({'(': '1', 'l': '1', 'O': '0', 'o': '0'})
+
+
+def extract_numbers(text):
+    """Tìm tất cả các con số trong một chuỗi bất kỳ (dấu . và , được coi là phân cách hàng nghìn)"""
+    numbers = []
+    for m in _NUMBER_RE.finditer(text.translate(_DIGIT_FIXES)):
+        try:
+            numbers.append(float(m.group().replace('.', '').replace(',', '')))
+        except ValueError:
+            pass
+    return numbers
+
+
+def _first_number(text):
+    numbers = extract_numbers(text) if text else []
+    return numbers[0] if numbers else None
+
+
+@dataclass
+class OcrRow:
+    """
+    1 dòng hàng hóa do LayoutLMv3 gom được:
+    - *_text: chữ gốc của từng cột (đã bỏ dấu phân cách như format cũ)
+    - quantity/unit_price/amount: số đọc được từ đúng cột đó (None nếu cột trống)
+    - numbers: mọi con số trong các cột số (logic suy luận SL = Thành tiền / Đơn giá dùng list này)
+    - boxes: cột -> box bao (0-1000) của các chữ thuộc cột
+    - confidence: cột -> xác suất nhãn trung bình của LayoutLMv3
+    """
+    name: str
+    quantity_text: str = ""
+    unit_price_text: str = ""
+    amount_text: str = ""
+    quantity: float = None
+    unit_price: float = None
+    amount: float = None
+    numbers: list = field(default_factory=list)
+    boxes: dict = field(default_factory=dict)
+    confidence: dict = field(default_factory=dict)
+    page: int = 1
+
+    @staticmethod
+    def from_group(group, page=1):
+        """group: 1 phần tử của InvoiceRecognizer._clean_and_group_data"""
+        # Giữ đúng cách chuẩn hóa chuỗi của format "name | qty | amount | price" trước đây
+        qty_text = group.get("Quantity", "1").replace(",", ".")
+        price_text = group.get("UnitPrice", "0").replace(",", "").replace(".", "")
+        amount_text = group.get("Amount", "0").replace(",", "").replace(".", "")
+        return OcrRow(
+            name=group.get("ItemName", ""),
+            quantity_text=qty_text, unit_price_text=price_text, amount_text=amount_text,
+            quantity=_first_number(group.get("Quantity")),
+            unit_price=_first_number(group.get("UnitPrice")),
+            amount=_first_number(group.get("Amount")),
+            numbers=extract_numbers(" ".join([qty_text, amount_text, price_text])),
+            boxes=group.get("boxes", {}),
+            confidence=group.get("confidence", {}),
+            page=page
+        )
+
+    @property
+    def min_confidence(self):
+        """Độ tin cậy thấp nhất trong các cột có dữ liệu (1.0 nếu không có thông tin)"""
+        return min(self.confidence.values()) if self.confidence else 1.0
+
+    def to_line(self):
+        """Format cũ "name | qty | amount | price" (raw text hiển thị cho người dùng)"""
+        return f"{self.name} | {self.quantity_text} | {self.amount_text} | {self.unit_price_text}"
+
+    def to_dict(self):
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(data):
+        return data if isinstance(data, OcrRow) else OcrRow(**data)
@@ -0,0 +1,148 @@
+# app/ocr_worker_pool.py
+"""
+Pool process riêng cho OCR.
+- Mỗi worker load InvoiceRecognizer đúng 1 lần (initializer) và giữ trong bộ nhớ.
+- Số thread torch/Paddle của mỗi worker bị giới hạn để các worker không tranh nhau CPU.
+- Worker tự được thay mới sau OCR_MAX_JOBS_PER_WORKER job để chặn rò rỉ bộ nhớ.
+- Hàng đợi có giới hạn: quá tải thì chờ tối đa OCR_POOL_SUBMIT_TIMEOUT giây rồi từ chối (OcrPoolBusyError).
+"""
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+
+class OcrPoolBusyError(Exception):
+    """Hàng đợi OCR đã đầy -> API nên trả 503 để client thử lại sau"""
+    pass
+
+
+# --- PHẦN CHẠY TRONG PROCESS WORKER ---
+_worker_models = {}
+
+def _init_worker(model_dir, threads, tier_kwargs):
+    """Initializer của mỗi worker: ghim số thread rồi load model của mọi tier 1 lần (dùng chung LayoutLMv3)"""
+    # Phải đặt biến môi trường TRƯỚC khi import torch/paddle thì OpenMP/MKL mới nhận
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    from app.my_ocr_core import InvoiceRecognizer
+
+    shared = None
+    for tier, recognizer_kwargs in tier_kwargs.items():
+        print(f" [OCR Worker {os.getpid()}] Đang load model tier '{tier}' ({threads} thread)...")
+        _worker_models[tier] = InvoiceRecognizer(
+            model_dir=model_dir,
+            cpu_threads=threads,
+            shared_layout=shared,
+            **recognizer_kwargs
+        )
+        shared = shared or _worker_models[tier]
+
+def _worker_predict(image_path, tier):
+    return _worker_models[tier].predict_document(image_path)
+
+def _worker_ping():
+    return os.getpid()
+
+
+# --- PHẦN CHẠY TRONG PROCESS API ---
+class OcrWorkerPool:
+    def __init__(self, model_dir, pool_size, threads_per_worker, max_jobs_per_worker,
+                 queue_size, tier_kwargs=None):
+        self.model_dir = model_dir
+        self.pool_size = max(1, pool_size)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.max_jobs_per_worker = max_jobs_per_worker or None
+        # tier -> tham số khởi tạo InvoiceRecognizer
+        self.tier_kwargs = tier_kwargs or {}
+        # Số job tối đa cho phép tồn tại cùng lúc (đang chạy + đang chờ)
+        self._slots = threading.BoundedSemaphore(self.pool_size + max(0, queue_size))
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 'spawn' để worker không thừa kế trạng thái torch/thread của process cha
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=mp.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_dir, self.threads_per_worker, self.tier_kwargs),
+                    max_tasks_per_child=self.max_jobs_per_worker
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, image_path, wait_timeout=None, tier=None):
+        """Đẩy 1 ảnh (đường dẫn hoặc bytes) vào pool. Hết chỗ trong wait_timeout giây -> OcrPoolBusyError"""
+        if not self._slots.acquire(timeout=wait_timeout):
+            raise OcrPoolBusyError("Hệ thống OCR đang quá tải, vui lòng thử lại sau.")
+
+        try:
+            tier = tier or next(iter(self.tier_kwargs))
+            future = self._get_executor().submit(_worker_predict, image_path, tier)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def predict(self, image_path, wait_timeout=None, timeout=None, tier=None):
+        """Gọi đồng bộ: trả về dict giống InvoiceRecognizer.predict_document"""
+        future = self.submit(image_path, wait_timeout=wait_timeout, tier=tier)
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            # Worker chết (OOM, lỗi load model...) -> tạo lại pool cho request sau
+            print(" [OCR Pool] Worker bị crash, khởi tạo lại pool.")
+            self._reset_executor()
+            raise
+
+    def warmup(self):
+        """Ép pool tạo đủ worker (model được load trong initializer) trước khi có request thật"""
+        executor = self._get_executor()
+        futures = [executor.submit(_worker_ping) for _ in range(self.pool_size)]
+        pids = {f.result() for f in futures}
+        print(f" [OCR Pool] Đã sẵn sàng {len(pids)} worker: {sorted(pids)}")
+        return pids
+
+    def shutdown(self):
+        self._reset_executor()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Singleton pool cho mỗi process API (tạo lazy ở request OCR đầu tiên)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Import lazy để tránh vòng import (ai_model import module này)
+                from app.ai_model import build_recognizer_kwargs
+
+                server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                _pool = OcrWorkerPool(
+                    model_dir=server_dir,
+                    pool_size=Config.OCR_POOL_SIZE,
+                    threads_per_worker=Config.OCR_THREADS_PER_WORKER,
+                    max_jobs_per_worker=Config.OCR_MAX_JOBS_PER_WORKER,
+                    queue_size=Config.OCR_POOL_QUEUE_SIZE,
+                    tier_kwargs={tier: build_recognizer_kwargs(tier) for tier in Config.OCR_ENABLED_TIERS}
+                )
+    return _pool
@@ -0,0 +1,148 @@
+# app/search_benchmark.py
+"""
+Benchmark chuẩn hóa tiếng Việt dùng cho Smart Search (không cần DB/MongoDB/model).
+
+Cách chạy (từ thư mục server):
+    # 2 cách bỏ dấu cũ (8 regex của SearchService, NFD + regex của text_utils) vs bảng translate + LRU cache
+    python -m app.search_benchmark normalize --lines 20000 --repeat 5
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+import unicodedata
+
+from app.utils.text_utils import remove_vietnamese_tones, remove_vietnamese_tones_many, _normalize
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- CÁCH CŨ (giữ lại để so sánh) ---
+
+def legacy_regex(text):
+    """SearchService.remove_vietnamese_tones trước đây: 8 lần re.sub mỗi chuỗi"""
+    if not text: return ""
+    text = text.lower()
+    text = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', text)
+    text = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', text)
+    text = re.sub(r'[oòóọỏõôồốộổỗơờớợởỡ]', 'o', text)
+    text = re.sub(r'[uùúụủũưừứựửữ]', 'u', text)
+    text = re.sub(r'[iìíịỉĩ]', 'i', text)
+    text = re.sub(r'[yỳýỵỷỹ]', 'y', text)
+    text = re.sub(r'[đ]', 'd', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return text.strip()
+
+
+def legacy_nfd(text):
+    """text_utils.remove_vietnamese_tones trước đây: NFD + regex"""
+    if not text: return ""
+    text = text.lower()
+    text = unicodedata.normalize('NFD', text)
+    text = re.sub(r'[\u0300-\u036f]', '', text)
+    text = text.replace('đ', 'd')
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    return text.strip()
+
+
+# --- DỮ LIỆU ---
+
+def load_product_names():
+    """Tên sản phẩm thật từ all_products.json + bookstore.json"""
+    names = []
+    with open(os.path.join(APP_DIR, 'all_products.json'), 'r', encoding='utf-8') as f:
+        for items in json.load(f).values():
+            names.extend(items)
+    with open(os.path.join(APP_DIR, 'bookstore.json'), 'r', encoding='utf-8') as f:
+        names.extend(book['name'] for book in json.load(f))
+    return names
+
+
+def synthetic_ocr_lines(names, n_lines, seed=0):
+    """Dòng OCR giả: tên sản phẩm + quy cách/đơn vị, đôi khi ở dạng NFD; tên lặp lại như trên hóa đơn thật"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        line = f"{rng.choice(names)} ({rng.choice(['500g', '1kg', 'Hộp 12', 'Thùng 24', 'Chai 1.5L'])})"
+        if rng.random() < 0.2:
+            line = unicodedata.normalize('NFD', line)
+        lines.append(line)
+    return lines
+
+
+# --- ĐO ---
+
+def _time_per_call(fn, texts, repeat, before_each=None):
+    """µs / chuỗi (lấy lần nhanh nhất trong repeat lần)"""
+    best = None
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / max(1, len(texts)) * 1e6
+
+
+def _time_batch(texts, repeat):
+    best = None
+    for _ in range(repeat):
+        _normalize.cache_clear()
+        start = time.perf_counter()
+        remove_vietnamese_tones_many(texts)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / max(1, len(texts)) * 1e6
+
+
+def run_normalize(args):
+    names = load_product_names()
+    datasets = [
+        ("danh mục", names),
+        ("dòng OCR", synthetic_ocr_lines(names, args.lines, seed=args.seed)),
+    ]
+
+    for title, texts in datasets:
+        print(f"\n=== {title}: {len(texts)} chuỗi ({len(set(texts))} khác nhau) ===")
+        # Kết quả mới phải khớp cách cũ (NFD) trên phần chữ/số, chỉ khác ở khoảng trắng/ký tự đặc biệt
+        mismatches = sum(
+            1 for t in texts
+            if remove_vietnamese_tones(t).replace(" ", "") != legacy_nfd(t).replace(" ", "")
+        )
+        legacy_diff = sum(1 for t in texts if legacy_regex(t) != legacy_nfd(t))
+        print(f"8 regex khác NFD + regex ở {legacy_diff} chuỗi; bảng translate khác NFD (bỏ qua khoảng trắng) ở {mismatches} chuỗi")
+
+        rows = [
+            ("8 regex (SearchService cũ)", _time_per_call(legacy_regex, texts, args.repeat)),
+            ("NFD + regex (text_utils cũ)", _time_per_call(legacy_nfd, texts, args.repeat)),
+            ("translate, cache nguội", _time_per_call(remove_vietnamese_tones, texts, args.repeat,
+                                                        before_each=_normalize.cache_clear)),
+            ("translate, cache nóng", _time_per_call(remove_vietnamese_tones, texts, args.repeat)),
+            ("batch (_many), cache nguội", _time_batch(texts, args.repeat)),
+        ]
+        baseline = rows[0][1]
+        print(f"{'cách chuẩn hóa':>28} | {'µs/chuỗi':>9} | {'tăng tốc':>8}")
+        for label, micros in rows:
+            print(f"{label:>28} | {micros:>9.2f} | {baseline / micros:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Smart Search")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    normalize = sub.add_parser("normalize", help="Bỏ dấu: regex cũ vs bảng translate + LRU cache")
+    normalize.add_argument("--lines", type=int, default=20000, help="Số dòng OCR giả lập")
+    normalize.add_argument("--repeat", type=int, default=5)
+    normalize.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "normalize":
+        run_normalize(args)
+
+
+if __name__ == "__main__":
+    main()
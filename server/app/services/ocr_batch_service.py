@@ -0,0 +1,163 @@
+# server/app/services/ocr_batch_service.py
+import os
+import json
+import time
+import uuid
+import zlib
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app.services.warehouse_service import WarehouseService
+
+# Định dạng được OCR (ảnh + PDF); file khác trong zip bị bỏ qua
+OCR_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp', '.pdf'}
+
+
+class OcrBatchService:
+    """
+    Upload nhiều hóa đơn 1 lần (nhiều file hoặc 1 file zip):
+    - Tất cả file được lưu vào 1 thư mục riêng của batch.
+    - Mỗi hóa đơn chạy process_ocr_upload trên 1 thread; với pool bật, các thread chỉ chờ
+      kết quả từ process worker nên batch N hóa đơn mất ~ (N / số worker) x thời gian 1 hóa đơn.
+    - Kết quả được stream dạng NDJSON theo thứ tự hóa đơn nào xong trước.
+    """
+
+    @staticmethod
+    def new_batch_dir():
+        batch_id = uuid.uuid4().hex
+        batch_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_ocr', f"batch_{batch_id}")
+        os.makedirs(batch_dir, exist_ok=True)
+        return batch_id, batch_dir
+
+    @staticmethod
+    def save_uploads(files, batch_dir):
+        """
+        Lưu các file upload (giải nén nếu là .zip) -> [(tên file gốc, đường dẫn đã lưu)].
+        Raise ValueError nếu không có file hợp lệ hoặc vượt quá số file cho phép (xóa luôn batch_dir).
+        """
+        max_files = current_app.config.get('OCR_BATCH_MAX_FILES', 100)
+        saved = []
+
+        try:
+            for file in files:
+                if not file or file.filename == '':
+                    continue
+                filename = secure_filename(file.filename)
+                ext = os.path.splitext(filename)[1].lower()
+
+                if ext == '.zip':
+                    saved.extend(OcrBatchService._extract_zip(file, batch_dir, len(saved), max_files - len(saved)))
+                elif ext in OCR_EXTENSIONS:
+                    if len(saved) >= max_files:
+                        raise ValueError(f"Tối đa {max_files} hóa đơn mỗi lần upload")
+                    path = os.path.join(batch_dir, f"{len(saved):04d}_{filename}")
+                    file.save(path)
+                    if os.path.getsize(path) > current_app.config.get('OCR_BATCH_MAX_ENTRY_BYTES', 25 * 1024 * 1024):
+                        raise ValueError(f"File {file.filename} quá lớn")
+                    saved.append((file.filename, path))
+
+            if not saved:
+                raise ValueError("Không có file ảnh/PDF hợp lệ nào được gửi")
+        except Exception:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            raise
+        return saved
+
+    @staticmethod
+    def _extract_zip(file, batch_dir, start_index, max_files):
+        """Giải nén file ảnh/PDF trong zip; dừng ngay (trước khi mở entry tiếp theo) khi vượt max_files"""
+        max_entry_bytes = current_app.config.get('OCR_BATCH_MAX_ENTRY_BYTES', 25 * 1024 * 1024)
+        saved = []
+        try:
+            archive = zipfile.ZipFile(file.stream)
+        except zipfile.BadZipFile:
+            raise ValueError(f"File zip không hợp lệ: {file.filename}")
+
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # Chỉ lấy tên file (bỏ thư mục trong zip) -> không thể ghi ra ngoài batch_dir
+                filename = secure_filename(os.path.basename(info.filename))
+                if os.path.splitext(filename)[1].lower() not in OCR_EXTENSIONS:
+                    continue
+                if info.file_size > max_entry_bytes:
+                    raise ValueError(f"File {info.filename} trong zip quá lớn")
+                if len(saved) >= max_files:
+                    raise ValueError(f"Tối đa {start_index + max_files} hóa đơn mỗi lần upload")
+
+                path = os.path.join(batch_dir, f"{start_index + len(saved):04d}_{filename}")
+                try:
+                    with archive.open(info) as src:
+                        data = src.read(max_entry_bytes + 1)
+                except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+                    # Entry hỏng (sai CRC, nén lỗi) hoặc zip có mật khẩu / kiểu nén không hỗ trợ
+                    raise ValueError(f"Không đọc được file {info.filename} trong zip: {e}")
+                # file_size trong header zip có thể khai thấp hơn thực tế -> kiểm tra lại trên dữ liệu đã đọc
+                if len(data) > max_entry_bytes:
+                    raise ValueError(f"File {info.filename} trong zip quá lớn")
+                with open(path, 'wb') as dst:
+                    dst.write(data)
+                saved.append((info.filename, path))
+        return saved
+
+    @staticmethod
+    def _run_one(app, path, tier=None):
+        """Chạy trong thread của batch -> cần app_context riêng"""
+        with app.app_context():
+            return WarehouseService.process_ocr_upload(path, tier=tier)
+
+    @staticmethod
+    def iter_batch_results(batch_id, entries, workers=None, tier=None, batch_dir=None):
+        """
+        Generator NDJSON (mỗi dòng 1 JSON); batch_dir bị xóa khi kết thúc (giữ lại nếu bật OCR_AUDIT_UPLOADS):
+        - {"type": "start", "batch_id", "total"}
+        - {"type": "result", "index", "filename", "success", "data"|"error", "progress": {...}} cho từng hóa đơn
+        - {"type": "summary", "total", "succeeded", "failed", "seconds"} khi xong cả batch
+        """
+        app = current_app._get_current_object()
+        workers = workers or app.config.get('OCR_BATCH_WORKERS', 2)
+        total = len(entries)
+        succeeded = failed = 0
+        start = time.perf_counter()
+
+        yield OcrBatchService._ndjson({"type": "start", "batch_id": batch_id, "total": total})
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(workers, total)), thread_name_prefix='ocr-batch')
+        try:
+            futures = {
+                executor.submit(OcrBatchService._run_one, app, path, tier): (index, filename)
+                for index, (filename, path) in enumerate(entries)
+            }
+            for future in as_completed(futures):
+                index, filename = futures[future]
+                event = {"type": "result", "index": index, "filename": filename}
+                try:
+                    event["data"] = future.result()
+                    event["success"] = True
+                    succeeded += 1
+                except Exception as e:
+                    print(f" [OCR Batch] {filename} lỗi: {e}")
+                    event["error"] = str(e)
+                    event["success"] = False
+                    failed += 1
+
+                event["progress"] = {"done": succeeded + failed, "total": total, "failed": failed}
+                yield OcrBatchService._ndjson(event)
+        finally:
+            # Client ngắt kết nối giữa chừng -> bỏ các hóa đơn chưa chạy
+            executor.shutdown(wait=False, cancel_futures=True)
+            if batch_dir and not app.config.get('OCR_AUDIT_UPLOADS'):
+                shutil.rmtree(batch_dir, ignore_errors=True)
+
+        yield OcrBatchService._ndjson({
+            "type": "summary", "batch_id": batch_id, "total": total,
+            "succeeded": succeeded, "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+
+    @staticmethod
+    def _ndjson(data):
+        return json.dumps(data, ensure_ascii=False, default=str) + "\n"
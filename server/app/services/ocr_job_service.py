@@ -0,0 +1,201 @@
+# server/app/services/ocr_job_service.py
+import os
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.extensions import db
+from app.models import OcrJob
+from app.services.warehouse_service import WarehouseService
+
+
+class OcrJobService:
+    """
+    Hàng đợi OCR bất đồng bộ:
+    - Request upload chỉ lưu file + tạo job rồi trả về job_id ngay.
+    - Pipeline OCR (process_ocr_upload) chạy trên executor nền.
+    - Trạng thái (queued/running/done/failed) và thời gian được lưu trong bảng ocr_job.
+    """
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_executor():
+        """Khởi tạo executor 1 lần cho mỗi process (lazy)"""
+        if OcrJobService._executor is None:
+            with OcrJobService._lock:
+                if OcrJobService._executor is None:
+                    OcrJobService._executor = ThreadPoolExecutor(
+                        max_workers=current_app.config.get('OCR_JOB_WORKERS', 2),
+                        thread_name_prefix='ocr-job'
+                    )
+        return OcrJobService._executor
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def submit(file_path, job_id=None, tier=None):
+        """Tạo job ở trạng thái queued (lưu cả tier để chạy lại đúng tier khi khôi phục) và đẩy vào executor nền"""
+        job = OcrJob(id=job_id or OcrJobService.new_job_id(), file_path=file_path, tier=tier,
+                     status=OcrJob.STATUS_QUEUED)
+        try:
+            db.session.add(job)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+        app = current_app._get_current_object()
+        OcrJobService._get_executor().submit(OcrJobService._run_job, app, job.id)
+        return job
+
+    @staticmethod
+    def _claim(job_id):
+        """queued -> running bằng 1 câu UPDATE có điều kiện (job đưa lại hàng đợi lúc khởi động có thể bị submit 2 lần)"""
+        claimed = OcrJob.query.filter_by(id=job_id, status=OcrJob.STATUS_QUEUED).update(
+            {"status": OcrJob.STATUS_RUNNING, "started_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        return claimed == 1
+
+    @staticmethod
+    def _mark_failed(job_id, error):
+        """Commit riêng sau khi rollback -> job không bị kẹt ở running khi commit kết quả lỗi"""
+        try:
+            OcrJob.query.filter_by(id=job_id).update(
+                {"status": OcrJob.STATUS_FAILED, "error": error, "finished_at": datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f" [OCR Job] Không đánh dấu được job {job_id} là failed: {e}")
+
+    @staticmethod
+    def _run_job(app, job_id):
+        """Chạy trong thread nền -> cần app_context riêng"""
+        with app.app_context():
+            try:
+                if not OcrJobService._claim(job_id):
+                    print(f" [OCR Job] Bỏ qua job {job_id}: không tìm thấy hoặc đã được worker khác nhận")
+                    return
+            except Exception as e:
+                db.session.rollback()
+                print(f" [OCR Job] Không cập nhật được trạng thái job {job_id}: {e}")
+                OcrJobService._mark_failed(job_id, f"Không cập nhật được trạng thái job: {e}")
+                return
+
+            job = db.session.get(OcrJob, job_id)
+            file_path = job.file_path
+            try:
+                result = WarehouseService.process_ocr_upload(file_path, tier=job.tier)
+                job.result = json.dumps(result, ensure_ascii=False, default=str)
+                job.status = OcrJob.STATUS_DONE
+                job.finished_at = datetime.utcnow()
+                # Commit kết quả cũng có thể lỗi (kết quả quá lớn, mất kết nối DB) -> xử lý như job lỗi
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f" [OCR Job] Job {job_id} lỗi: {e}")
+                OcrJobService._mark_failed(job_id, str(e))
+            finally:
+                # Job đã kết thúc -> file tạm không còn cần (bản lưu kiểm tra nằm ở uploads/ocr_audit nếu bật)
+                OcrJobService._remove_file(file_path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def recover_jobs(app):
+        """
+        Gọi lúc khởi động process OCR: job queued của lần chạy trước được đưa lại vào executor
+        (với tier đã lưu trong DB), job running quá OCR_JOB_STALE_SECONDS bị đánh dấu failed.
+        """
+        with app.app_context():
+            cutoff = datetime.utcnow() - timedelta(seconds=app.config.get('OCR_JOB_STALE_SECONDS', 1800))
+            try:
+                failed = OcrJob.query.filter(
+                    OcrJob.status == OcrJob.STATUS_RUNNING, OcrJob.started_at < cutoff
+                ).update(
+                    {"status": OcrJob.STATUS_FAILED, "error": "Job bị gián đoạn do server khởi động lại",
+                     "finished_at": datetime.utcnow()},
+                    synchronize_session=False
+                )
+                queued = OcrJob.query.with_entities(OcrJob.id, OcrJob.file_path) \
+                    .filter_by(status=OcrJob.STATUS_QUEUED).order_by(OcrJob.created_at).all()
+                db.session.commit()
+            except Exception as e:
+                # Bảng chưa migrate / DB chưa sẵn sàng -> không chặn khởi động
+                db.session.rollback()
+                print(f" [OCR Job] Bỏ qua khôi phục job: {e}")
+                return
+
+            requeued = 0
+            for job_id, file_path in queued:
+                if os.path.exists(file_path):
+                    OcrJobService._get_executor().submit(OcrJobService._run_job, app, job_id)
+                    requeued += 1
+                else:
+                    OcrJobService._mark_failed(job_id, "File upload không còn trên server")
+            if failed or queued:
+                print(f" [OCR Job] Khôi phục: {requeued} job đưa lại hàng đợi, "
+                      f"{failed + len(queued) - requeued} job đánh dấu failed")
+
+    @staticmethod
+    def get_job(job_id):
+        job = db.session.get(OcrJob, job_id)
+        if not job:
+            raise ValueError("Không tìm thấy OCR job")
+        return job
+
+    @staticmethod
+    def iter_job_events(job_id, poll_interval=0.5, timeout=None):
+        """
+        Generator cho Server-Sent Events:
+        - 'status' mỗi khi trạng thái đổi
+        - 'done' / 'failed' kèm kết quả khi job kết thúc
+        - comment keep-alive để gateway không cắt kết nối
+        """
+        timeout = timeout or current_app.config.get('OCR_JOB_STREAM_TIMEOUT', 300)
+        deadline = time.monotonic() + timeout
+        last_status = None
+        last_emit = time.monotonic()
+
+        while True:
+            # Bỏ cache của session để đọc trạng thái mới nhất do thread worker ghi
+            db.session.expire_all()
+            job = db.session.get(OcrJob, job_id)
+            if not job:
+                yield OcrJobService._sse("error", {"error": "Không tìm thấy OCR job"})
+                return
+
+            if job.is_finished:
+                yield OcrJobService._sse(job.status, job.to_dict())
+                return
+
+            if job.status != last_status:
+                last_status = job.status
+                last_emit = time.monotonic()
+                yield OcrJobService._sse("status", job.to_dict(include_result=False))
+            elif time.monotonic() - last_emit > 15:
+                last_emit = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            if time.monotonic() > deadline:
+                yield OcrJobService._sse("timeout", job.to_dict(include_result=False))
+                return
+
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def _sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
@@ -1,6 +1,10 @@
+import threading
 from pymongo import MongoClient
 from thefuzz import process, fuzz 
-import re
+from config import Config
+from app.models import Product
+from app.utils.product_match_index import ProductMatchIndex, best_choices, prepare_choice
+from app.utils.text_utils import remove_vietnamese_tones, remove_vietnamese_tones_many
 
 # Cấu hình MongoDB
 MONGO_URI = 'mongodb://localhost:27017/'
@@ -11,32 +15,71 @@ class SearchService:
     client = MongoClient(MONGO_URI)
     db = client[DB_NAME]
     collection = db[COLLECTION_NAME]
+    # Chỉ 1 request load lại index tại 1 thời điểm
+    _index_reload_lock = threading.Lock()
 
-    # Đảm bảo index full text search đã được tạo
-    # (Chạy lệnh này 1 lần trong MongoDB Compass hoặc Shell: db.products.createIndex({search_text: "text"}))
+    # Index text trên search_text + unique mysql_id do mongo_sync tạo (python -m app.utils.mongo_sync)
 
     @staticmethod
     def remove_vietnamese_tones(text):
         """
         Chuyển đổi tiếng Việt có dấu sang không dấu để so sánh chính xác hơn
+        (dùng chung app/utils/text_utils -> khớp với name_no_tone do mongo_sync / index tạo ra)
         """
-        if not text: return ""
-        text = text.lower()
-        text = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', text)
-        text = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', text)
-        text = re.sub(r'[oòóọỏõôồốộổỗơờớợởỡ]', 'o', text)
-        text = re.sub(r'[uùúụủũưừứựửữ]', 'u', text)
-        text = re.sub(r'[iìíịỉĩ]', 'i', text)
-        text = re.sub(r'[yỳýỵỷỹ]', 'y', text)
-        text = re.sub(r'[đ]', 'd', text)
-        # Xóa ký tự đặc biệt
-        text = re.sub(r'[^\w\s]', ' ', text)
-        return text.strip()
+        return remove_vietnamese_tones(text)
+
+    @staticmethod
+    def _ensure_index():
+        """
+        Load index trong bộ nhớ từ MySQL lần đầu / sau mỗi SEARCH_INDEX_REFRESH_SECONDS giây -> False nếu lỗi.
+        Index cũ hết hạn: 1 request load lại, các request khác không chờ mà dùng tiếp index hiện tại.
+        Chưa có index: các request chờ lần load đầu tiên.
+        """
+        if ProductMatchIndex.is_loaded(Config.SEARCH_INDEX_REFRESH_SECONDS):
+            return True
+        has_index = ProductMatchIndex.is_loaded()
+        if not SearchService._index_reload_lock.acquire(blocking=not has_index):
+            return True
+        try:
+            # Request khác vừa load xong trong lúc chờ lock
+            if ProductMatchIndex.is_loaded(Config.SEARCH_INDEX_REFRESH_SECONDS):
+                return True
+            # Cả sản phẩm ngừng kinh doanh: danh mục OCR (seed all_products.json, is_active=False) chỉ dùng để map AI
+            products = Product.query.with_entities(Product.id, Product.name, Product.sku).all()
+            ProductMatchIndex.max_candidates = Config.SEARCH_MAX_CANDIDATES
+            names_clean = remove_vietnamese_tones_many([p.name for p in products])
+            ProductMatchIndex.load(
+                (p.id, p.name, name_clean, p.sku) for p, name_clean in zip(products, names_clean)
+            )
+            return True
+        except Exception as e:
+            if has_index:
+                print(f" [Search Index] Không load lại được index, dùng tiếp bản cũ: {e}")
+                return True
+            print(f" [Search Index] Không load được index, dùng MongoDB: {e}")
+            return False
+        finally:
+            SearchService._index_reload_lock.release()
+
+    @staticmethod
+    def _sync_index(product_obj):
+        """
+        Cập nhật index trong bộ nhớ sau khi thêm/sửa sản phẩm (giữ cả sản phẩm ngừng kinh doanh, giống MongoDB).
+        Index chưa load (vd: tắt SEARCH_INDEX_ENABLED, chưa từng cần SEARCH_INDEX_FALLBACK) thì upsert không làm gì.
+        """
+        ProductMatchIndex.upsert(
+            product_obj.id, product_obj.name,
+            SearchService.remove_vietnamese_tones(product_obj.name), product_obj.sku
+        )
 
     @staticmethod
     def match_product(ocr_text):
         if not ocr_text or len(ocr_text.strip()) < 2: 
             return None
+
+        # Index trong bộ nhớ: ứng viên theo trigram + chấm WRatio, không cần truy vấn MongoDB
+        if Config.SEARCH_INDEX_ENABLED and SearchService._ensure_index():
+            return SearchService._match_with_index(ocr_text)
             
         # 1. TÌM ỨNG VIÊN (CANDIDATES)
         candidates_cursor = SearchService.collection.find(
@@ -46,22 +89,18 @@ class SearchService:
         
         candidates = list(candidates_cursor)
         
-        # Fallback tìm kiếm mù (Regex) nếu Full-text search thất bại
-        if not candidates:
-            longest_word = max(ocr_text.split(), key=len, default="")
-            if len(longest_word) > 3:
-                candidates = list(SearchService.collection.find(
-                    {"search_text": {"$regex": longest_word, "$options": "i"}}
-                ).limit(10))
-
+        # Fallback khi Full-text search thất bại (tên viết tắt / lỗi OCR): chỉ mục trigram trong bộ nhớ
+        # (thay cho $regex không neo đầu chuỗi -> quét toàn bộ collection), chỉ khi bật SEARCH_INDEX_FALLBACK
         if not candidates:
+            if Config.SEARCH_INDEX_FALLBACK and SearchService._ensure_index():
+                return SearchService._match_with_index(ocr_text)
             return {"status": "NEW", "confidence": 0.0, "match": None}
 
         # 2. SO KHỚP KÉP (DUAL MATCHING STRATEGY)
         ocr_clean = SearchService.remove_vietnamese_tones(ocr_text)
         choices = {}
         for c in candidates:
-            db_name_clean = c.get('name_no_tone', SearchService.remove_vietnamese_tones(c['name']))
+            db_name_clean = c.get('name_no_tone') or SearchService.remove_vietnamese_tones(c['name'])
             choices[str(c['_id'])] = db_name_clean
 
         # Bước 2a: Tìm thằng giống nhất bằng WRatio (Chấp nhận viết tắt, sai trật tự)
@@ -72,7 +111,98 @@ class SearchService:
 
         match_name_clean, score_wratio, match_key = best_match
         found_product = next((c for c in candidates if str(c['_id']) == match_key), None)
+        return SearchService._decide(ocr_clean, match_name_clean, score_wratio, {
+            "id": found_product['mysql_id'], "name": found_product['name'], "sku": found_product['sku']
+        })
+
+    @staticmethod
+    def _match_with_index(ocr_text):
+        ocr_clean = SearchService.remove_vietnamese_tones(ocr_text)
+        best = ProductMatchIndex.best_matches([ocr_clean])[0]
+        if not best:
+            return {"status": "NEW", "confidence": 0.0, "match": None}
+        product, score_wratio, match_name_clean = best
+        return SearchService._decide(ocr_clean, match_name_clean, score_wratio, product)
 
+    @staticmethod
+    def match_products_bulk(ocr_texts):
+        """
+        Match tất cả dòng OCR của 1 hóa đơn trong 1 lần -> list kết quả (cùng schema với match_product)
+        theo đúng thứ tự đầu vào (None cho dòng quá ngắn).
+        - Các dòng trùng tên sau chuẩn hóa chỉ được chấm 1 lần.
+        - Index bật: ứng viên trigram của mọi dòng + 1 lượt cdist. Index tắt: 1 truy vấn $text chung cho mọi dòng,
+          chấm cả ma trận tên x ứng viên; dòng không có ứng viên nào được tìm lại trong chỉ mục trigram.
+        """
+        results = [None] * len(ocr_texts)
+        positions = {}  # tên không dấu -> [vị trí trong ocr_texts]
+        for i, text in enumerate(ocr_texts):
+            if not text or len(text.strip()) < 2:
+                continue
+            positions.setdefault(SearchService.remove_vietnamese_tones(text), []).append(i)
+        if not positions:
+            return results
+
+        queries = list(positions)
+        if Config.SEARCH_INDEX_ENABLED and SearchService._ensure_index():
+            best = ProductMatchIndex.best_matches(queries)
+        else:
+            best = SearchService._best_matches_from_mongo([ocr_texts[positions[q][0]] for q in queries], queries)
+            missing = [i for i, match in enumerate(best) if match is None]
+            # Dòng không có ứng viên từ $text -> tìm lại trong chỉ mục trigram (1 lượt cho tất cả, nếu bật fallback)
+            if missing and Config.SEARCH_INDEX_FALLBACK and SearchService._ensure_index():
+                retried = ProductMatchIndex.best_matches([queries[i] for i in missing])
+                for i, match in zip(missing, retried):
+                    best[i] = match
+
+        for query, match in zip(queries, best):
+            if match is None:
+                result = {"status": "NEW", "confidence": 0.0, "match": None}
+            else:
+                product, score_wratio, match_name_clean = match
+                result = SearchService._decide(query, match_name_clean, score_wratio, product)
+            for i in positions[query]:
+                results[i] = dict(result)
+        return results
+
+    @staticmethod
+    def _best_matches_from_mongo(raw_texts, queries_clean):
+        """
+        1 truy vấn $text (các từ được OR với nhau) lấy ứng viên cho mọi dòng -> giống ProductMatchIndex.best_matches.
+        Mỗi dòng chỉ được chọn trong các ứng viên có chung ít nhất 1 từ với chính dòng đó (ứng viên do từ của dòng
+        khác kéo về không tính) -> dòng không có ứng viên riêng trả về None.
+        """
+        candidates = list(SearchService.collection.find(
+            {"$text": {"$search": " ".join(raw_texts)}},
+            {"score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(20 * len(raw_texts)))
+        if not candidates:
+            return [None] * len(queries_clean)
+
+        names_clean = [c.get('name_no_tone') or SearchService.remove_vietnamese_tones(c['name']) for c in candidates]
+        # Từ của ứng viên giống những gì index text có: tên không dấu + SKU
+        candidate_terms = [
+            set(name.split()) | set(SearchService.remove_vietnamese_tones(c.get('sku') or '').split())
+            for c, name in zip(candidates, names_clean)
+        ]
+        allowed = [
+            {slot for slot, terms in enumerate(candidate_terms) if terms & set(query.split())}
+            for query in queries_clean
+        ]
+        results = []
+        for slot, score in best_choices(queries_clean, [prepare_choice(n) for n in names_clean], allowed):
+            if slot is None or score <= 0:
+                results.append(None)
+                continue
+            c = candidates[slot]
+            results.append(({"id": c['mysql_id'], "name": c['name'], "sku": c['sku']}, score, names_clean[slot]))
+        return results
+
+    @staticmethod
+    def _decide(ocr_clean, match_name_clean, score_wratio, product):
+        """
+        Ma trận quyết định AUTO / SUGGESTION / NEW cho ứng viên tốt nhất (dùng chung cho MongoDB và index).
+        product: {"id", "name", "sku"} của ứng viên.
+        """
         # Bước 2b: KIỂM TRA NGHIÊM NGẶT (Strict Check)
         # Tính thêm điểm token_sort_ratio (So sánh toàn bộ từ, không chấp nhận partial match quá đà)
         # Ví dụ: "gia vị sốt vang" vs "bột chiên gia vị"
@@ -118,43 +248,49 @@ class SearchService:
             "status": status,
             "confidence": final_score / 100.0,
             "match": {
-                "id": found_product['mysql_id'],
-                "name": found_product['name'],
-                "sku": found_product['sku']
+                "id": product['id'],
+                "name": product['name'],
+                "sku": product['sku']
             }
         }
 
+    @staticmethod
+    def build_mongo_doc(product_obj, name_no_tone=None):
+        """Document MongoDB của 1 sản phẩm (tên không dấu chỉ tính 1 lần; mongo_sync truyền sẵn theo lô)"""
+        if name_no_tone is None:
+            name_no_tone = remove_vietnamese_tones(product_obj.name)
+        return {
+            "mysql_id": product_obj.id,
+            "name": product_obj.name,
+            "name_no_tone": name_no_tone,
+            "sku": product_obj.sku,
+            # Giữ cả sản phẩm ngừng kinh doanh (AI mapping vẫn cần danh mục đầy đủ), chỉ đánh dấu trạng thái
+            "is_active": product_obj.is_active,
+            # Tạo trường search_text chứa mọi thứ có thể tìm kiếm
+            "search_text": f"{product_obj.name} {name_no_tone} {product_obj.sku}"
+        }
+
     @staticmethod
     def add_product(product_obj):
         """Đồng bộ sản phẩm mới sang MongoDB"""
         try:
-            doc = {
-                "mysql_id": product_obj.id,
-                "name": product_obj.name,
-                "name_no_tone": SearchService.remove_vietnamese_tones(product_obj.name),
-                "sku": product_obj.sku,
-                # Tạo trường search_text chứa mọi thứ có thể tìm kiếm
-                "search_text": f"{product_obj.name} {SearchService.remove_vietnamese_tones(product_obj.name)} {product_obj.sku}" 
-            }
+            doc = SearchService.build_mongo_doc(product_obj)
             SearchService.collection.insert_one(doc)
             print(f" Synced to Mongo: {product_obj.name}")
         except Exception as e:
             print(f" Mongo Sync Error: {e}")
+        SearchService._sync_index(product_obj)
 
     @staticmethod
     def update_product_in_mongo(product_obj):
-        """Cập nhật sản phẩm trong MongoDB"""
+        """Cập nhật sản phẩm trong MongoDB (kể cả ngừng kinh doanh: chỉ cập nhật is_active)"""
         try:
             SearchService.collection.update_one(
                 {"mysql_id": product_obj.id},
-                {"$set": {
-                    "name": product_obj.name,
-                    "name_no_tone": SearchService.remove_vietnamese_tones(product_obj.name),
-                    "sku": product_obj.sku,
-                    "search_text": f"{product_obj.name} {SearchService.remove_vietnamese_tones(product_obj.name)} {product_obj.sku}"
-                }},
+                {"$set": SearchService.build_mongo_doc(product_obj)},
                 upsert=True
             )
             print(f" Updated Mongo: {product_obj.name}")
         except Exception as e:
-            print(f" Mongo Update Error: {e}")
\ No newline at end of file
+            print(f" Mongo Update Error: {e}")
+        SearchService._sync_index(product_obj)
\ No newline at end of file
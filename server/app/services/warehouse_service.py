@@ -1,10 +1,16 @@
 # server/app/services/warehouse_service.py
 import re
+import time
+from flask import current_app
 from app.extensions import db
 from app.models import Product, ImportSlip, ImportSlipDetail, ExportSlip, ExportSlipDetail
 from datetime import datetime
 from app import ai_model 
 from app.services.search_service import SearchService
+from app.utils.ocr_cache import OcrResultCache
+from app.utils.ocr_metrics import OcrJobStats, OcrMetrics
+from app.ocr_types import OcrRow, extract_numbers
+from config import Config
 
 class WarehouseService:
     @staticmethod
@@ -131,34 +137,29 @@ class WarehouseService:
     @staticmethod
     def _extract_numbers(text):
         """Tìm tất cả các con số trong một chuỗi bất kỳ"""
-        text = text.replace('(', '1').replace('l', '1').replace('O', '0').replace('o', '0')
-        matches = list(re.finditer(r'\d+(?:[.,]\d+)*', text))
-        numbers = []
-        for m in matches:
-            try:
-                clean_str = m.group().replace('.', '').replace(',', '')
-                val = float(clean_str)
-                numbers.append(val)
-            except: pass
-        return numbers
+        return extract_numbers(text)
 
     @staticmethod
     def _parse_row_logic(line):
         """
-        Logic: Tách chuỗi bằng dấu "|".
-        - Phần 0: Chắc chắn là Tên (AI đã gom).
-        - Phần 1, 2, 3: Là các con số (SL, Tổng, Giá). Ta sẽ extract lại và dùng logic toán học.
+        Nhận OcrRow (dữ liệu có cấu trúc từ InvoiceRecognizer) hoặc chuỗi cũ "name | qty | amount | price".
+        - Tên: cột ItemName (hoặc phần 0 của chuỗi).
+        - Các con số (SL, Tổng, Giá): OcrRow đã tách sẵn; chuỗi cũ thì extract lại bằng regex.
+        Sau đó dùng logic toán học; dòng có độ tin cậy nhãn LayoutLM thấp luôn cần kiểm tra lại.
         """
-        parts = line.split('|')
-        
-        # 1. Lấy tên (Phần đầu tiên)
-        raw_name = parts[0]
+        ocr_row = line if isinstance(line, OcrRow) else None
+        if ocr_row:
+            raw_name = ocr_row.name
+            numbers_found = ocr_row.numbers
+        else:
+            parts = line.split('|')
+            # 1. Lấy tên (Phần đầu tiên)
+            raw_name = parts[0]
+            # 2. Lấy tất cả các con số từ các phần còn lại
+            # Gộp chuỗi còn lại để extract số 1 lần cho tiện
+            numbers_found = WarehouseService._extract_numbers(" ".join(parts[1:]))
+
         final_name = WarehouseService._clean_product_name(raw_name)
-        
-        # 2. Lấy tất cả các con số từ các phần còn lại
-        # Gộp chuỗi còn lại để extract số 1 lần cho tiện
-        numbers_part = " ".join(parts[1:]) 
-        numbers_found = WarehouseService._extract_numbers(numbers_part)
         count = len(numbers_found)
         
         qty = 0; price = 0; amount = 0
@@ -187,64 +188,178 @@ class WarehouseService:
             # [MỞ RỘNG] Nếu có số thứ 3 (số nhỏ), check xem nó có khớp với SL tính được không
             # Nếu khớp -> Tăng độ tin cậy. Nếu không -> Kệ nó (vì ta tin phép chia hơn)
 
+            # Phép chia không ra số nguyên nhưng các cột đã gán nhãn tự khớp nhau (SL x Giá = Tổng)
+            # -> tin theo cột (vd: SL lớn hơn đơn giá, hoặc trong cột có số rác)
+            if not is_trustworthy and ocr_row and ocr_row.quantity and ocr_row.unit_price and ocr_row.amount:
+                if abs(ocr_row.quantity * ocr_row.unit_price - ocr_row.amount) < 1:
+                    qty = int(ocr_row.quantity) if ocr_row.quantity.is_integer() else ocr_row.quantity
+                    price = ocr_row.unit_price; amount = ocr_row.amount
+                    is_trustworthy = True
+
         elif count == 1:
             # Chỉ có 1 số -> Đoán là Giá = Tổng, SL = 1
             val = numbers_found[0]
             qty = 1; price = val; amount = val
             is_trustworthy = False # Cần check
 
+        # Model không chắc chắn về cột của chữ -> bắt người dùng kiểm tra lại
+        if ocr_row and ocr_row.min_confidence < Config.OCR_MIN_LABEL_CONFIDENCE:
+            is_trustworthy = False
+
         return final_name, qty, price, amount, is_trustworthy
 
     @staticmethod
-    def process_ocr_upload(file_path):
-        raw_text_block = ai_model.process_ocr(file_path)
-        lines = raw_text_block.strip().split('\n')
-        processed_items = []
-        
-        SKIP_KEYWORDS = ["ITEMNAME", "QUANTITY", "AMOUNT", "UNITPRICE"]
-
-        for line in lines:
-            line = line.strip()
-            if not line: continue
-            
-            # Kiểm tra keyword rác (Header)
-            if any(k in line.upper() for k in SKIP_KEYWORDS): continue
-            
-            # Chỉ cần truyền dòng có chứa dấu | vào
-            if "|" not in line: 
-                # Trường hợp AI cũ hoặc lỗi format, fallback về logic cũ hoặc bỏ qua
-                # Nhưng code my_ocr_core mới đã đảm bảo có |
-                continue
+    def _parse_ocr_rows(ocr_rows):
+        """
+        List[OcrRow] -> các dòng sản phẩm đã parse (chưa fuzzy match).
+        Kết quả chỉ phụ thuộc vào ảnh + model nên có thể cache được.
+        """
+        rows = []
+        for ocr_row in ocr_rows:
+            ocr_row = OcrRow.from_dict(ocr_row)
+            final_name, qty, price, amount, is_trustworthy = WarehouseService._parse_row_logic(ocr_row)
 
-            final_name, qty, price, amount, is_trustworthy = WarehouseService._parse_row_logic(line)
-            
             if len(final_name) < 2: continue
-            
+
             if price == 0 and amount == 0:
                 continue
 
-            # Fuzzy Search
-            match_result = SearchService.match_product(final_name)
-            product_id = None; sku = ""; status = "NEW"; confidence = 0.0; display_name = final_name
-
-            if match_result and match_result['match']:
-                display_name = match_result['match']['name']
-                product_id = match_result['match']['id']
-                sku = match_result['match']['sku']
-                status = match_result['status']
-                confidence = match_result['confidence']
-
-            ui_item = {
-                "tempId": int(datetime.now().timestamp() * 1000000) + len(processed_items),
-                "ocrText": line.split('|')[0], # Chỉ hiện tên gốc
-                "productId": product_id, "productName": display_name, "sku": sku,
-                "quantity": qty, "unitPrice": float(price), "amount": float(amount),
-                "status": status, "confidence": confidence, "isUserEdited": False,
-                "needsManualCheck": not is_trustworthy
-            }
-            processed_items.append(ui_item)
-
-        return { "items": processed_items, "raw_text": raw_text_block }
+            rows.append({
+                "ocrText": ocr_row.name,
+                "name": final_name, "quantity": qty,
+                "unitPrice": float(price), "amount": float(amount),
+                "isTrustworthy": is_trustworthy,
+                "labelConfidence": round(ocr_row.min_confidence, 4),
+                "page": ocr_row.page,
+                "boxes": ocr_row.boxes
+            })
+
+        return rows
+
+    @staticmethod
+    def _build_ui_item(row, index, match_result):
+        """1 dòng đã parse + kết quả Smart Search của dòng đó -> item cho màn hình nhập kho"""
+        final_name = row["name"]
+        product_id = None; sku = ""; status = "NEW"; confidence = 0.0; display_name = final_name
+
+        if match_result and match_result['match']:
+            display_name = match_result['match']['name']
+            product_id = match_result['match']['id']
+            sku = match_result['match']['sku']
+            status = match_result['status']
+            confidence = match_result['confidence']
+
+        return {
+            "tempId": int(datetime.now().timestamp() * 1000000) + index,
+            "ocrText": row["ocrText"],
+            "productId": product_id, "productName": display_name, "sku": sku,
+            "quantity": row["quantity"], "unitPrice": row["unitPrice"], "amount": row["amount"],
+            "status": status, "confidence": confidence, "isUserEdited": False,
+            "needsManualCheck": not row["isTrustworthy"]
+        }
+
+    @staticmethod
+    def _run_ocr_with_cache(file_path, stats=None, tier=None):
+        """
+        Trả về (raw_text_block, rows, pages, cache_hit).
+        Cache theo nội dung ảnh + phiên bản model + tier -> upload lại cùng 1 ảnh không phải chạy lại AI.
+        """
+        stats = stats or OcrJobStats()
+        cache = None
+        cache_key = None
+        if current_app.config.get('OCR_CACHE_ENABLED', True):
+            try:
+                with stats.stage("cache_lookup"):
+                    cache = OcrResultCache.from_config(current_app.config, tier)
+                    if isinstance(file_path, bytes):
+                        cache_key = cache.key_for_bytes(file_path)
+                    else:
+                        cache_key = cache.key_for_file(file_path)
+                    cached = cache.get(cache_key)
+                if cached:
+                    print(f" [OCR Cache] Hit: {cache_key[:16]}...")
+                    stats.count("cache_hit")
+                    return cached["raw_text"], cached["rows"], cached.get("pages", []), True
+                stats.count("cache_miss")
+            except Exception as e:
+                print(f" [OCR Cache] Bỏ qua cache do lỗi: {e}")
+                cache = None
+
+        raw_text_block, ocr_rows, pages, ocr_metrics = ai_model.process_ocr_document(file_path, tier)
+        stats.merge(ocr_metrics)
+        with stats.stage("parse_rows"):
+            rows = WarehouseService._parse_ocr_rows(ocr_rows)
+
+        # Không cache kết quả lỗi/rỗng để lần sau còn chạy lại
+        if cache and raw_text_block and not raw_text_block.startswith("ERROR"):
+            cache.set(cache_key, {"raw_text": raw_text_block, "rows": rows, "pages": pages})
+
+        return raw_text_block, rows, pages, False
+
+    @staticmethod
+    def process_ocr_upload(file_path, debug=False, tier=None):
+        """
+        Ảnh hoặc PDF nhiều trang (đường dẫn hoặc bytes upload) -> danh sách item cho màn hình nhập kho.
+        Với PDF, các dòng của mọi trang được gộp chung; "pages" chứa thời gian xử lý từng trang.
+        debug=True: trả thêm "metrics" (thời gian từng stage + bộ đếm) của riêng request này.
+        tier: "fast" / "accurate" (Config.OCR_TIERS), None = OCR_DEFAULT_TIER. Tier lạ -> ValueError.
+        """
+        result = { "items": [] }
+        # Không stream -> match cả hóa đơn trong 1 lần gọi bulk (dòng trùng tên chỉ chấm 1 lần trên toàn hóa đơn)
+        events = WarehouseService.iter_ocr_upload(file_path, debug=debug, tier=tier, match_chunk_size=0)
+        for event, data in events:
+            if event == "raw_text":
+                result.update(data)
+            elif event == "item":
+                result["items"].append(data)
+            elif event == "summary" and debug:
+                result["metrics"] = data["metrics"]
+        return result
+
+    @staticmethod
+    def iter_ocr_upload(file_path, debug=False, tier=None, match_chunk_size=None):
+        """
+        Generator cho bản streaming của process_ocr_upload, yield (event, data):
+        - ("raw_text", {"raw_text", "pages", "cached", "tier"}) ngay khi OCR xong
+        - ("item", ui_item) cho từng dòng (cùng schema với "items"): match theo nhóm match_chunk_size dòng
+          (None = SEARCH_STREAM_CHUNK_SIZE, 0 = cả hóa đơn) bằng 1 lần gọi bulk, nhóm nào xong thì gửi ngay
+        - ("summary", {"total", "statuses", "cached", "seconds"[, "metrics"]}) ở cuối
+        """
+        tier = ai_model.resolve_tier(tier)
+        stats = OcrJobStats()
+        stats.count(f"tier_{tier}")
+        start = time.perf_counter()
+        raw_text_block, rows, pages, cache_hit = WarehouseService._run_ocr_with_cache(file_path, stats, tier)
+        yield "raw_text", { "raw_text": raw_text_block, "pages": pages, "cached": cache_hit, "tier": tier }
+
+        # Luôn match lại để phản ánh thay đổi mới nhất của danh mục sản phẩm
+        if match_chunk_size is None:
+            match_chunk_size = Config.SEARCH_STREAM_CHUNK_SIZE
+        chunk_size = match_chunk_size if match_chunk_size > 0 else max(1, len(rows))
+        statuses = {}
+        for chunk_start in range(0, len(rows), chunk_size):
+            chunk = rows[chunk_start:chunk_start + chunk_size]
+            with stats.stage("match"):
+                match_results = SearchService.match_products_bulk([row["name"] for row in chunk])
+            for offset, (row, match_result) in enumerate(zip(chunk, match_results)):
+                item = WarehouseService._build_ui_item(row, chunk_start + offset, match_result)
+                statuses[item["status"]] = statuses.get(item["status"], 0) + 1
+                yield "item", item
+
+        # Với bản streaming, "total" gồm cả thời gian ghi dữ liệu ra client giữa các lần yield
+        stats.add_time("total", time.perf_counter() - start)
+        stats.count("items", len(rows))
+        for status, count in statuses.items():
+            stats.count(f"match_{status}", count)
+        OcrMetrics.observe(stats)
+
+        summary = {
+            "total": len(rows), "statuses": statuses, "cached": cache_hit,
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        if debug:
+            summary["metrics"] = stats.to_dict()
+        yield "summary", summary
 
     @staticmethod
     def create_product(data):
@@ -0,0 +1,66 @@
+# server/app/utils/import_budget.py
+"""
+Kiểm tra "ngân sách import": create_app() KHÔNG được kéo theo các thư viện ML nặng.
+Chạy trong 1 interpreter mới (subprocess) để sys.modules sạch.
+
+Cách chạy (từ thư mục server, dùng trong CI):
+    python -m app.utils.import_budget --max-seconds 1.0
+Trả về exit code 1 nếu có thư viện nặng bị import hoặc vượt thời gian cho phép.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Các thư viện chỉ được phép load trong process OCR
+HEAVY_MODULES = ("torch", "paddle", "paddleocr", "transformers", "vietocr")
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+heavy = sorted({m.split('.')[0] for m in sys.modules} & set(%r))
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+"""
+
+
+def measure_create_app():
+    """Trả về {"seconds": thời gian import + create_app, "heavy": [thư viện nặng đã bị load]}"""
+    env = dict(os.environ, OCR_PRELOAD_MODELS='0')
+    proc = subprocess.run(
+        [sys.executable, "-c", _PROBE % (HEAVY_MODULES,)],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    # Dòng cuối là JSON, các dòng trước có thể là log print của app
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra create_app() không import thư viện ML")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Thời gian tối đa cho import + create_app (bỏ trống = không kiểm tra)")
+    args = parser.parse_args()
+
+    result = measure_create_app()
+    print(f"create_app(): {result['seconds']:.3f}s")
+
+    failed = False
+    if result["heavy"]:
+        print(f"❌ create_app() đã import thư viện nặng: {', '.join(result['heavy'])}")
+        failed = True
+    if args.max_seconds is not None and result["seconds"] > args.max_seconds:
+        print(f"❌ Vượt ngân sách thời gian: {result['seconds']:.3f}s > {args.max_seconds}s")
+        failed = True
+
+    if not failed:
+        print("✅ Không có thư viện ML nào bị import khi khởi tạo app.")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# server/app/utils/layout_templates.py
+"""
+Cache mẫu bố cục hóa đơn theo nhà cung cấp (bỏ qua LayoutLMv3 khi gặp lại mẫu quen).
+- Dấu vân tay (fingerprint) của 1 hóa đơn = dòng tiêu đề bảng: cột nào (Tên hàng/SL/Đơn giá/Thành tiền)
+  nằm ở vị trí x nào (làm tròn theo FINGERPRINT_BUCKET trên thang 0-1000).
+- Học: sau mỗi lần LayoutLMv3 chạy với mọi dòng có độ tin cậy >= learn_confidence, lưu khoảng x của từng cột.
+  Các lần học sau khớp khoảng cũ thì tăng số lần xác nhận, lệch thì học lại từ đầu.
+- Dùng: mẫu đã được xác nhận >= min_confirmations lần -> gán cột cho từng chữ theo vị trí x,
+  không cần chạy LayoutLMv3. Tỉ lệ chữ gán được cột thấp hơn min_coverage -> quay về model đầy đủ.
+Module này không import thư viện ML (dùng được ở cả process API lẫn pool worker).
+"""
+import os
+import copy
+import json
+import tempfile
+import threading
+
+from app.utils.text_utils import remove_vietnamese_tones
+
+COLUMNS = ("ItemName", "Quantity", "UnitPrice", "Amount")
+
+# Từ khóa tiêu đề cột (không dấu, chữ thường); thử cụm dài trước để "thanh tien" không bị bắt bởi "tien"
+HEADER_KEYWORDS = sorted([
+    ("ten hang", "ItemName"), ("ten san pham", "ItemName"), ("ten hang hoa", "ItemName"),
+    ("mat hang", "ItemName"), ("hang hoa", "ItemName"), ("dien giai", "ItemName"),
+    ("so luong", "Quantity"), ("sluong", "Quantity"), ("sl", "Quantity"),
+    ("don gia", "UnitPrice"), ("gia ban", "UnitPrice"),
+    ("thanh tien", "Amount"), ("thanhtien", "Amount"), ("tong tien", "Amount"),
+], key=lambda kv: -len(kv[0]))
+
+# Dòng bắt đầu bằng các từ này là phần tổng kết dưới bảng -> không thuộc dòng hàng hóa
+FOOTER_PREFIXES = ("tong", "cong tien", "thanh toan", "chiet khau", "thue", "vat")
+
+# Độ rộng ô (thang 0-1000) khi làm tròn vị trí cột trong fingerprint
+FINGERPRINT_BUCKET = 100
+# 2 khoảng x của cùng 1 cột được coi là khớp nhau khi IoU >= ngưỡng này
+RANGE_MATCH_IOU = 0.5
+# Chữ nằm ngoài mọi cột nhưng cách cột gần nhất không quá bấy nhiêu (thang 0-1000) vẫn được gán vào cột đó
+ASSIGN_MARGIN = 20
+
+
+def _x_center(box):
+    return (box[0] + box[2]) / 2
+
+
+def _same_line(a, b, threshold=0.5):
+    overlap = min(a[3], b[3]) - max(a[1], b[1])
+    height = min(a[3] - a[1], b[3] - b[1])
+    return overlap > 0 and height > 0 and overlap / height > threshold
+
+
+def _header_column(text):
+    """Chữ của 1 box -> tên cột nếu là tiêu đề cột, ngược lại None"""
+    normalized = remove_vietnamese_tones(text)
+    for keyword, column in HEADER_KEYWORDS:
+        if normalized == keyword or normalized.startswith(keyword + " "):
+            return column
+    return None
+
+
+def _range_iou(a, b):
+    inter = min(a[1], b[1]) - max(a[0], b[0])
+    union = max(a[1], b[1]) - min(a[0], b[0])
+    return inter / union if inter > 0 and union > 0 else 0.0
+
+
+class LayoutHeader:
+    """Dòng tiêu đề bảng tìm được trong 1 trang (tọa độ 0-1000)"""
+    __slots__ = ("fingerprint", "centers", "bottom", "footer_top")
+
+    def __init__(self, fingerprint, centers, bottom, footer_top):
+        self.fingerprint = fingerprint
+        self.centers = centers        # cột -> tâm x của chữ tiêu đề
+        self.bottom = bottom          # y dưới cùng của dòng tiêu đề
+        self.footer_top = footer_top  # y của dòng tổng kết đầu tiên dưới bảng (1000 nếu không có)
+
+
+class LayoutTemplateStore:
+    def __init__(self, path=None, min_confirmations=3, min_coverage=0.85, learn_confidence=0.9):
+        """
+        path: file JSON lưu mẫu (None = chỉ giữ trong bộ nhớ)
+        min_confirmations: số lần LayoutLMv3 cho cùng kết quả trước khi mẫu được dùng
+        min_coverage: tỉ lệ chữ trong bảng phải gán được cột, thấp hơn -> chạy LayoutLMv3
+        learn_confidence: chỉ học từ kết quả mà mọi dòng có độ tin cậy nhãn >= ngưỡng này
+        """
+        self.path = path
+        self.min_confirmations = int(min_confirmations)
+        self.min_coverage = float(min_coverage)
+        self.learn_confidence = float(learn_confidence)
+        self._lock = threading.Lock()
+        # fingerprint -> {"columns": {cột: [x1, x2]}, "centers": {cột: x}, "confirmations": int}
+        self._templates = self._read_file()
+        # Thời gian LayoutLMv3 trung bình cho mỗi chữ (EMA) -> ước lượng thời gian tiết kiệm được
+        self._layout_seconds_per_word = None
+
+    # --- Nhận diện mẫu ---
+
+    @staticmethod
+    def find_header(words, boxes):
+        """Tìm dòng tiêu đề bảng (>= 2 cột nhận ra được) -> LayoutHeader hoặc None"""
+        candidates = [(_header_column(w), b) for w, b in zip(words, boxes)]
+        candidates = [(c, b) for c, b in candidates if c]
+        if len(candidates) < 2:
+            return None
+
+        best = None
+        for column, box in candidates:
+            line = {}
+            for other_column, other_box in candidates:
+                if _same_line(box, other_box) and other_column not in line:
+                    line[other_column] = other_box
+            if len(line) < 2:
+                continue
+            top = min(b[1] for b in line.values())
+            # Ưu tiên dòng nhận ra nhiều cột nhất, rồi tới dòng nằm trên cùng
+            if best is None or (len(line), -top) > (len(best), -min(b[1] for b in best.values())):
+                best = line
+        if best is None:
+            return None
+
+        centers = {column: _x_center(box) for column, box in best.items()}
+        bottom = max(b[3] for b in best.values())
+        footer_top = 1000
+        for word, box in zip(words, boxes):
+            if box[1] > bottom and remove_vietnamese_tones(word).startswith(FOOTER_PREFIXES):
+                footer_top = min(footer_top, box[1])
+
+        ordered = sorted(centers.items(), key=lambda kv: kv[1])
+        fingerprint = "|".join(f"{column}@{int(x // FINGERPRINT_BUCKET)}" for column, x in ordered)
+        return LayoutHeader(fingerprint, centers, bottom, footer_top)
+
+    def match(self, header):
+        """Mẫu đã đủ số lần xác nhận cho header này -> dict mẫu, ngược lại None"""
+        if header is None:
+            return None
+        with self._lock:
+            template = self._templates.get(header.fingerprint)
+            if template and template["confirmations"] >= self.min_confirmations:
+                return template
+        return None
+
+    # --- Gán cột theo hình học ---
+
+    def assign(self, template, header, words, boxes):
+        """
+        Gán nhãn cột cho từng chữ theo khoảng x của mẫu (dịch theo độ lệch của dòng tiêu đề hiện tại).
+        -> (labels cùng định dạng LayoutLMv3 "<Cột>Value" hoặc "O", coverage = tỉ lệ chữ trong bảng gán được cột)
+        """
+        shifts = [header.centers[c] - x for c, x in template["centers"].items() if c in header.centers]
+        shift = sum(shifts) / len(shifts) if shifts else 0.0
+        columns = {c: (r[0] + shift, r[1] + shift) for c, r in template["columns"].items()}
+
+        labels = []
+        in_table = assigned = 0
+        for box in boxes:
+            center_y = (box[1] + box[3]) / 2
+            if center_y <= header.bottom or center_y >= header.footer_top:
+                labels.append("O")
+                continue
+            in_table += 1
+
+            x = _x_center(box)
+            best_column, best_distance = None, None
+            for column, (x1, x2) in columns.items():
+                # Nằm trong khoảng -> khoảng cách tới tâm cột (âm để luôn thắng các cột chỉ ở gần)
+                if x1 <= x <= x2:
+                    distance = abs(x - (x1 + x2) / 2) - 1000
+                else:
+                    distance = min(abs(x - x1), abs(x - x2))
+                    if distance > ASSIGN_MARGIN:
+                        continue
+                if best_distance is None or distance < best_distance:
+                    best_column, best_distance = column, distance
+
+            if best_column:
+                assigned += 1
+                labels.append(f"{best_column}Value")
+            else:
+                labels.append("O")
+
+        coverage = assigned / in_table if in_table else 0.0
+        return labels, coverage
+
+    # --- Học từ kết quả LayoutLMv3 ---
+
+    def learn(self, header, rows, layout_seconds=None, n_words=None):
+        """
+        rows: List[OcrRow] do LayoutLMv3 vừa trích xuất cho trang có dòng tiêu đề header.
+        Trả về True nếu mẫu được cập nhật.
+        """
+        if layout_seconds is not None and n_words:
+            per_word = layout_seconds / n_words
+            previous = self._layout_seconds_per_word
+            self._layout_seconds_per_word = per_word if previous is None else 0.8 * previous + 0.2 * per_word
+
+        if header is None or len(rows) < 2:
+            return False
+        if any(row.min_confidence < self.learn_confidence for row in rows):
+            return False
+
+        columns = {}
+        for row in rows:
+            for column, box in row.boxes.items():
+                if column not in COLUMNS:
+                    continue
+                x1, x2 = columns.get(column, (box[0], box[2]))
+                columns[column] = (min(x1, box[0]), max(x2, box[2]))
+        if "ItemName" not in columns or len(columns) < 2:
+            return False
+
+        with self._lock:
+            template = self._templates.get(header.fingerprint)
+            consistent = template is not None and set(template["columns"]) == set(columns) and all(
+                _range_iou(template["columns"][c], r) >= RANGE_MATCH_IOU for c, r in columns.items()
+            )
+            if consistent:
+                # Mở rộng khoảng cột theo lần quan sát mới
+                template["columns"] = {
+                    c: [min(template["columns"][c][0], r[0]), max(template["columns"][c][1], r[1])]
+                    for c, r in columns.items()
+                }
+                template["confirmations"] += 1
+            else:
+                template = {
+                    "columns": {c: list(r) for c, r in columns.items()},
+                    "centers": dict(header.centers),
+                    "confirmations": 1
+                }
+                self._templates[header.fingerprint] = template
+            # Bản sao sâu: ghi file ngoài lock trong khi learn() khác có thể sửa dict lồng bên trong
+            snapshot = copy.deepcopy(self._templates)
+
+        self._write_file(snapshot)
+        return True
+
+    def estimate_saved_seconds(self, n_words, template_seconds):
+        """Thời gian LayoutLMv3 ước tính cho n_words chữ trừ đi thời gian gán cột theo mẫu"""
+        if self._layout_seconds_per_word is None:
+            return 0.0
+        return max(0.0, self._layout_seconds_per_word * n_words - template_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "templates": len(self._templates),
+                "active": sum(1 for t in self._templates.values() if t["confirmations"] >= self.min_confirmations)
+            }
+
+    # --- Lưu trữ ---
+
+    def _read_file(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f" [OCR Template] Bỏ qua file mẫu lỗi {self.path}: {e}")
+            return {}
+
+    def _write_file(self, templates):
+        """Ghi nguyên tử; gộp với mẫu do process khác đã ghi (giữ bản có nhiều lần xác nhận hơn)"""
+        if not self.path:
+            return
+        try:
+            merged = self._read_file()
+            for fingerprint, template in templates.items():
+                current = merged.get(fingerprint)
+                if current is None or template["confirmations"] >= current["confirmations"]:
+                    merged[fingerprint] = template
+
+            folder = os.path.dirname(self.path) or "."
+            os.makedirs(folder, exist_ok=True)
+            # File tạm tên duy nhất cùng thư mục (nhiều thread/process ghi cùng lúc không đè nhau, os.replace nguyên tử)
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(merged, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            print(f" [OCR Template] Không ghi được file mẫu: {e}")
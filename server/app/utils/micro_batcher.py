@@ -0,0 +1,111 @@
+# server/app/utils/micro_batcher.py
+"""
+Gom các lượt suy luận nhỏ từ nhiều request đồng thời thành 1 batch lớn.
+- Mỗi request gọi submit(items) và chờ; 1 thread nền lấy request đầu tiên trong hàng đợi,
+  chờ thêm tối đa max_wait_ms (hoặc tới khi đủ max_batch_size) rồi chạy process_fn 1 lần cho tất cả.
+- Kết quả được tách lại theo đúng thứ tự/kích thước của từng request.
+- expected_callers (tùy chọn): số request đang chạy; đã gom đủ từ mọi request thì chạy luôn,
+  không chờ hết cửa sổ -> 1 request đơn lẻ gần như không bị cộng thêm độ trễ.
+"""
+import time
+import queue
+import threading
+
+
+class _BatchRequest:
+    __slots__ = ("items", "size", "result", "error", "done")
+
+    def __init__(self, items, size):
+        self.items = items
+        self.size = size
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    def __init__(self, process_fn, max_batch_size=64, max_wait_ms=20, size_fn=len,
+                 expected_callers=None, name="micro-batcher"):
+        """
+        process_fn(list items) -> list kết quả cùng độ dài
+        size_fn(items của 1 request) -> "kích thước" tính vào max_batch_size (mặc định: số item)
+        """
+        self.process_fn = process_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.size_fn = size_fn
+        self.expected_callers = expected_callers
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Thống kê: số lần chạy process_fn, số request, tổng kích thước
+        self.batches = 0
+        self.requests = 0
+        self.items = 0
+
+    def submit(self, items):
+        """Gửi items của 1 request, block tới khi có kết quả (list cùng độ dài items)"""
+        if not items:
+            return []
+        request = _BatchRequest(list(items), self.size_fn(items))
+        self._ensure_thread()
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = batch[0].size
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            if self.expected_callers and len(batch) >= self.expected_callers():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += request.size
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            all_items = [item for request in batch for item in request.items]
+            try:
+                outputs = self.process_fn(all_items)
+                offset = 0
+                for request in batch:
+                    request.result = outputs[offset:offset + len(request.items)]
+                    offset += len(request.items)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            self.batches += 1
+            self.requests += len(batch)
+            self.items += sum(request.size for request in batch)
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_requests_per_batch": round(self.requests / self.batches, 2) if self.batches else 0,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0
+        }
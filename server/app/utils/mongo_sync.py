@@ -1,54 +1,204 @@
 # app/utils/mongo_sync.py
-from pymongo import MongoClient, TEXT
-from app import create_app
+"""
+Đồng bộ Product (MySQL) -> MongoDB cho Smart Search.
+- Tăng dần (mặc định): chỉ đọc sản phẩm có updated_at >= watermark lần trước (lùi SEARCH_SYNC_OVERLAP_SECONDS),
+  stream theo lô bằng yield_per, mỗi lô 1 bulk_write unordered upsert mọi sản phẩm (kể cả ngừng kinh doanh,
+  trạng thái nằm ở trường is_active). Sản phẩm bị xóa hẳn khỏi MySQL watermark không thấy được:
+  chỉ dọn khi chạy với --prune (quét toàn bộ id 2 phía) hoặc --full.
+- Làm lại toàn bộ (--full, hoặc lần đầu khi chưa có watermark): ghi vào collection phụ rồi rename đè
+  collection chính -> Search không bao giờ thấy collection rỗng hay đang ghi dở.
+- Index tạo idempotent, khớp với truy vấn thật: text trên search_text ($text), unique trên mysql_id (upsert/xóa).
+Watermark lưu trong collection sync_state của cùng database.
+
+Cách chạy (từ thư mục server):
+    python -m app.utils.mongo_sync          # tăng dần
+    python -m app.utils.mongo_sync --prune  # tăng dần + dọn sản phẩm đã xóa hẳn khỏi MySQL
+    python -m app.utils.mongo_sync --full   # làm lại toàn bộ
+"""
+import argparse
+from datetime import datetime, timedelta
+from itertools import islice
+
+from pymongo import MongoClient, TEXT, ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+from config import Config
 from app.models import Product
-from app.utils.text_utils import remove_vietnamese_tones
+from app.utils.text_utils import remove_vietnamese_tones_many
 
 # Cấu hình Mongo (Nên để trong config.py nhưng viết tạm ở đây)
 MONGO_URI = 'mongodb://localhost:27017/'
 DB_NAME = 'smart_warehouse_search'
 COLLECTION_NAME = 'products'
+SHADOW_COLLECTION_NAME = 'products_rebuild'
+STATE_COLLECTION_NAME = 'sync_state'
+STATE_ID = 'products'
+
+TEXT_INDEX_NAME = 'search_text_text'
+ID_INDEX_NAME = 'mysql_id_unique'
+
+
+def ensure_indexes(collection):
+    """Tạo index nếu chưa có (gọi lại nhiều lần không sao)"""
+    # Mỗi collection chỉ được 1 index text: bỏ index cũ (name/sku) trước khi tạo index trên search_text
+    for name, info in collection.index_information().items():
+        if name != TEXT_INDEX_NAME and any(kind == TEXT for _, kind in info['key']):
+            collection.drop_index(name)
+            print(f" [Mongo Sync] Đã xóa index text cũ: {name}")
+    collection.create_index([("search_text", TEXT)], name=TEXT_INDEX_NAME)
+    collection.create_index([("mysql_id", ASCENDING)], name=ID_INDEX_NAME, unique=True)
+
+
+def _product_query(since=None):
+    query = Product.query.with_entities(
+        Product.id, Product.name, Product.sku, Product.is_active, Product.updated_at
+    )
+    if since is not None:
+        # updated_at NULL: dòng cũ chưa backfill -> luôn đồng bộ
+        query = query.filter((Product.updated_at >= since) | (Product.updated_at.is_(None)))
+    return query.order_by(Product.id)
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _prepare_chunk(chunk):
+    """Lô dòng MySQL -> (list (row, document), updated_at lớn nhất)"""
+    from app.services.search_service import SearchService
+
+    names_no_tone = remove_vietnamese_tones_many([row.name for row in chunk])
+    prepared = [
+        (row, SearchService.build_mongo_doc(row, name_no_tone))
+        for row, name_no_tone in zip(chunk, names_no_tone)
+    ]
+    latest = max((row.updated_at for row in chunk if row.updated_at), default=None)
+    return prepared, latest
+
+
+def _next_watermark(previous, latest, started):
+    """Mốc mới = updated_at lớn nhất đã đọc, không vượt quá lúc bắt đầu (đồng hồ DB lệch -> đọc lại, không bỏ sót)"""
+    if latest is None:
+        return previous or started
+    return min(latest, started)
+
+
+def _save_state(db_mongo, watermark, mode, stats):
+    db_mongo[STATE_COLLECTION_NAME].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"watermark": watermark, "mode": mode, "synced_at": datetime.utcnow(), "stats": stats}},
+        upsert=True
+    )
+
+
+def full_rebuild(db_mongo, chunk_size):
+    """Ghi toàn bộ sản phẩm vào collection phụ rồi đổi tên đè collection chính"""
+    started = datetime.utcnow()
+    shadow = db_mongo[SHADOW_COLLECTION_NAME]
+    shadow.drop()
 
-def sync_products_to_mongo():
+    written = 0
+    latest = None
+    for chunk in _chunks(_product_query().yield_per(chunk_size), chunk_size):
+        prepared, chunk_latest = _prepare_chunk(chunk)
+        shadow.insert_many([doc for _, doc in prepared], ordered=False)
+        written += len(prepared)
+        if chunk_latest and (latest is None or chunk_latest > latest):
+            latest = chunk_latest
+
+    # Tạo index sau khi ghi xong (nhanh hơn cập nhật index từng document); cũng tạo collection nếu danh mục rỗng
+    ensure_indexes(shadow)
+    shadow.rename(COLLECTION_NAME, dropTarget=True)
+
+    stats = {"written": written}
+    _save_state(db_mongo, _next_watermark(None, latest, started), "full", stats)
+    print(f" [Mongo Sync] Làm lại toàn bộ: {written} sản phẩm.")
+    return stats
+
+
+def _prune_deleted(collection, chunk_size):
+    """Xóa document có mysql_id không còn trong MySQL (sản phẩm bị xóa hẳn, watermark không thấy được)"""
+    mysql_ids = {row.id for row in Product.query.with_entities(Product.id).yield_per(chunk_size)}
+    stale = (
+        doc["mysql_id"] for doc in collection.find({}, {"mysql_id": 1, "_id": 0})
+        if doc.get("mysql_id") not in mysql_ids
+    )
+    removed = 0
+    for chunk in _chunks(stale, chunk_size):
+        removed += collection.delete_many({"mysql_id": {"$in": chunk}}).deleted_count
+    return removed
+
+
+def incremental_sync(db_mongo, chunk_size, prune=False):
+    """
+    Đồng bộ các sản phẩm thay đổi từ lần trước; chưa có watermark -> làm lại toàn bộ.
+    prune=True: dọn thêm sản phẩm đã xóa hẳn (đọc mọi id MySQL + Mongo, không chạy mỗi lần).
+    """
+    state = db_mongo[STATE_COLLECTION_NAME].find_one({"_id": STATE_ID})
+    if not state or not state.get("watermark"):
+        print(" [Mongo Sync] Chưa có watermark -> làm lại toàn bộ.")
+        return full_rebuild(db_mongo, chunk_size)
+
+    started = datetime.utcnow()
+    collection = db_mongo[COLLECTION_NAME]
+    try:
+        ensure_indexes(collection)
+    except OperationFailure as e:
+        # Thường do mysql_id bị trùng trong dữ liệu cũ -> làm lại toàn bộ để sạch
+        print(f" [Mongo Sync] Không tạo được index ({e}) -> làm lại toàn bộ.")
+        return full_rebuild(db_mongo, chunk_size)
+
+    since = state["watermark"] - timedelta(seconds=Config.SEARCH_SYNC_OVERLAP_SECONDS)
+    upserted = modified = deleted = 0
+    latest = None
+    for chunk in _chunks(_product_query(since).yield_per(chunk_size), chunk_size):
+        prepared, chunk_latest = _prepare_chunk(chunk)
+        ops = [UpdateOne({"mysql_id": row.id}, {"$set": doc}, upsert=True) for row, doc in prepared]
+        result = collection.bulk_write(ops, ordered=False)
+        upserted += result.upserted_count
+        modified += result.modified_count
+        if chunk_latest and (latest is None or chunk_latest > latest):
+            latest = chunk_latest
+
+    if prune:
+        deleted = _prune_deleted(collection, chunk_size)
+
+    stats = {"upserted": upserted, "modified": modified, "deleted": deleted}
+    _save_state(db_mongo, _next_watermark(state["watermark"], latest, started), "incremental", stats)
+    print(f" [Mongo Sync] Tăng dần từ {since}: thêm {upserted}, sửa {modified}, xóa {deleted}.")
+    return stats
+
+
+def sync_products_to_mongo(full=False, chunk_size=None, prune=False):
     """
-    Hàm này lấy toàn bộ Product từ MySQL và đẩy sang MongoDB để phục vụ Search.
-    Nên chạy hàm này khi khởi động server hoặc khi có thay đổi lớn về sản phẩm.
+    Đồng bộ Product từ MySQL sang MongoDB để phục vụ Search.
+    Mặc định chỉ đồng bộ phần thay đổi; full=True khi đổi định dạng document (vd: cách chuẩn hóa name_no_tone).
+    prune=True: đồng bộ tăng dần + dọn sản phẩm đã xóa hẳn khỏi MySQL (chạy định kỳ thưa, vd: hằng đêm).
     """
+    from app import create_app
+
+    chunk_size = chunk_size or Config.SEARCH_SYNC_CHUNK_SIZE
     app = create_app()
     with app.app_context():
-        # 1. Kết nối Mongo
         client = MongoClient(MONGO_URI)
         db_mongo = client[DB_NAME]
-        collection = db_mongo[COLLECTION_NAME]
-
-        # 2. Xóa dữ liệu cũ (Reset index)
-        collection.delete_many({})
-        print("Đã xóa dữ liệu cũ trong MongoDB.")
-
-        # 3. Lấy dữ liệu từ MySQL
-        mysql_products = Product.query.all()
-        print(f"Tìm thấy {len(mysql_products)} sản phẩm trong MySQL.")
-
-        # 4. Chuẩn bị dữ liệu
-        mongo_docs = []
-        for p in mysql_products:
-            doc = {
-                "mysql_id": p.id,
-                "name": p.name,
-                "sku": p.sku,
-                # Lưu thêm dạng không dấu để tăng khả năng tìm kiếm
-                "name_no_tone": remove_vietnamese_tones(p.name),
-                "search_text": f"{p.name} {remove_vietnamese_tones(p.name)} {p.sku}"
-            }
-            mongo_docs.append(doc)
-
-        # 5. Insert vào Mongo
-        if mongo_docs:
-            collection.insert_many(mongo_docs)
-            
-            # 6. Tạo Text Index (Quan trọng để tìm kiếm nhanh)
-            collection.create_index([("name", TEXT), ("sku", TEXT)])
-            print("Đã đồng bộ và đánh index thành công!")
+        if full:
+            return full_rebuild(db_mongo, chunk_size)
+        return incremental_sync(db_mongo, chunk_size, prune)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đồng bộ Product từ MySQL sang MongoDB (Smart Search)")
+    parser.add_argument("--full", action="store_true", help="Làm lại toàn bộ qua collection phụ rồi hoán đổi")
+    parser.add_argument("--prune", action="store_true", help="Dọn sản phẩm đã xóa hẳn khỏi MySQL (quét toàn bộ id)")
+    parser.add_argument("--chunk-size", type=int, default=Config.SEARCH_SYNC_CHUNK_SIZE)
+    args = parser.parse_args()
+    sync_products_to_mongo(full=args.full, chunk_size=args.chunk_size, prune=args.prune)
+
 
 if __name__ == "__main__":
-    sync_products_to_mongo()
\ No newline at end of file
+    main()
@@ -0,0 +1,130 @@
+# server/app/utils/ocr_cache.py
+import os
+import json
+import time
+import uuid
+import hashlib
+
+
+class OcrResultCache:
+    """
+    Cache kết quả OCR trên đĩa, khóa = SHA-256(nội dung file) + phiên bản model.
+    - Mỗi entry là 1 file JSON trong thư mục cache.
+    - LRU theo mtime: mỗi lần hit sẽ "touch" file, khi vượt dung lượng thì xóa file cũ nhất.
+    - TTL tính theo thời điểm tạo entry (lưu trong JSON), không bị reset khi hit.
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, model_version="v1"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.model_version = model_version
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def from_config(config, tier=None):
+        """Tạo cache từ app.config (thư mục nằm trong UPLOAD_FOLDER); mỗi tier OCR có không gian key riêng"""
+        return OcrResultCache(
+            cache_dir=os.path.join(config['UPLOAD_FOLDER'], 'ocr_cache'),
+            max_bytes=config.get('OCR_CACHE_MAX_BYTES', 200 * 1024 * 1024),
+            ttl_seconds=config.get('OCR_CACHE_TTL', 7 * 24 * 3600),
+            # Chế độ suy luận (int8/TorchScript) có thể làm kết quả khác fp32 -> tính vào version
+            model_version="|".join([
+                config.get('OCR_MODEL_VERSION', 'v1'),
+                config.get('OCR_INFERENCE_MODE', 'fp32'),
+                f"ts={int(bool(config.get('OCR_TORCHSCRIPT', False)))}",
+                f"tier={tier or config.get('OCR_DEFAULT_TIER', 'accurate')}"
+            ])
+        )
+
+    def key_for_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return self._versioned(digest)
+
+    def key_for_file(self, file_path, chunk_size=1024 * 1024):
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        return self._versioned(sha.hexdigest())
+
+    def _versioned(self, digest):
+        # Đổi model -> đổi key -> entry cũ tự hết hạn theo LRU/TTL
+        version_hash = hashlib.sha256(self.model_version.encode('utf-8')).hexdigest()[:12]
+        return f"{digest}_{version_hash}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        except Exception as e:
+            print(f" [OCR Cache] Lỗi đọc cache: {e}")
+            return None
+
+        if time.time() - entry.get('created_at', 0) > self.ttl_seconds:
+            self._remove(path)
+            return None
+
+        # Đánh dấu vừa được dùng (LRU)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get('payload')
+
+    def set(self, key, payload):
+        path = self._path(key)
+        # Ghi ra file tạm rồi rename -> không bao giờ đọc phải file ghi dở
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"created_at": time.time(), "payload": payload}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f" [OCR Cache] Lỗi ghi cache: {e}")
+            self._remove(tmp_path)
+            return
+        self.prune()
+
+    def prune(self):
+        """Xóa entry hết hạn, sau đó xóa entry ít dùng nhất cho tới khi dưới max_bytes"""
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # mtime luôn >= created_at nên entry chưa được touch quá TTL chắc chắn đã hết hạn
+            if now - st.st_mtime > self.ttl_seconds:
+                self._remove(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,169 @@
+# server/app/utils/ocr_metrics.py
+"""
+Đo thời gian từng bước của pipeline OCR.
+- OcrJobStats: số liệu của 1 job (thời gian từng stage + bộ đếm + gauge), picklable để trả về từ pool worker.
+- OcrMetrics: gộp số liệu của mọi job trong process thành histogram độ trễ + tổng bộ đếm + giá trị gauge mới nhất,
+  phục vụ endpoint /ocr-metrics. Mỗi process API giữ registry riêng.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# Mốc histogram độ trễ (giây)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+
+class OcrJobStats:
+    def __init__(self):
+        self.stages = {}   # tên stage -> tổng số giây
+        self.counts = {}   # tên bộ đếm -> giá trị
+        self.gauges = {}   # tên gauge -> giá trị tức thời (vd: tỉ lệ bận của từng stage pipeline)
+
+    @contextmanager
+    def stage(self, name):
+        """with stats.stage("detection"): ...  (cộng dồn nếu stage chạy nhiều lần, vd: nhiều trang PDF)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def merge(self, other):
+        """Gộp số liệu từ OcrJobStats hoặc dict (kết quả to_dict() trả về từ worker)"""
+        if other is None:
+            return
+        data = other.to_dict() if isinstance(other, OcrJobStats) else other
+        for name, seconds in data.get("stages", {}).items():
+            self.add_time(name, seconds)
+        for name, value in data.get("counts", {}).items():
+            self.count(name, value)
+        self.gauges.update(data.get("gauges", {}))
+
+    def to_dict(self):
+        return {
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "counts": dict(self.counts),
+            "gauges": dict(self.gauges)
+        }
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+
+    def quantile(self, q):
+        """Ước lượng phân vị từ bucket (lấy cận trên của bucket chứa phân vị)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        for upper, cumulative in zip(self.buckets, self.bucket_counts):
+            if cumulative >= target:
+                return upper
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {str(b): c for b, c in zip(self.buckets, self.bucket_counts)}
+        }
+
+
+class OcrMetrics:
+    _lock = threading.Lock()
+    _histograms = {}
+    _counters = {}
+    _gauges = {}
+    _jobs = 0
+
+    @staticmethod
+    def observe(stats):
+        """Ghi nhận số liệu của 1 job đã hoàn tất"""
+        data = stats.to_dict() if isinstance(stats, OcrJobStats) else stats
+        with OcrMetrics._lock:
+            OcrMetrics._jobs += 1
+            for name, seconds in data.get("stages", {}).items():
+                if name not in OcrMetrics._histograms:
+                    OcrMetrics._histograms[name] = _Histogram(LATENCY_BUCKETS)
+                OcrMetrics._histograms[name].observe(seconds)
+            for name, value in data.get("counts", {}).items():
+                OcrMetrics._counters[name] = OcrMetrics._counters.get(name, 0) + value
+            OcrMetrics._gauges.update(data.get("gauges", {}))
+
+    @staticmethod
+    def snapshot():
+        with OcrMetrics._lock:
+            counters = dict(OcrMetrics._counters)
+            return {
+                "jobs": OcrMetrics._jobs,
+                "stages": {k: h.to_dict() for k, h in OcrMetrics._histograms.items()},
+                "counters": counters,
+                "gauges": dict(OcrMetrics._gauges),
+                "templates": OcrMetrics._template_summary(counters)
+            }
+
+    @staticmethod
+    def _template_summary(counters):
+        """Tỉ lệ trang dùng được mẫu bố cục (bỏ qua LayoutLMv3) + tổng thời gian ước tính tiết kiệm được"""
+        hits = counters.get("template_hits", 0)
+        lookups = hits + counters.get("template_misses", 0) + counters.get("template_fallbacks", 0)
+        return {
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "hits": hits,
+            "fallbacks": counters.get("template_fallbacks", 0),
+            "learned": counters.get("template_learned", 0),
+            "saved_seconds": round(counters.get("template_saved_ms", 0) / 1000, 3)
+        }
+
+    @staticmethod
+    def render_prometheus():
+        """Định dạng text của Prometheus để scrape trực tiếp"""
+        with OcrMetrics._lock:
+            lines = [
+                "# TYPE ocr_jobs_total counter",
+                f"ocr_jobs_total {OcrMetrics._jobs}",
+                "# TYPE ocr_stage_seconds histogram",
+            ]
+            for name, h in OcrMetrics._histograms.items():
+                for upper, c in zip(h.buckets, h.bucket_counts):
+                    lines.append(f'ocr_stage_seconds_bucket{{stage="{name}",le="{upper}"}} {c}')
+                lines.append(f'ocr_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'ocr_stage_seconds_sum{{stage="{name}"}} {h.total}')
+                lines.append(f'ocr_stage_seconds_count{{stage="{name}"}} {h.count}')
+            lines.append("# TYPE ocr_items_total counter")
+            for name, value in OcrMetrics._counters.items():
+                lines.append(f'ocr_items_total{{name="{name}"}} {value}')
+            lines.append("# TYPE ocr_gauge gauge")
+            for name, value in OcrMetrics._gauges.items():
+                lines.append(f'ocr_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def reset():
+        with OcrMetrics._lock:
+            OcrMetrics._histograms = {}
+            OcrMetrics._counters = {}
+            OcrMetrics._gauges = {}
+            OcrMetrics._jobs = 0
@@ -0,0 +1,121 @@
+# server/app/utils/ocr_uploads.py
+"""
+Xử lý file upload cho OCR:
+- read_upload: đọc file upload vào bộ nhớ theo từng chunk, dừng ngay khi vượt giới hạn dung lượng
+  (giới hạn bộ nhớ của 1 file; chặn body quá lớn khi parse multipart là việc của MAX_CONTENT_LENGTH).
+- persist_upload: chỉ dùng khi cần file trên đĩa (job bất đồng bộ, bật audit).
+- prune_temp_files / maybe_prune_temp_files: dọn file tạm cũ trong uploads/temp_ocr
+  (chỉ file/thư mục do code này tạo, file khác như ảnh mẫu đi kèm repo được giữ nguyên).
+
+Chạy dọn thủ công (từ thư mục server):
+    python -m app.utils.ocr_uploads --max-age-hours 24
+"""
+import os
+import re
+import time
+import uuid
+import shutil
+import argparse
+import threading
+from werkzeug.utils import secure_filename
+
+CHUNK_SIZE = 64 * 1024
+
+# Tên do persist_upload ("<uuid hex>_<tên file>") và OcrBatchService ("batch_<uuid hex>") tạo ra
+TEMP_NAME_RE = re.compile(r'^(?:[0-9a-f]{32}_.+|batch_[0-9a-f]{32})$')
+
+
+class UploadTooLargeError(ValueError):
+    """File upload vượt OCR_MAX_UPLOAD_BYTES -> API trả 413"""
+    pass
+
+
+def read_upload(file_storage, max_bytes):
+    """Đọc FileStorage vào bytes, raise UploadTooLargeError khi vượt max_bytes (không nạp hết file vào bộ nhớ)"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = file_storage.stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise UploadTooLargeError(f"File vượt quá dung lượng cho phép ({max_bytes // (1024 * 1024)} MB)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def temp_dir(config):
+    return os.path.join(config['UPLOAD_FOLDER'], 'temp_ocr')
+
+
+def persist_upload(data, filename, folder, prefix=None):
+    """Ghi bytes ra folder với tên duy nhất (upload trùng tên không ghi đè nhau) -> đường dẫn"""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{prefix or uuid.uuid4().hex}_{secure_filename(filename)}")
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def prune_temp_files(folder, max_age_seconds):
+    """Xóa file/thư mục batch do OCR tạo trong folder có mtime cũ hơn max_age_seconds -> số mục đã xóa"""
+    if not os.path.isdir(folder):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for name in os.listdir(folder):
+        if not TEMP_NAME_RE.match(name):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            if os.stat(path).st_mtime > cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+def maybe_prune_temp_files(config):
+    """Gọi ở mỗi request upload: tối đa 1 lần mỗi OCR_JANITOR_INTERVAL giây, chạy trên thread nền"""
+    global _last_prune
+    interval = config.get('OCR_JANITOR_INTERVAL', 600)
+    with _prune_lock:
+        now = time.monotonic()
+        if _last_prune and now - _last_prune < interval:
+            return
+        _last_prune = now
+
+    folder = temp_dir(config)
+    max_age = config.get('OCR_TEMP_MAX_AGE', 24 * 3600)
+
+    def run():
+        removed = prune_temp_files(folder, max_age)
+        if removed:
+            print(f" [OCR Janitor] Đã xóa {removed} file tạm cũ trong {folder}")
+
+    threading.Thread(target=run, name='ocr-janitor', daemon=True).start()
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Xóa file tạm OCR cũ trong uploads/temp_ocr")
+    parser.add_argument("--max-age-hours", type=float, default=Config.OCR_TEMP_MAX_AGE / 3600)
+    args = parser.parse_args()
+
+    folder = os.path.join(Config.UPLOAD_FOLDER, 'temp_ocr')
+    removed = prune_temp_files(folder, args.max_age_hours * 3600)
+    print(f"Đã xóa {removed} mục trong {folder}")
+
+
+if __name__ == "__main__":
+    main()
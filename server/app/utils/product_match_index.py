@@ -0,0 +1,204 @@
+# server/app/utils/product_match_index.py
+"""
+Index fuzzy matching trong bộ nhớ cho toàn bộ danh mục sản phẩm (thay cho 1 truy vấn MongoDB mỗi dòng OCR).
+- Tên không dấu của mọi sản phẩm nằm liên tiếp trong 1 list theo slot (đã qua default_process của RapidFuzz,
+  giống bước tiền xử lý mặc định của thefuzz).
+- Chỉ mục ngược trigram (3 ký tự liên tiếp) trên tên không dấu + SKU: trigram -> array('i') các slot chứa nó.
+  Lỗi OCR chỉ làm hỏng vài trigram ("banh" -> "banb" vẫn giữ " ba", "ban") nên vẫn tìm ra ứng viên.
+- Tìm kiếm 2 bước: lấy top max_candidates slot theo độ trùng trigram (hệ số Dice),
+  sau đó chấm lại bằng WRatio (process.cdist) chỉ trên các ứng viên này.
+- Cập nhật từng sản phẩm (thêm/sửa) chỉ sửa posting list của trigram liên quan.
+Module chỉ lưu trữ + chấm điểm; chuẩn hóa tên và quyết định AUTO/SUGGESTION/NEW nằm ở SearchService.
+"""
+import time
+import threading
+from array import array
+
+import numpy as np
+from rapidfuzz import process, fuzz, utils
+
+# Số ứng viên (theo độ trùng trigram) được chấm lại bằng WRatio cho mỗi câu truy vấn
+DEFAULT_MAX_CANDIDATES = 50
+
+
+def prepare_choice(name_clean):
+    """Tiền xử lý tên giống thefuzz (chữ thường, bỏ ký tự đặc biệt) trước khi chấm điểm"""
+    return utils.default_process(name_clean or "")
+
+
+def trigrams(text):
+    """Tập trigram của chuỗi đã prepare_choice (thêm khoảng trắng 2 đầu để từ ngắn/đầu từ cũng có trigram)"""
+    if not text:
+        return set()
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def best_choices(queries_clean, choices, allowed=None):
+    """
+    Chấm WRatio cả ma trận truy vấn x ứng viên trong 1 lần gọi cdist.
+    choices đã qua prepare_choice. allowed (tùy chọn): list cùng thứ tự queries, mỗi phần tử là tập vị trí
+    ứng viên được phép chọn cho câu truy vấn đó.
+    Trả về list cùng thứ tự queries: (vị trí ứng viên tốt nhất, điểm làm tròn như thefuzz).
+    """
+    if not queries_clean or not choices:
+        return [(None, 0)] * len(queries_clean)
+    queries = [prepare_choice(q) for q in queries_clean]
+    scores = process.cdist(queries, choices, scorer=fuzz.WRatio, dtype=np.float32, workers=-1)
+    if allowed is not None:
+        mask = np.zeros(scores.shape, dtype=bool)
+        for row, positions in enumerate(allowed):
+            mask[row, list(positions)] = True
+        scores[~mask] = -1
+    best = scores.argmax(axis=1)
+    return [
+        (int(slot), int(round(float(scores[row, slot])))) if scores[row, slot] >= 0 else (None, 0)
+        for row, slot in enumerate(best)
+    ]
+
+
+class ProductMatchIndex:
+    _lock = threading.RLock()
+    _choices = []        # slot -> tên đã default_process
+    _names_clean = []    # slot -> tên không dấu gốc (dùng cho strict check + phạt độ dài)
+    _products = []       # slot -> {"id", "name", "sku"}
+    _grams = []          # slot -> tập trigram của slot (để gỡ khỏi posting list khi sửa/xóa)
+    _gram_counts = array('i')  # slot -> số trigram (mẫu số của hệ số Dice)
+    _postings = {}       # trigram -> array('i') các slot
+    _slots = {}          # product id -> slot
+    _loaded_at = None
+    max_candidates = DEFAULT_MAX_CANDIDATES
+
+    @staticmethod
+    def is_loaded(max_age=None):
+        loaded_at = ProductMatchIndex._loaded_at
+        if loaded_at is None:
+            return False
+        return not max_age or time.monotonic() - loaded_at < max_age
+
+    @staticmethod
+    def _product_grams(name_clean, sku):
+        return trigrams(prepare_choice(name_clean)) | trigrams(prepare_choice(sku))
+
+    @staticmethod
+    def load(entries):
+        """Thay toàn bộ index. entries: iterable (product_id, name, name_clean, sku)"""
+        choices, names_clean, products, grams, slots = [], [], [], [], {}
+        gram_counts = array('i')
+        postings = {}
+        for product_id, name, name_clean, sku in entries:
+            slot = len(products)
+            slots[product_id] = slot
+            choices.append(prepare_choice(name_clean))
+            names_clean.append(name_clean or "")
+            products.append({"id": product_id, "name": name, "sku": sku})
+            product_grams = ProductMatchIndex._product_grams(name_clean, sku)
+            grams.append(product_grams)
+            gram_counts.append(len(product_grams))
+            for gram in product_grams:
+                postings.setdefault(gram, array('i')).append(slot)
+
+        with ProductMatchIndex._lock:
+            ProductMatchIndex._choices = choices
+            ProductMatchIndex._names_clean = names_clean
+            ProductMatchIndex._products = products
+            ProductMatchIndex._grams = grams
+            ProductMatchIndex._gram_counts = gram_counts
+            ProductMatchIndex._postings = postings
+            ProductMatchIndex._slots = slots
+            ProductMatchIndex._loaded_at = time.monotonic()
+        print(f" [Search Index] Đã load {len(products)} sản phẩm / {len(postings)} trigram vào index.")
+
+    @staticmethod
+    def _unindex(slot):
+        """Gỡ slot khỏi posting list của các trigram cũ (gọi trong lock)"""
+        postings = ProductMatchIndex._postings
+        for gram in ProductMatchIndex._grams[slot]:
+            posting = postings.get(gram)
+            if posting is None:
+                continue
+            remaining = array('i', (s for s in posting if s != slot))
+            if remaining:
+                postings[gram] = remaining
+            else:
+                del postings[gram]
+        ProductMatchIndex._grams[slot] = set()
+        ProductMatchIndex._gram_counts[slot] = 0
+
+    @staticmethod
+    def upsert(product_id, name, name_clean, sku):
+        """Thêm mới hoặc cập nhật 1 sản phẩm (bỏ qua khi index chưa load, lần load đầu sẽ lấy dữ liệu mới nhất)"""
+        with ProductMatchIndex._lock:
+            if ProductMatchIndex._loaded_at is None:
+                return
+            slot = ProductMatchIndex._slots.get(product_id)
+            if slot is None:
+                slot = len(ProductMatchIndex._products)
+                ProductMatchIndex._slots[product_id] = slot
+                ProductMatchIndex._choices.append("")
+                ProductMatchIndex._names_clean.append("")
+                ProductMatchIndex._products.append(None)
+                ProductMatchIndex._grams.append(set())
+                ProductMatchIndex._gram_counts.append(0)
+            else:
+                ProductMatchIndex._unindex(slot)
+
+            product_grams = ProductMatchIndex._product_grams(name_clean, sku)
+            for gram in product_grams:
+                # Slot mới nằm cuối -> posting list vẫn tăng dần; slot cũ thì thứ tự không quan trọng với bincount
+                ProductMatchIndex._postings.setdefault(gram, array('i')).append(slot)
+            ProductMatchIndex._grams[slot] = product_grams
+            ProductMatchIndex._gram_counts[slot] = len(product_grams)
+            ProductMatchIndex._choices[slot] = prepare_choice(name_clean)
+            ProductMatchIndex._names_clean[slot] = name_clean or ""
+            ProductMatchIndex._products[slot] = {"id": product_id, "name": name, "sku": sku}
+
+    @staticmethod
+    def _candidates(query_grams):
+        """Top max_candidates slot theo hệ số Dice của tập trigram (gọi trong lock) -> list slot"""
+        postings = [ProductMatchIndex._postings[g] for g in query_grams if g in ProductMatchIndex._postings]
+        if not postings:
+            return []
+        n_slots = len(ProductMatchIndex._products)
+        hits = np.concatenate([np.frombuffer(p, dtype=np.intc) for p in postings])
+        overlap = np.bincount(hits, minlength=n_slots)
+        gram_counts = np.frombuffer(ProductMatchIndex._gram_counts, dtype=np.intc)
+        dice = 2.0 * overlap / (len(query_grams) + gram_counts + 1e-9)
+
+        k = min(ProductMatchIndex.max_candidates, n_slots)
+        top = np.argpartition(-dice, k - 1)[:k] if k < n_slots else np.arange(n_slots)
+        return [int(slot) for slot in top if overlap[slot] > 0]
+
+    @staticmethod
+    def best_matches(queries_clean):
+        """
+        Trigram -> ứng viên của từng câu truy vấn (tên không dấu), rồi chấm WRatio mọi câu truy vấn với
+        hợp các ứng viên trong 1 lần gọi cdist (mỗi câu chỉ được chọn trong ứng viên của chính nó).
+        Trả về list cùng thứ tự: (product, điểm WRatio làm tròn như thefuzz, tên không dấu của sản phẩm) hoặc None.
+        """
+        with ProductMatchIndex._lock:
+            per_query = [ProductMatchIndex._candidates(trigrams(prepare_choice(q))) for q in queries_clean]
+            union = sorted({slot for slots in per_query for slot in slots})
+            choices = [ProductMatchIndex._choices[slot] for slot in union]
+            names_clean = [ProductMatchIndex._names_clean[slot] for slot in union]
+            products = [ProductMatchIndex._products[slot] for slot in union]
+
+        position = {slot: i for i, slot in enumerate(union)}
+        allowed = [{position[slot] for slot in slots} for slots in per_query]
+        results = []
+        for i, score in best_choices(queries_clean, choices, allowed):
+            product = products[i] if i is not None else None
+            results.append((product, score, names_clean[i]) if product and score > 0 else None)
+        return results
+
+    @staticmethod
+    def stats():
+        with ProductMatchIndex._lock:
+            return {
+                "products": len(ProductMatchIndex._slots),
+                "slots": len(ProductMatchIndex._products),
+                "trigrams": len(ProductMatchIndex._postings),
+                "postings": sum(len(p) for p in ProductMatchIndex._postings.values()),
+                "age_seconds": round(time.monotonic() - ProductMatchIndex._loaded_at, 1)
+                if ProductMatchIndex._loaded_at is not None else None
+            }
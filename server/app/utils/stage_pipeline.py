@@ -0,0 +1,116 @@
+# server/app/utils/stage_pipeline.py
+"""
+Executor nhiều stage chạy gối nhau (pipeline) trên thread, nối bằng hàng đợi có giới hạn.
+- Mỗi stage có 1 hoặc nhiều thread riêng: trong khi stage sau xử lý item N, stage trước đã làm item N+1.
+  Có lợi khi các stage là code nhả GIL (OpenCV, Paddle, torch).
+- Hàng đợi giữa 2 stage có giới hạn queue_size -> stage nhanh không chạy trước quá xa, submit() bị chặn
+  khi stage đầu đã đầy (backpressure).
+- submit(item) -> Future; stage lỗi thì Future nhận exception và item bỏ qua các stage còn lại.
+- utilization(): tỉ lệ thời gian bận của từng stage trong window_seconds gần nhất.
+"""
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+class _Stage:
+    def __init__(self, name, fn, workers, queue_size):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.busy_seconds = 0.0
+        self.items = 0
+        # (bắt đầu, kết thúc) của các lần xử lý gần đây -> tính utilization theo cửa sổ thời gian
+        self.intervals = deque()
+
+
+class StagePipeline:
+    def __init__(self, stages, queue_size=4, name="stage-pipeline", window_seconds=60):
+        """stages: list (tên, fn(item) -> item cho stage sau, số thread)"""
+        self.name = name
+        self.window_seconds = window_seconds
+        self._stages = [_Stage(n, fn, workers, queue_size) for n, fn, workers in stages]
+        self._lock = threading.Lock()
+        self._started = None
+
+    def submit(self, item):
+        """Đưa item vào stage đầu (chặn khi hàng đợi đầy) -> Future nhận kết quả của stage cuối"""
+        self._ensure_threads()
+        future = Future()
+        self._stages[0].queue.put((item, future))
+        return future
+
+    def _ensure_threads(self):
+        if self._started is None:
+            with self._lock:
+                if self._started is None:
+                    for index, stage in enumerate(self._stages):
+                        for i in range(stage.workers):
+                            threading.Thread(
+                                target=self._loop, args=(index,),
+                                name=f"{self.name}-{stage.name}-{i}", daemon=True
+                            ).start()
+                    self._started = time.monotonic()
+
+    def _loop(self, index):
+        stage = self._stages[index]
+        next_stage = self._stages[index + 1] if index + 1 < len(self._stages) else None
+        while True:
+            item, future = stage.queue.get()
+            start = time.monotonic()
+            try:
+                result = stage.fn(item)
+            except BaseException as e:
+                future.set_exception(e)
+                result = future = None
+            finally:
+                end = time.monotonic()
+                with self._lock:
+                    stage.busy_seconds += end - start
+                    stage.items += 1
+                    stage.intervals.append((start, end))
+                    self._trim(stage, end)
+
+            if future is None:
+                continue
+            if next_stage is None:
+                future.set_result(result)
+            else:
+                next_stage.queue.put((result, future))
+
+    def _trim(self, stage, now):
+        cutoff = now - self.window_seconds
+        while stage.intervals and stage.intervals[0][1] < cutoff:
+            stage.intervals.popleft()
+
+    def utilization(self):
+        """Stage -> tỉ lệ bận (0-1) trong window_seconds gần nhất (chia cho số thread của stage)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._started is None:
+                return {stage.name: 0.0 for stage in self._stages}
+            window = min(self.window_seconds, now - self._started) or 1e-9
+            cutoff = now - window
+            result = {}
+            for stage in self._stages:
+                self._trim(stage, now)
+                busy = sum(end - max(start, cutoff) for start, end in stage.intervals if end > cutoff)
+                result[stage.name] = round(min(1.0, busy / (window * stage.workers)), 4)
+            return result
+
+    def stats(self):
+        utilization = self.utilization()
+        with self._lock:
+            return {
+                stage.name: {
+                    "workers": stage.workers,
+                    "items": stage.items,
+                    "busy_seconds": round(stage.busy_seconds, 3),
+                    "queued": stage.queue.qsize(),
+                    "utilization": utilization[stage.name]
+                }
+                for stage in self._stages
+            }
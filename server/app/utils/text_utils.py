@@ -1,27 +1,73 @@
 # server/app/utils/text_utils.py
+"""
+Chuẩn hóa tiếng Việt dùng chung cho index, đồng bộ MongoDB và Smart Search
+(mọi nơi phải cho ra cùng 1 chuỗi name_no_tone với cùng 1 tên sản phẩm).
+- Bỏ dấu bằng bảng str.translate dựng sẵn 1 lần (cả chữ dựng sẵn lẫn dấu tổ hợp U+0300-U+036F).
+- Kết quả: chữ thường, chỉ gồm a-z 0-9, ký tự khác thành khoảng trắng, khoảng trắng liên tiếp gộp làm 1.
+- Chuỗi lặp lại (tên sản phẩm, dòng OCR trùng) lấy từ LRU cache.
+"""
 import re
 import unicodedata
+from functools import lru_cache
+
+NORMALIZE_CACHE_SIZE = 65536
+
+
+def _build_tone_table():
+    table = {}
+    # Toàn bộ chữ Latin có dấu (Latin-1 Supplement, Latin Extended A/B, Latin Extended Additional)
+    for cp in list(range(0x00C0, 0x0250)) + list(range(0x1E00, 0x1F00)):
+        char = chr(cp)
+        base = unicodedata.normalize('NFD', char)[0].lower()
+        if base != char and base.isascii() and base.isalnum():
+            table[cp] = base
+    table[ord('đ')] = 'd'
+    table[ord('Đ')] = 'd'
+    # Dấu tổ hợp (chuỗi đã ở dạng NFD) -> xóa
+    for cp in range(0x0300, 0x0370):
+        table[cp] = None
+    # Ký tự ASCII không phải chữ/số -> khoảng trắng
+    for cp in range(128):
+        if not chr(cp).isalnum():
+            table[cp] = ' '
+    return str.maketrans(table)
+
+
+_TONE_TABLE = _build_tone_table()
+_NON_ASCII_RE = re.compile(r'[^a-z0-9 ]')
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize(text):
+    text = text.lower().translate(_TONE_TABLE)
+    if not text.isascii():
+        # Ký tự hiếm ngoài bảng (chữ Latin khác, ký hiệu Unicode) -> khoảng trắng
+        text = _NON_ASCII_RE.sub(' ', text)
+    return " ".join(text.split())
+
 
 def remove_vietnamese_tones(text):
     """
-    Chuyển đổi chuỗi tiếng Việt có dấu thành không dấu (Chuẩn Unicode).
+    Chuyển đổi chuỗi tiếng Việt có dấu thành không dấu (chữ thường, chỉ giữ chữ, số và 1 khoảng trắng giữa các từ).
+    Ví dụ: "Bánh   Quy-Đậu Phộng (500g)" -> "banh quy dau phong 500g"
     """
     if not text: return ""
-    
-    # 1. Chuyển về chữ thường
-    text = text.lower()
-    
-    # 2. Chuẩn hóa Unicode (Dựng sẵn -> Tổ hợp) để tách dấu ra khỏi chữ
-    text = unicodedata.normalize('NFD', text)
-    
-    # 3. Lọc bỏ các ký tự dấu (non-spacing mark)
-    text = re.sub(r'[\u0300-\u036f]', '', text)
-    
-    # 4. Thay thế chữ Đ/đ đặc biệt (vì NFD không tách được chữ đ)
-    text = text.replace('đ', 'd')
-    
-    # 5. Xóa các ký tự đặc biệt dư thừa, chỉ giữ lại chữ và số
-    # (Tùy chọn: nếu muốn giữ dấu cách thì để \s)
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    
-    return text.strip()
\ No newline at end of file
+    # Chuỗi rất dài (ít khi lặp lại) không đưa vào cache
+    if len(text) > 256:
+        return _normalize.__wrapped__(text)
+    return _normalize(text)
+
+
+def remove_vietnamese_tones_many(texts):
+    """Chuẩn hóa cả list (vd: toàn bộ danh mục khi load index / đồng bộ), phần tử trùng chỉ tính 1 lần"""
+    seen = {}
+    result = []
+    for text in texts:
+        if text not in seen:
+            seen[text] = remove_vietnamese_tones(text)
+        result.append(seen[text])
+    return result
+
+
+def normalize_cache_info():
+    return _normalize.cache_info()
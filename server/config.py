@@ -28,6 +28,148 @@ class Config:
     # Cấu hình thư mục Upload
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
 
+    # Cấu hình OCR
+    # Số vùng chữ VietOCR nhận dạng trong 1 lượt (1 = tắt batching)
+    OCR_REC_BATCH_SIZE = int(os.environ.get('OCR_REC_BATCH_SIZE', 32))
+    # Độ phân giải rasterize từng trang khi upload hóa đơn PDF
+    OCR_PDF_DPI = int(os.environ.get('OCR_PDF_DPI', 200))
+    # Thu nhỏ ảnh để cạnh dài nhất <= giá trị này trước khi detect (0 = giữ nguyên)
+    OCR_MAX_IMAGE_SIDE = int(os.environ.get('OCR_MAX_IMAGE_SIDE', 2000))
+    # Chỉ detect/nhận dạng trong vùng bảng hàng hóa (tìm theo đường kẻ ngang)
+    OCR_TABLE_CROP = os.environ.get('OCR_TABLE_CROP', '1').lower() in ('1', 'true', 'yes')
+    # Cửa sổ trượt LayoutLMv3: độ dài mỗi cửa sổ (token) và số token chồng lấn giữa 2 cửa sổ
+    OCR_LAYOUT_WINDOW = int(os.environ.get('OCR_LAYOUT_WINDOW', 512))
+    OCR_LAYOUT_STRIDE = int(os.environ.get('OCR_LAYOUT_STRIDE', 128))
+    # Chế độ suy luận trên CPU: 'fp32' (mặc định) hoặc 'int8' (dynamic quantization)
+    OCR_INFERENCE_MODE = os.environ.get('OCR_INFERENCE_MODE', 'fp32')
+    # Dùng CNN VietOCR đã trace bằng TorchScript (cache trong final_model_optimized/)
+    OCR_TORCHSCRIPT = os.environ.get('OCR_TORCHSCRIPT', '0').lower() in ('1', 'true', 'yes')
+    # Số job OCR bất đồng bộ chạy song song trong 1 process API
+    OCR_JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', 2))
+    # Thời gian tối đa (giây) giữ kết nối SSE theo dõi 1 job
+    OCR_JOB_STREAM_TIMEOUT = int(os.environ.get('OCR_JOB_STREAM_TIMEOUT', 300))
+    # Lúc khởi động process OCR: job 'running' đã bắt đầu quá N giây (process cũ chết giữa chừng) -> failed
+    OCR_JOB_STALE_SECONDS = int(os.environ.get('OCR_JOB_STALE_SECONDS', 1800))
+
+    # Dòng có cột mà xác suất nhãn LayoutLMv3 thấp hơn ngưỡng này luôn bị đánh dấu cần kiểm tra lại
+    OCR_MIN_LABEL_CONFIDENCE = float(os.environ.get('OCR_MIN_LABEL_CONFIDENCE', 0.5))
+
+    # Micro-batching: gom vùng chữ / cửa sổ LayoutLMv3 của các request chạy đồng thời trên cùng 1 model
+    # (có tác dụng với model singleton dùng chung bởi nhiều thread; mỗi pool worker chỉ chạy 1 job/lần)
+    OCR_MICROBATCH_ENABLED = os.environ.get('OCR_MICROBATCH_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    OCR_MICROBATCH_WAIT_MS = float(os.environ.get('OCR_MICROBATCH_WAIT_MS', 20))
+    OCR_MICROBATCH_MAX_CROPS = int(os.environ.get('OCR_MICROBATCH_MAX_CROPS', 64))
+    OCR_MICROBATCH_MAX_WINDOWS = int(os.environ.get('OCR_MICROBATCH_MAX_WINDOWS', 8))
+
+    # Upload OCR được xử lý trong bộ nhớ; giới hạn dung lượng 1 file
+    OCR_MAX_UPLOAD_BYTES = int(os.environ.get('OCR_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+    # Bật để lưu lại mọi file upload OCR vào uploads/ocr_audit (mặc định không ghi ra đĩa)
+    OCR_AUDIT_UPLOADS = os.environ.get('OCR_AUDIT_UPLOADS', '0').lower() in ('1', 'true', 'yes')
+    # File tạm trong uploads/temp_ocr (job bất đồng bộ, batch) bị xóa sau OCR_TEMP_MAX_AGE giây
+    OCR_TEMP_MAX_AGE = int(os.environ.get('OCR_TEMP_MAX_AGE', 24 * 3600))
+    OCR_JANITOR_INTERVAL = int(os.environ.get('OCR_JANITOR_INTERVAL', 600))
+
+    # Chỉ load DB detector của Paddle (tắt = dựng cả PaddleOCR kèm model rec/cls không dùng tới)
+    OCR_PADDLE_DET_ONLY = os.environ.get('OCR_PADDLE_DET_ONLY', '1').lower() in ('1', 'true', 'yes')
+
+    # Tier OCR chọn theo từng request (?tier=fast). Mỗi tier ghi đè tham số khởi tạo InvoiceRecognizer;
+    # tham số không khai báo lấy theo các giá trị OCR_* ở trên. Các tier dùng chung 1 bản LayoutLMv3 và
+    # DB detector (det_limit_side_len đặt theo từng lần gọi); VietOCR cũng dùng chung khi cùng arch
+    # (greedy hay beam search chọn theo từng tier).
+    OCR_TIERS = {
+        # Cấu hình đầy đủ (mặc định trước khi có tier)
+        # Beam search: chính xác hơn với chữ mờ/dính nhưng nhận dạng từng vùng một (không chạy theo lô)
+        'accurate': {
+            'vietocr_arch': 'vgg_seq2seq',
+            'beamsearch': True,
+            'det_limit_side_len': 960,
+        },
+        # Quét lại nhanh / nhập số lượng lớn: ảnh nhỏ hơn, cửa sổ LayoutLMv3 chồng lấn ít hơn
+        'fast': {
+            'vietocr_arch': 'vgg_seq2seq',
+            'beamsearch': False,
+            'det_limit_side_len': 640,
+            'max_image_side': 1280,
+            'pdf_dpi': 150,
+            'layout_window': 512,
+            'layout_stride': 32,
+        },
+    }
+    OCR_DEFAULT_TIER = os.environ.get('OCR_DEFAULT_TIER', 'accurate')
+    # Các tier được load (mỗi pool worker giữ sẵn model của tất cả các tier này)
+    OCR_ENABLED_TIERS = [t.strip() for t in os.environ.get('OCR_ENABLED_TIERS', 'accurate,fast').split(',') if t.strip()]
+
+    # Cache mẫu bố cục theo nhà cung cấp: học khoảng x của các cột theo dòng tiêu đề bảng,
+    # gặp lại mẫu đã được LayoutLMv3 xác nhận đủ số lần thì gán cột theo vị trí, bỏ qua LayoutLMv3.
+    # Mặc định tắt: mẫu học từ chính output của model (độ tin cậy cao), chưa phải từ phiếu nhập người dùng đã duyệt
+    OCR_TEMPLATE_CACHE = os.environ.get('OCR_TEMPLATE_CACHE', '0').lower() in ('1', 'true', 'yes')
+    OCR_TEMPLATE_PATH = os.environ.get('OCR_TEMPLATE_PATH', os.path.join(UPLOAD_FOLDER, 'ocr_templates.json'))
+    OCR_TEMPLATE_MIN_CONFIRMATIONS = int(os.environ.get('OCR_TEMPLATE_MIN_CONFIRMATIONS', 3))
+    # Tỉ lệ chữ trong bảng phải gán được cột, thấp hơn -> chạy LayoutLMv3
+    OCR_TEMPLATE_MIN_COVERAGE = float(os.environ.get('OCR_TEMPLATE_MIN_COVERAGE', 0.85))
+    # Chỉ học từ kết quả LayoutLMv3 mà mọi dòng có độ tin cậy nhãn >= ngưỡng này
+    OCR_TEMPLATE_LEARN_CONFIDENCE = float(os.environ.get('OCR_TEMPLATE_LEARN_CONFIDENCE', 0.9))
+
+    # Pipeline nhiều stage: preprocess/detection của hóa đơn sau chạy gối với recognition/LayoutLMv3 của hóa đơn trước
+    # (có lợi khi nhiều hóa đơn cùng chạy trên 1 model: upload batch, job bất đồng bộ). Mặc định tắt.
+    # Bật cùng OCR_MICROBATCH_ENABLED thì pipeline được dùng, micro-batching bị tắt (có cảnh báo lúc khởi tạo).
+    OCR_PIPELINE_ENABLED = os.environ.get('OCR_PIPELINE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    OCR_PIPELINE_PREPARE_WORKERS = int(os.environ.get('OCR_PIPELINE_PREPARE_WORKERS', 2))
+    OCR_PIPELINE_QUEUE_SIZE = int(os.environ.get('OCR_PIPELINE_QUEUE_SIZE', 4))
+
+    # Chỉ bật ở các process làm nhiệm vụ OCR: load sẵn model ngay khi create_app()
+    OCR_PRELOAD_MODELS = os.environ.get('OCR_PRELOAD_MODELS', '0').lower() in ('1', 'true', 'yes')
+
+    # Pool process OCR (tắt thì dùng 1 model singleton trong process API như cũ)
+    OCR_POOL_ENABLED = os.environ.get('OCR_POOL_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    OCR_POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE', max(1, (os.cpu_count() or 2) // 2)))
+    OCR_THREADS_PER_WORKER = int(os.environ.get('OCR_THREADS_PER_WORKER', 2))
+    # Thay worker mới sau N job để giới hạn bộ nhớ tăng dần (0 = không giới hạn)
+    OCR_MAX_JOBS_PER_WORKER = int(os.environ.get('OCR_MAX_JOBS_PER_WORKER', 200))
+    # Số job được phép chờ thêm khi tất cả worker đều bận
+    OCR_POOL_QUEUE_SIZE = int(os.environ.get('OCR_POOL_QUEUE_SIZE', 8))
+    # Thời gian (giây) chờ chỗ trống trong hàng đợi trước khi từ chối request
+    OCR_POOL_SUBMIT_TIMEOUT = float(os.environ.get('OCR_POOL_SUBMIT_TIMEOUT', 5))
+    # Thời gian (giây) tối đa cho 1 job OCR trong pool
+    OCR_POOL_JOB_TIMEOUT = float(os.environ.get('OCR_POOL_JOB_TIMEOUT', 180))
+
+    # Upload nhiều hóa đơn 1 lần: số hóa đơn xử lý song song (mặc định = số worker OCR)
+    OCR_BATCH_WORKERS = int(os.environ.get('OCR_BATCH_WORKERS', OCR_POOL_SIZE if OCR_POOL_ENABLED else OCR_JOB_WORKERS))
+    OCR_BATCH_MAX_FILES = int(os.environ.get('OCR_BATCH_MAX_FILES', 100))
+    # Dung lượng tối đa của 1 file sau khi giải nén từ zip
+    OCR_BATCH_MAX_ENTRY_BYTES = int(os.environ.get('OCR_BATCH_MAX_ENTRY_BYTES', 25 * 1024 * 1024))
+    # Tổng dung lượng 1 request upload batch (nhiều file hoặc 1 zip)
+    OCR_BATCH_MAX_UPLOAD_BYTES = int(os.environ.get('OCR_BATCH_MAX_UPLOAD_BYTES', 200 * 1024 * 1024))
+    # Werkzeug từ chối body lớn hơn giá trị này ngay khi parse multipart (413), kể cả upload chunked
+    # không có Content-Length -> request.files không bao giờ spool quá mức này ra đĩa
+    MAX_CONTENT_LENGTH = int(os.environ.get(
+        'MAX_CONTENT_LENGTH', max(OCR_MAX_UPLOAD_BYTES, OCR_BATCH_MAX_UPLOAD_BYTES) + 64 * 1024
+    ))
+
+    # Cache kết quả OCR theo SHA-256 của ảnh (lưu trong UPLOAD_FOLDER/ocr_cache)
+    OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+    OCR_CACHE_TTL = int(os.environ.get('OCR_CACHE_TTL', 7 * 24 * 3600))
+    # Đổi giá trị này mỗi khi thay model/tham số OCR để vô hiệu hóa cache cũ
+    OCR_MODEL_VERSION = os.environ.get('OCR_MODEL_VERSION', 'paddle-det+vietocr-vgg_seq2seq+layoutlmv3-v3')
+
+    # Smart Search: index trigram + fuzzy matching trong bộ nhớ cho toàn bộ danh mục (tắt = chỉ truy vấn $text MongoDB,
+    # không load index)
+    SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    # Khi tắt SEARCH_INDEX_ENABLED: dòng $text không ra ứng viên vẫn tìm lại bằng index trigram
+    # (bật = load index vào bộ nhớ lần đầu cần fallback; tắt = trả NEW luôn)
+    SEARCH_INDEX_FALLBACK = os.environ.get('SEARCH_INDEX_FALLBACK', '0').lower() in ('1', 'true', 'yes')
+    # Load lại toàn bộ index sau N giây (nhận thay đổi từ process API khác; process hiện tại cập nhật ngay)
+    SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', 300))
+    # Số ứng viên (theo độ trùng trigram) được chấm lại bằng WRatio cho mỗi dòng OCR
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 50))
+    # Bản streaming OCR: match theo nhóm N dòng rồi gửi ngay (item đầu tiên không phải chờ match cả hóa đơn)
+    SEARCH_STREAM_CHUNK_SIZE = int(os.environ.get('SEARCH_STREAM_CHUNK_SIZE', 8))
+    # Đồng bộ MySQL -> MongoDB (python -m app.utils.mongo_sync): số dòng mỗi lượt đọc/bulk_write
+    SEARCH_SYNC_CHUNK_SIZE = int(os.environ.get('SEARCH_SYNC_CHUNK_SIZE', 1000))
+    # Đọc lùi lại N giây trước watermark (transaction commit muộn với updated_at cũ hơn vẫn được đồng bộ)
+    SEARCH_SYNC_OVERLAP_SECONDS = int(os.environ.get('SEARCH_SYNC_OVERLAP_SECONDS', 5))
+
     # Cấu hình Google OAuth
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
\ No newline at end of file